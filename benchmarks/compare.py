@@ -0,0 +1,58 @@
+"""Compare two result files of benchmarks/config_pipeline.py.
+
+Usage: python benchmarks/compare.py baseline.json results.json [--threshold 20]
+
+Exits with 1 when a benchmark got slower than the threshold (in percent).
+"""
+import argparse
+import json
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Prints both runs side by side and returns the names of the regressions."""
+    before = {(result["name"], result["size"]): result for result in baseline["results"]}
+    regressions = []
+
+    print(f"baseline: {baseline.get('commit') or '?'} ({baseline.get('created')}), current: {current.get('commit') or '?'} ({current.get('created')})")
+    print(f"{'benchmark':<28} {'size':>6} {'baseline':>12} {'current':>12} {'change':>8}")
+
+    for result in current["results"]:
+        key = (result["name"], result["size"])
+        old = before.get(key)
+
+        if old is None:
+            print(f"{result['name']:<28} {result['size']:>6} {'-':>12} {result['per_op_us']:>10.2f}us {'new':>8}")
+            continue
+
+        change = (result["per_op_us"] - old["per_op_us"]) / old["per_op_us"] * 100 if old["per_op_us"] > 0 else 0.0
+        flag = ""
+
+        if change > threshold:
+            flag = "  << regression"
+            regressions.append(f"{result['name']}[{result['size']}]")
+
+        print(f"{result['name']:<28} {result['size']:>6} {old['per_op_us']:>10.2f}us {result['per_op_us']:>10.2f}us {change:>+7.1f}%{flag}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=20, help="Slowdown in percent that counts as a regression.")
+    args = parser.parse_args()
+
+    regressions = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+
+    if regressions:
+        raise SystemExit(f"Regressions: {', '.join(regressions)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Benchmark the config to discovery path and the state path on synthetic configs.
+
+Runs every benchmark for configs of 10, 1k and 10k function blocks (see
+tools/qbus_config_generator.py) and reports the best time per operation:
+
+    config.validate          validate the config JSON
+    discovery.create         create the discovery messages of every entity
+    discovery.serialize      serialize those messages to JSON
+    discovery.cached         get the messages of every entity from a warm discovery cache
+    config_service.load      load qbusconfig.json, validating it
+    config_service.load_snapshot
+                             load qbusconfig.json from its snapshot
+    config_service.lookup    find every entity by id and by ref id
+    dispatch                 route state messages through Qbha to the real subscribers
+    state.validate           validate entity state payloads
+
+Usage:
+    python benchmarks/config_pipeline.py --output results.json
+    python benchmarks/config_pipeline.py --sizes 10,1000 --compare results.json
+
+--compare prints the change against an earlier result file and exits with 1
+on a regression, see benchmarks/compare.py.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+sys.path.insert(0, os.path.join(_ROOT, "tools"))
+sys.path.insert(0, os.path.join(_ROOT, "benchmarks"))
+
+# Settings are read once, before anything from src is imported
+os.environ["DATA_FOLDER"] = tempfile.mkdtemp(prefix="qbha-bench-")
+os.environ["QBUS_CAPTURE"] = "False"
+
+from compare import compare, load_results  # noqa: E402
+from qbus_config_generator import entity_state, generate_config  # noqa: E402
+
+_RESULTS_VERSION = 1
+_STATE_MESSAGES = 2000
+
+
+class _Bench:
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results: list[dict] = []
+
+
+    def run(self, name: str, size: int, ops: int, fn: Callable[[], object], setup: Callable[[], object] | None = None) -> None:
+        timings = []
+
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        result = {
+            "name": name,
+            "size": size,
+            "ops": ops,
+            "best": best,
+            "median": statistics.median(timings),
+            "per_op_us": best * 1e6 / ops,
+        }
+        self.results.append(result)
+        print(f"{name:<28} {size:>6} {ops:>7} ops {result['per_op_us']:>10.2f}us/op {best * 1000:>10.2f}ms")
+
+
+def bench_config(bench: _Bench, size: int, raw: bytes) -> None:
+    from DiscoveryCache import DiscoveryCache
+    from MqttMessageFactory import MqttMessageFactory
+    from QbusConfigService import QbusConfigService
+    from QbusGateway import create_gateways
+    from QbusHelpers import get_type_adapter
+    from QbusMqttModels.QbusConfig import QbusConfig
+
+    adapter = get_type_adapter(QbusConfig)
+    config = adapter.validate_json(raw)
+    entities = [(entity, controller) for controller in config.devices for entity in controller.functionBlocks]
+    bench.run("config.validate", size, size, lambda: adapter.validate_json(raw))
+
+    gateway = create_gateways()[0]
+    factory = MqttMessageFactory(gateway)
+    messages = []
+
+    def create() -> None:
+        messages.clear()
+
+        for (entity, controller) in entities:
+            message = factory.create_homeassistant_message(entity, controller)
+
+            if message is not None:
+                messages.extend(m for m in (message if isinstance(message, list) else [message]) if m.payload is not None)
+
+    bench.run("discovery.create", size, size, create)
+
+    def serialize() -> None:
+        for message in messages:
+            message.payload.model_dump_json()
+
+    bench.run("discovery.serialize", size, len(messages), serialize)
+
+    folder = tempfile.mkdtemp(prefix="qbha-bench-cache-", dir=os.environ["DATA_FOLDER"])
+    cached = MqttMessageFactory(gateway, DiscoveryCache(folder + "/"))
+
+    for (entity, controller) in entities:
+        cached.create_discovery_messages(entity, controller)
+
+    bench.run("discovery.cached", size, size, lambda: [cached.create_discovery_messages(entity, controller) for (entity, controller) in entities])
+
+    folder = tempfile.mkdtemp(prefix="qbha-bench-config-", dir=os.environ["DATA_FOLDER"]) + "/"
+    QbusConfigService(folder).save(raw, config)
+    snapshot = f"{folder}qbusconfig.snapshot"
+    saved_snapshot = f"{folder}saved.snapshot"
+    shutil.copy(snapshot, saved_snapshot)
+
+    def remove_snapshot() -> None:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+
+    bench.run("config_service.load", size, size, lambda: QbusConfigService(folder).load(), remove_snapshot)
+    bench.run("config_service.load_snapshot", size, size, lambda: QbusConfigService(folder).load(), lambda: shutil.copy(saved_snapshot, snapshot))
+
+    service = QbusConfigService(folder)
+    service.load()
+    ids = [entity.id for (entity, _) in entities]
+    ref_ids = [entity.refId for (entity, _) in entities]
+
+    def lookup() -> None:
+        for id in ids:
+            service.find_entity_by_id(id)
+
+        for ref_id in ref_ids:
+            service.find_entity_with_controller_by_ref_id(ref_id)
+
+    bench.run("config_service.lookup", size, size * 2, lookup)
+
+
+def bench_state(bench: _Bench, size: int, raw: bytes, config: dict) -> None:
+    from fake_mqtt_client import FakeMqttClient, create_message
+    from main import create_subscribers
+    from Qbha import Qbha
+    from QbusHelpers import get_type_adapter
+    from QbusMqttModels.QbusEntityState import QbusEntityState
+    from Scheduler import Scheduler
+    from Settings import DEFAULT_GATEWAY_PREFIX, Settings
+
+    rnd = random.Random(size)
+    entities = [(entity, controller["id"]) for controller in config["devices"] for entity in controller["functionBlocks"]]
+    messages = []
+
+    for _ in range(_STATE_MESSAGES):
+        (entity, controller_id) = rnd.choice(entities)
+        topic = f"{DEFAULT_GATEWAY_PREFIX}/{controller_id}/{entity['id']}/state"
+        messages.append(create_message(topic, json.dumps(entity_state(entity, rnd)).encode()))
+
+    bench.run("state.validate", size, len(messages), lambda: [get_type_adapter(QbusEntityState).validate_json(msg.payload) for msg in messages])
+
+    # The subscribers load the config of the default gateway from the data folder
+    with open(f"{Settings().DataFolder}qbusconfig.json", "wb") as file:
+        file.write(raw)
+
+    for name in ("qbusconfig.snapshot", "discoverycache.json"):
+        if os.path.exists(f"{Settings().DataFolder}{name}"):
+            os.remove(f"{Settings().DataFolder}{name}")
+
+    client = FakeMqttClient()
+    scheduler = Scheduler()
+    subscribers = create_subscribers(client, scheduler)
+    qbha = Qbha(client, subscribers)
+
+    try:
+        qbha._on_message(client, None, messages[0])
+        bench.run("dispatch", size, len(messages), lambda: [qbha._on_message(client, None, msg) for msg in messages])
+    finally:
+        for subscriber in subscribers:
+            subscriber.close()
+
+        scheduler.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma separated numbers of function blocks.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file.")
+    parser.add_argument("--threshold", type=float, default=20, help="Slowdown in percent that counts as a regression.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    bench = _Bench(args.repeat)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    print(f"{'benchmark':<28} {'size':>6} {'ops':>11} {'per op':>14} {'best':>12}")
+
+    for size in sizes:
+        config = generate_config(size)
+        raw = json.dumps(config).encode()
+        bench_config(bench, size, raw)
+        bench_state(bench, size, raw, config)
+
+    results = {
+        "version": _RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": bench.results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    shutil.rmtree(os.environ["DATA_FOLDER"], ignore_errors=True)
+
+    if args.compare:
+        print()
+        regressions = compare(load_results(args.compare), results, args.threshold)
+
+        if regressions:
+            raise SystemExit(f"Regressions: {', '.join(regressions)}.")
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
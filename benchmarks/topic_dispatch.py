@@ -0,0 +1,108 @@
+"""Compare topic dispatch through TopicTrie with the Subscriber._is_match loop.
+
+Usage: python benchmarks/topic_dispatch.py [--subscribers N] [--messages N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from Subscribers.Subscriber import Subscriber  # noqa: E402
+from TopicTrie import TopicTrie  # noqa: E402
+
+
+_PREFIX = "cloudapp/QBUSMQTTGW"
+
+
+class _BenchSubscriber(Subscriber):
+    def __init__(self, topic: str) -> None:
+        super().__init__()
+        self.topic = topic
+
+
+def _create_subscribers(count: int) -> list[Subscriber]:
+    # The real subscriber set, padded with entity specific filters to
+    # simulate large installations.
+    topics = [
+        f"{_PREFIX}/#",
+        "homeassistant/status",
+        f"{_PREFIX}/config",
+        f"{_PREFIX}/+/state",
+        f"{_PREFIX}/+/+/state",
+        f"{_PREFIX}/state",
+    ]
+
+    for i in range(max(0, count - len(topics))):
+        topics.append(f"{_PREFIX}/UL{i % 8}/UL{i}/setState")
+
+    return [_BenchSubscriber(topic) for topic in topics[:count]]
+
+
+def _create_topics(count: int) -> list[str]:
+    rnd = random.Random(42)
+    topics = []
+
+    for _ in range(count):
+        roll = rnd.random()
+
+        if roll < 0.9:
+            topics.append(f"{_PREFIX}/UL{rnd.randrange(8)}/UL{rnd.randrange(1000)}/state")
+        elif roll < 0.95:
+            topics.append(f"{_PREFIX}/UL{rnd.randrange(8)}/state")
+        else:
+            topics.append("homeassistant/status")
+
+    return topics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=6)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    subscribers = _create_subscribers(args.subscribers)
+    topics = _create_topics(args.messages)
+
+    trie: TopicTrie[int] = TopicTrie()
+
+    for index, subscriber in enumerate(subscribers):
+        for topic in subscriber.get_topics():
+            trie.add(topic, index)
+
+    def linear() -> int:
+        hits = 0
+
+        for topic in topics:
+            for subscriber in subscribers:
+                if subscriber._is_match(topic, subscriber.topic):
+                    hits += 1
+
+        return hits
+
+    def routed() -> int:
+        hits = 0
+
+        for topic in topics:
+            hits += len(sorted(trie.match(topic)))
+
+        return hits
+
+    if linear() != routed():
+        raise SystemExit("Trie and linear dispatch disagree on the number of matches.")
+
+    linear_time = min(timeit.repeat(linear, number=1, repeat=args.repeat))
+    routed_time = min(timeit.repeat(routed, number=1, repeat=args.repeat))
+
+    print(f"subscribers: {len(subscribers)}, messages: {len(topics)}")
+    print(f"_is_match loop: {linear_time * 1e6 / len(topics):8.2f} us/msg")
+    print(f"TopicTrie:      {routed_time * 1e6 / len(topics):8.2f} us/msg")
+    print(f"speedup:        {linear_time / routed_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
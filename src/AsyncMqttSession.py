@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncMqttSession:
+    """Drives a paho client from an asyncio event loop.
+
+    The client socket is registered with the loop, so reads, writes and
+    keepalives run on the loop thread and no network thread is needed.
+    """
+
+    _MISC_INTERVAL = 1
+    _RECONNECT_DELAY_MIN = 1
+    _RECONNECT_DELAY_MAX = 60
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, client: mqtt.Client, loop: asyncio.AbstractEventLoop) -> None:
+        self.client = client
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self._misc: asyncio.Task | None = None
+        self._closed = asyncio.Event()
+        self._stopping = False
+        # Set once the CONNECT packet is queued, connecting resets the packets queued before it
+        self.connected = asyncio.Event()
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+
+    async def run(self, host: str, port: int, keepalive: int = 60) -> None:
+        delay = self._RECONNECT_DELAY_MIN
+
+        while not self._stopping:
+            self._closed.clear()
+            self.connected.clear()
+
+            try:
+                # Off the loop, the DNS lookup and TCP handshake block. paho
+                # registers the new socket with the loop through the socket
+                # callbacks, which hand over to the loop thread.
+                await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+                self.connected.set()
+                delay = self._RECONNECT_DELAY_MIN
+            except OSError as exception:
+                self._logger.warning(f"MQTT connection failed ({exception}), retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._RECONNECT_DELAY_MAX)
+                continue
+
+            await self._closed.wait()
+
+            if not self._stopping:
+                self._logger.debug(f"MQTT connection lost, reconnecting in {delay}s.")
+                await asyncio.sleep(delay)
+
+
+    def stop(self) -> None:
+        self._stopping = True
+        self.client.disconnect()
+        # Flush the disconnect right away, the loop may not run again
+        self.client.loop_write()
+        self._closed.set()
+
+
+    def _on_socket_open(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call(self.loop.add_reader, sock, client.loop_read)
+        self._call(self._start_misc)
+
+
+    def _on_socket_close(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call(self.loop.remove_reader, sock)
+        self._call(self._stop_misc)
+
+
+    def _on_socket_register_write(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+
+    def _on_socket_unregister_write(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call(self.loop.remove_writer, sock)
+
+
+    def _call(self, callback, *args) -> None:
+        # Socket callbacks may fire on another thread, e.g. when a worker publishes
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+
+    def _start_misc(self) -> None:
+        if self._misc is None or self._misc.done():
+            self._misc = self.loop.create_task(self._misc_loop())
+
+
+    def _stop_misc(self) -> None:
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+        self._closed.set()
+
+
+    async def _misc_loop(self) -> None:
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(self._MISC_INTERVAL)
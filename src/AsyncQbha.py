@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import paho.mqtt.client as mqtt
+
+from AsyncMqttSession import AsyncMqttSession
+from Qbha import Qbha, _SubscriberMetrics
+from Subscribers.AsyncSubscriber import AsyncSubscriber, SyncSubscriberAdapter
+from Subscribers.Subscriber import Subscriber
+
+
+class AsyncQbha(Qbha):
+    """Runs the bridge on an asyncio event loop instead of `loop_forever`.
+
+    Subscribers are processed as coroutines. Synchronous subscribers are
+    wrapped in a `SyncSubscriberAdapter`. Messages of the same topic are
+    processed in order, different topics run concurrently.
+    """
+
+    def __init__(self, client: mqtt.Client, subscribers: list[Subscriber], publish_client: mqtt.Client | None = None) -> None:
+        self.async_subscribers: list[AsyncSubscriber] = []
+        self._session: AsyncMqttSession | None = None
+        self._tails: dict[str, asyncio.Task] = {}
+
+        super().__init__(client, subscribers, publish_client=publish_client)
+
+
+    def add_subscribers(self, subscribers: list[Subscriber]) -> None:
+        super().add_subscribers(subscribers)
+
+        self.async_subscribers.extend(
+            subscriber if isinstance(subscriber, AsyncSubscriber) else SyncSubscriberAdapter(subscriber)
+            for subscriber in subscribers
+        )
+
+        # The connect runs off the loop, the CONNACK may have been read already
+        if self.mqtt_client.is_connected():
+            self._subscribe(self.mqtt_client, subscribers)
+
+
+    def start(self) -> None:
+        asyncio.run(self.run())
+
+
+    async def run(self) -> None:
+        self._configure_client()
+        session = self._get_session()
+
+        try:
+            await session.run(self._settings.MqttHost, self._settings.MqttPort, 60)
+        finally:
+            session.stop()
+
+
+    async def wait_connected(self) -> None:
+        """Waits until the CONNECT packet is queued, messages published before it would be lost."""
+        await self._get_session().connected.wait()
+
+
+    def stop(self) -> None:
+        if self._session is not None:
+            self._session.stop()
+
+
+    def _get_session(self) -> AsyncMqttSession:
+        if self._session is None:
+            self._session = AsyncMqttSession(self.mqtt_client, asyncio.get_running_loop())
+
+        return self._session
+
+
+    def _on_message(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        indexes = self._router.match(msg.topic)
+
+        if not indexes:
+            return
+
+        indexes = sorted(indexes)
+        previous = self._tails.get(msg.topic)
+
+        # Fast path: nothing pending for this topic and no real coroutines,
+        # so the message can be handled right away without creating a task.
+        if previous is None and all(isinstance(self.async_subscribers[index], SyncSubscriberAdapter) for index in indexes):
+            for index in indexes:
+                try:
+                    self._process(self.subscribers[index], self._metrics[index], msg)
+                except Exception as exception:
+                    self._logger.exception(exception)
+
+            return
+
+        task = asyncio.get_running_loop().create_task(self._dispatch_async(msg, indexes, previous))
+        self._tails[msg.topic] = task
+        task.add_done_callback(lambda t: self._release_tail(msg.topic, t))
+
+
+    def _release_tail(self, topic: str, task: asyncio.Task) -> None:
+        if self._tails.get(topic) is task:
+            del self._tails[topic]
+
+
+    async def _dispatch_async(self, msg: mqtt.MQTTMessage, indexes: list[int], previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            # Keep the order of messages with the same topic
+            await asyncio.wait([previous])
+
+        for index in indexes:
+            subscriber = self.async_subscribers[index]
+            metrics = self._metrics[index]
+
+            try:
+                if isinstance(subscriber, SyncSubscriberAdapter):
+                    self._process(subscriber.subscriber, metrics, msg)
+                else:
+                    await self._process_async(subscriber, metrics, msg)
+            except Exception as exception:
+                self._logger.exception(exception)
+
+
+    async def _process_async(self, subscriber: AsyncSubscriber, metrics: _SubscriberMetrics, msg: mqtt.MQTTMessage) -> None:
+        self._logger.debug(f"Processing {msg.topic} with {metrics.name}.")
+        metrics.messages_in.inc()
+        start = time.perf_counter()
+
+        try:
+            await subscriber.process_async(metrics.client, msg)
+        except ValueError:
+            # pydantic's ValidationError, but also invalid JSON
+            metrics.validation_failures.inc()
+            raise
+        except Exception:
+            metrics.errors.inc()
+            raise
+        finally:
+            metrics.duration.observe(time.perf_counter() - start)
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable
+
+from Scheduler import ScheduledCall
+
+
+class AsyncScheduler:
+    """Scheduler implementation backed by an asyncio event loop.
+
+    Same interface as `Scheduler`, but callbacks run on the loop thread
+    instead of on a dedicated thread.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
+
+    def time(self) -> float:
+        return self._loop.time()
+
+
+    def call_soon(self, callback: Callable[..., Any], *args) -> ScheduledCall:
+        return self.call_later(0, callback, *args)
+
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        return self.call_at(self.time() + max(0, delay), callback, *args)
+
+
+    def call_at(self, when: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        call = ScheduledCall(when, callback, args)
+
+        if threading.get_ident() == self._loop_thread:
+            self._loop.call_at(when, self._run, call)
+        else:
+            self._loop.call_soon_threadsafe(self._loop.call_at, when, self._run, call)
+
+        return call
+
+
+    def close(self) -> None:
+        pass
+
+
+    def _run(self, call: ScheduledCall) -> None:
+        if call.cancelled():
+            return
+
+        try:
+            call.callback(*call.args)
+        except Exception as exception:
+            self._logger.exception(exception)
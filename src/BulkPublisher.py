@@ -0,0 +1,197 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable
+
+import paho.mqtt.client as mqtt
+
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage
+from Metrics import Metrics
+from Scheduler import ScheduledCall, Scheduler
+
+
+class BulkPublish:
+    """A set of messages handed to the BulkPublisher."""
+
+    def __init__(self, client: mqtt.Client, messages: list[DiscoveryMessage], on_complete: Callable[["BulkPublish"], None] | None) -> None:
+        self.client = client
+        self.total = len(messages)
+        self.published = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.cancelled = False
+        self.on_complete = on_complete
+        self.pending: collections.deque[DiscoveryMessage] = collections.deque(messages)
+        self.inflight = 0
+        self._done = threading.Event()
+
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class BulkPublisher:
+    """Publishes large sets of messages with a bounded number in flight.
+
+    A message is in flight until paho reports it as published, for QoS 1
+    and 2 that is when the broker acknowledged it. Publishing pauses while
+    disconnected and messages that could not be sent are retried after the
+    reconnect. All publishing happens on the scheduler thread.
+    """
+
+    _WINDOW = 50
+    _SWEEP_INTERVAL = 1
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, client: mqtt.Client, scheduler: Scheduler) -> None:
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._jobs: collections.deque[BulkPublish] = collections.deque()
+        self._inflight: dict[int, tuple[BulkPublish, DiscoveryMessage, mqtt.MQTTMessageInfo]] = {}
+        self._pump_scheduled = False
+        self._sweep: ScheduledCall | None = None
+
+        client.on_publish = self._on_publish
+
+        metrics = Metrics()
+        metrics.gauge("qbha_bulk_inflight", "Number of bulk published messages waiting for completion.", callback=lambda: len(self._inflight))
+        metrics.gauge("qbha_bulk_pending", "Number of bulk published messages not sent yet.", callback=lambda: sum(len(job.pending) for job in list(self._jobs)))
+        self._published = metrics.counter("qbha_bulk_published_total", "Number of bulk published messages that completed.")
+        self._retried = metrics.counter("qbha_bulk_retries_total", "Number of bulk published messages that were sent again.")
+
+
+    def publish(self, client: mqtt.Client, messages: list[DiscoveryMessage], on_complete: Callable[[BulkPublish], None] | None = None) -> BulkPublish:
+        job = BulkPublish(client, messages, on_complete)
+
+        with self._lock:
+            self._jobs.append(job)
+
+        self._schedule_pump()
+        return job
+
+
+    def _on_publish(self, client: mqtt.Client, userdata, mid: int) -> None:
+        # Runs on the network thread, possibly while paho holds its own locks,
+        # so only bookkeeping here and the next messages go out on the scheduler.
+        with self._lock:
+            item = self._inflight.pop(mid, None)
+
+            if item is None:
+                return
+
+            self._complete(item[0])
+
+        self._schedule_pump()
+
+
+    def _schedule_pump(self) -> None:
+        with self._lock:
+            if self._pump_scheduled:
+                return
+
+            self._pump_scheduled = True
+
+        self._scheduler.call_soon(self._pump)
+
+
+    def _pump(self) -> None:
+        with self._lock:
+            self._pump_scheduled = False
+            self._check_inflight()
+            batch: list[tuple[BulkPublish, DiscoveryMessage]] = []
+
+            for job in self._jobs:
+                if not job.client.is_connected():
+                    break
+
+                while job.pending and not job.cancelled and len(self._inflight) + len(batch) < self._WINDOW:
+                    batch.append((job, job.pending.popleft()))
+                    job.inflight += 1
+
+        # Never publish while holding the lock, paho calls _on_publish with its own lock held
+        sent: list[tuple[BulkPublish, DiscoveryMessage, mqtt.MQTTMessageInfo]] = []
+
+        for (job, message) in batch:
+            (topic, payload, qos, retain) = message
+            sent.append((job, message, job.client.publish(topic, payload, qos, retain)))
+
+        with self._lock:
+            for (job, message, info) in sent:
+                # paho keeps QoS 1 and 2 messages while disconnected and sends them after the reconnect
+                queued = info.rc == mqtt.MQTT_ERR_SUCCESS or info.rc == mqtt.MQTT_ERR_NO_CONN and message[2] > 0
+
+                if not queued:
+                    job.inflight -= 1
+                    job.retries += 1
+                    job.pending.appendleft(message)
+                    self._retried.inc()
+                elif info.is_published():
+                    self._complete(job)
+                else:
+                    self._inflight[info.mid] = (job, message, info)
+
+            self._finish_jobs()
+
+            if self._jobs and self._sweep is None:
+                self._sweep = self._scheduler.call_later(self._SWEEP_INTERVAL, self._on_sweep)
+
+
+    def _on_sweep(self) -> None:
+        with self._lock:
+            self._sweep = None
+
+        self._pump()
+
+
+    def _check_inflight(self) -> None:
+        # Completions that raced with registering the mid, or were reported
+        # before the client had on_publish set, are caught here.
+        for mid, (job, _, info) in list(self._inflight.items()):
+            if info.is_published():
+                del self._inflight[mid]
+                self._complete(job)
+            elif job.cancelled:
+                del self._inflight[mid]
+                job.inflight -= 1
+
+
+    def _complete(self, job: BulkPublish) -> None:
+        job.inflight -= 1
+        job.published += 1
+        self._published.inc()
+
+
+    def _finish_jobs(self) -> None:
+        while self._jobs:
+            job = self._jobs[0]
+
+            if job.inflight > 0 or job.pending and not job.cancelled:
+                return
+
+            self._jobs.popleft()
+            job.finished = time.monotonic()
+
+            if not job.cancelled:
+                rate = job.total / job.duration if job.duration > 0 else 0
+                self._logger.debug(f"Published {job.total} messages in {job.duration:.2f}s ({rate:.0f}/s, {job.retries} retries).")
+
+            job._done.set()
+
+            if job.on_complete is not None:
+                self._scheduler.call_soon(job.on_complete, job)
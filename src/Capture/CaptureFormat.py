@@ -0,0 +1,39 @@
+import struct
+from typing import NamedTuple
+
+# Segment file layout:
+#
+#   header  b"QCAP" + version (u8)
+#   block*  flags (u8), stored length (u32), record count (u32), first and
+#           last timestamp (f64, f64), followed by the stored block data
+#
+# Block data is a sequence of records, optionally zlib compressed as a whole:
+#
+#   record  timestamp (f64), topic length (u16), payload length (u32),
+#           topic (utf-8), payload (raw bytes)
+#
+# Every segment has a JSON lines index next to it with one line per block:
+# offset, length, record count, time range and the controllers it contains.
+
+SEGMENT_EXTENSION = ".qcap"
+INDEX_EXTENSION = ".qidx"
+SEGMENT_MAGIC = b"QCAP"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sB")
+BLOCK_HEADER = struct.Struct("<BIIdd")
+RECORD_HEADER = struct.Struct("<dHI")
+FLAG_ZLIB = 0x01
+
+GATEWAY_KEY = ""
+
+
+class CaptureRecord(NamedTuple):
+    timestamp: float
+    topic: str
+    payload: bytes
+
+
+def controller_of(topic: str) -> str:
+    # cloudapp/QBUSMQTTGW/<controller>/state or .../<controller>/<entity>/state
+    parts = topic.split("/", 4)
+    return parts[2] if len(parts) >= 4 else GATEWAY_KEY
@@ -0,0 +1,118 @@
+import json
+import os
+import zlib
+from typing import Iterator
+
+from Capture.CaptureFormat import BLOCK_HEADER, FLAG_ZLIB, INDEX_EXTENSION, RECORD_HEADER, SEGMENT_EXTENSION, SEGMENT_HEADER, SEGMENT_MAGIC, CaptureRecord, controller_of
+
+
+class CaptureReader:
+    """Reads binary capture segments written by `CaptureWriter`.
+
+    Blocks outside the requested time window, or without messages of the
+    requested controller, are skipped using the index without reading them.
+    """
+
+    def __init__(self, paths: list[str]) -> None:
+        self.segments: list[str] = []
+
+        for path in paths:
+            if os.path.isdir(path):
+                self.segments.extend(
+                    os.path.join(path, file) for file in sorted(os.listdir(path))
+                    if file.endswith(SEGMENT_EXTENSION)
+                )
+            else:
+                self.segments.append(path)
+
+
+    def read(self, start: float | None = None, end: float | None = None, controller: str | None = None) -> Iterator[CaptureRecord]:
+        for segment in self.segments:
+            yield from self._read_segment(segment, start, end, controller)
+
+
+    def _read_segment(self, path: str, start: float | None, end: float | None, controller: str | None) -> Iterator[CaptureRecord]:
+        with open(path, "rb") as file:
+            magic, _ = SEGMENT_HEADER.unpack(file.read(SEGMENT_HEADER.size))
+
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"'{path}' is not a capture segment.")
+
+            for block in self._load_index(path, file):
+                if start is not None and block["t_max"] < start:
+                    continue
+
+                if end is not None and block["t_min"] > end:
+                    continue
+
+                if controller is not None and block.get("controllers") is not None and controller not in block["controllers"]:
+                    continue
+
+                file.seek(block["offset"])
+                header = file.read(BLOCK_HEADER.size)
+
+                if len(header) < BLOCK_HEADER.size:
+                    break
+
+                flags, length, count, _, _ = BLOCK_HEADER.unpack(header)
+                data = file.read(length)
+
+                if len(data) < length:
+                    # Block still being written
+                    break
+
+                if flags & FLAG_ZLIB:
+                    data = zlib.decompress(data)
+
+                for record in self._parse_block(data, count):
+                    if start is not None and record.timestamp < start:
+                        continue
+
+                    if end is not None and record.timestamp > end:
+                        continue
+
+                    if controller is not None and controller_of(record.topic) != controller:
+                        continue
+
+                    yield record
+
+
+    def _load_index(self, path: str, file) -> list[dict]:
+        index_path = path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+
+        if os.path.isfile(index_path):
+            with open(index_path, "r") as index:
+                return [json.loads(line) for line in index if line.strip()]
+
+        # No index, only walk the block headers. Controllers are unknown.
+        blocks = []
+        offset = SEGMENT_HEADER.size
+        file.seek(offset)
+
+        while True:
+            header = file.read(BLOCK_HEADER.size)
+
+            if len(header) < BLOCK_HEADER.size:
+                break
+
+            _, length, count, t_min, t_max = BLOCK_HEADER.unpack(header)
+            blocks.append({"offset": offset, "length": BLOCK_HEADER.size + length, "records": count, "t_min": t_min, "t_max": t_max, "controllers": None})
+            offset += BLOCK_HEADER.size + length
+            file.seek(offset)
+
+        return blocks
+
+
+    def _parse_block(self, data: bytes, count: int) -> Iterator[CaptureRecord]:
+        position = 0
+        view = memoryview(data)
+
+        for _ in range(count):
+            timestamp, topic_length, payload_length = RECORD_HEADER.unpack_from(view, position)
+            position += RECORD_HEADER.size
+            topic = bytes(view[position:position + topic_length]).decode()
+            position += topic_length
+            payload = bytes(view[position:position + payload_length])
+            position += payload_length
+
+            yield CaptureRecord(timestamp, topic, payload)
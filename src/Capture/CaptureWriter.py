@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+from Capture.CaptureFormat import BLOCK_HEADER, FLAG_ZLIB, INDEX_EXTENSION, RECORD_HEADER, SEGMENT_EXTENSION, SEGMENT_HEADER, SEGMENT_MAGIC, SEGMENT_VERSION, controller_of
+
+
+class CaptureWriter:
+    """Appends raw MQTT messages to binary capture segments.
+
+    `append` only puts the message on a queue. A background thread groups
+    records in blocks, writes them to the current segment together with an
+    index entry, and rotates segments when they grow too large.
+    """
+
+    _BLOCK_RECORDS = 1024
+    _BLOCK_BYTES = 256 * 1024
+    _FLUSH_INTERVAL = 5
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, folder: str, *, prefix: str = "qbuscapture", segment_size: int = 10485760, segment_count: int = 5, compress: bool = True) -> None:
+        self.folder = folder
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.segment_count = max(1, segment_count)
+        self.compress = compress
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._segment = None
+        self._index = None
+        self._segment_bytes = 0
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._run, name="qbha-capture", daemon=True)
+        self._thread.start()
+
+
+    def append(self, topic: str, payload: bytes, timestamp: float | None = None) -> None:
+        self._queue.put((time.time() if timestamp is None else timestamp, topic, bytes(payload)))
+
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+    def _run(self) -> None:
+        records: list[tuple[float, str, bytes]] = []
+        size = 0
+        deadline = None
+        closing = False
+
+        while not closing:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                closing = True
+            elif item:
+                records.append(item)
+                size += RECORD_HEADER.size + len(item[1]) + len(item[2])
+
+                if deadline is None:
+                    deadline = time.monotonic() + self._FLUSH_INTERVAL
+
+            if records and (closing or item is False or len(records) >= self._BLOCK_RECORDS or size >= self._BLOCK_BYTES):
+                try:
+                    self._write_block(records)
+                except OSError as exception:
+                    self._logger.error(f"Unable to write capture: {exception}")
+
+                records = []
+                size = 0
+                deadline = None
+
+        self._close_segment()
+
+
+    def _write_block(self, records: list[tuple[float, str, bytes]]) -> None:
+        data = bytearray()
+        controllers: set[str] = set()
+
+        for (timestamp, topic, payload) in records:
+            encoded_topic = topic.encode()
+            data += RECORD_HEADER.pack(timestamp, len(encoded_topic), len(payload))
+            data += encoded_topic
+            data += payload
+            controllers.add(controller_of(topic))
+
+        flags = 0
+        stored = bytes(data)
+
+        if self.compress:
+            flags |= FLAG_ZLIB
+            stored = zlib.compress(stored, 6)
+
+        if self._segment is None or self._segment_bytes >= self.segment_size:
+            self._rotate()
+
+        offset = self._segment_bytes
+        t_min = min(r[0] for r in records)
+        t_max = max(r[0] for r in records)
+
+        self._segment.write(BLOCK_HEADER.pack(flags, len(stored), len(records), t_min, t_max))
+        self._segment.write(stored)
+        self._segment.flush()
+        self._segment_bytes += BLOCK_HEADER.size + len(stored)
+
+        entry = {
+            "offset": offset,
+            "length": BLOCK_HEADER.size + len(stored),
+            "records": len(records),
+            "t_min": t_min,
+            "t_max": t_max,
+            "controllers": sorted(controllers),
+        }
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+
+
+    def _rotate(self) -> None:
+        self._close_segment()
+        os.makedirs(self.folder, exist_ok=True)
+
+        self._sequence += 1
+        name = f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{self._sequence:04d}"
+        path = os.path.join(self.folder, name)
+
+        self._segment = open(path + SEGMENT_EXTENSION, "wb")
+        self._segment.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION))
+        self._segment_bytes = SEGMENT_HEADER.size
+        self._index = open(path + INDEX_EXTENSION, "w")
+
+        self._remove_old_segments()
+
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+
+    def _remove_old_segments(self) -> None:
+        segments = sorted(
+            file for file in os.listdir(self.folder)
+            if file.startswith(self.prefix + "-") and file.endswith(SEGMENT_EXTENSION)
+        )
+
+        for file in segments[:-self.segment_count]:
+            base = os.path.join(self.folder, file[:-len(SEGMENT_EXTENSION)])
+
+            for path in (base + SEGMENT_EXTENSION, base + INDEX_EXTENSION):
+                if os.path.isfile(path):
+                    os.remove(path)
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage
+from Metrics import Metrics
+from Settings import Settings
+
+
+class DiscoveryCache:
+    """Serialized discovery messages per entity, keyed by a fingerprint.
+
+    An entry is reused as long as the fingerprint of its entity, controller
+    and settings is unchanged. The cache is persisted in the data folder so
+    a restart does not rebuild every entity. Not thread safe, it is only
+    used while processing a config.
+    """
+
+    _VERSION = 1
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+    _hits = Metrics().counter("qbha_discovery_cache_hits_total", "Entities whose discovery messages were taken from the cache.")
+    _misses = Metrics().counter("qbha_discovery_cache_misses_total", "Entities whose discovery messages were (re)created.")
+
+
+    def __init__(self, data_folder: str | None = None) -> None:
+        self._path = f"{data_folder or self._settings.DataFolder}discoverycache.json"
+        self._entries: dict[str, tuple[str, list[DiscoveryMessage]]] | None = None
+        self._dirty = False
+
+
+    def get(self, key: str, fingerprint: str) -> list[DiscoveryMessage] | None:
+        entry = self._get_entries().get(key)
+
+        if entry is None or entry[0] != fingerprint:
+            self._misses.inc()
+            return None
+
+        self._hits.inc()
+        return entry[1]
+
+
+    def put(self, key: str, fingerprint: str, messages: list[DiscoveryMessage]) -> None:
+        self._get_entries()[key] = (fingerprint, messages)
+        self._dirty = True
+
+
+    def evict_missing(self, keys: set[str]) -> int:
+        entries = self._get_entries()
+        missing = [key for key in entries if key not in keys]
+
+        for key in missing:
+            del entries[key]
+
+        if missing:
+            self._dirty = True
+
+        return len(missing)
+
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+
+        data = {
+            "version": self._VERSION,
+            "entries": {key: [fingerprint, messages] for key, (fingerprint, messages) in self._get_entries().items()},
+        }
+
+        try:
+            with open(f"{self._path}.tmp", "w") as file:
+                json.dump(data, file)
+
+            os.replace(f"{self._path}.tmp", self._path)
+            self._dirty = False
+        except OSError as exception:
+            self._logger.warning(f"Unable to save discovery cache: {exception}.")
+
+
+    def _get_entries(self) -> dict[str, tuple[str, list[DiscoveryMessage]]]:
+        if self._entries is None:
+            self._entries = self._load()
+
+        return self._entries
+
+
+    def _load(self) -> dict[str, tuple[str, list[DiscoveryMessage]]]:
+        if not os.path.isfile(self._path):
+            return {}
+
+        try:
+            with open(self._path, "r") as file:
+                data = json.load(file)
+
+            if data.get("version") != self._VERSION:
+                return {}
+
+            return {
+                key: (fingerprint, [tuple(message) for message in messages])
+                for key, (fingerprint, messages) in data["entries"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError) as exception:
+            self._logger.warning(f"Ignoring invalid discovery cache: {exception}.")
+            return {}
@@ -0,0 +1,347 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+from typing import Iterable, NamedTuple
+
+from QbusHelpers import parse_ref_id
+from QbusMqttModels.QbusConfigEntity import QbusConfigEntity
+from Settings import Settings
+
+# Domains an entity type can be mapped to, the first one is the default
+_DOMAINS = {
+    "onoff": ("switch", "binary_sensor"),
+}
+_MATCH_KEYS = ("id", "refId", "name", "name_regex", "location", "type")
+_GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+
+class EntityMapping(NamedTuple):
+    domain: str | None = None
+    device_class: str | None = None
+    exclude: bool = False
+    name: str | None = None
+
+
+_DEFAULT_MAPPING = EntityMapping()
+
+
+class _Rule:
+    __slots__ = ("index", "ids", "ref_ids", "names", "name_patterns", "name_prefixes", "locations", "types", "mapping")
+
+    def __init__(self, index: int, mapping: dict) -> None:
+        self.index = index
+        self.ids: frozenset[str] | None = None
+        self.ref_ids: frozenset[str] | None = None
+        self.names: frozenset[str] | None = None
+        self.name_patterns: list[re.Pattern] | None = None
+        # The literal start of every name glob, if none of them starts with a wildcard
+        self.name_prefixes: list[str] | None = None
+        self.locations: frozenset[str] | None = None
+        self.types: frozenset[str] | None = None
+        # Only the keys the rule sets, so later rules can override them one by one
+        self.mapping = mapping
+
+
+    def matches(self, keys: "_EntityKeys") -> bool:
+        return (
+            (self.ids is None or keys.id in self.ids)
+            and (self.ref_ids is None or not self.ref_ids.isdisjoint(keys.ref_ids))
+            and (self.names is None or keys.name in self.names)
+            and (self.name_patterns is None or any(pattern.search(keys.name) for pattern in self.name_patterns))
+            and (self.locations is None or keys.location in self.locations)
+            and (self.types is None or keys.type in self.types)
+        )
+
+
+class _EntityKeys:
+    __slots__ = ("id", "ref_ids", "name", "location", "type")
+
+    def __init__(self, entity: QbusConfigEntity) -> None:
+        self.id = (entity.id or "").upper()
+        self.ref_ids = (entity.refId or "", parse_ref_id(entity.refId))
+        self.name = (entity.name or "").casefold()
+        self.location = (entity.location or "").casefold()
+        self.type = entity.type.lower() if isinstance(entity.type, str) else ""
+
+
+class EntityRules:
+    """Compiled rules that map Qbus entities to Home Assistant entities.
+
+    A rule matches on any combination of id, ref id, name (exact or glob),
+    name regex (searched, case insensitive), location and type, a list of
+    values matches any of them. It sets the domain, device class or name,
+    or excludes the entity. Rules later in the list override earlier ones.
+    For example:
+
+        [
+            {"match": {"location": "Garage", "type": "onoff"}, "domain": "binary_sensor", "device_class": "door"},
+            {"match": {"name": "Test*"}, "exclude": true},
+            {"match": {"refId": "0001/12"}, "name": "{location} {name}"}
+        ]
+
+    Every rule is indexed on its most selective key, so classifying an
+    entity only looks at the rules of its own buckets. Only rules that
+    match on nothing but a name regex or a glob starting with a wildcard
+    are checked for every entity.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, rules: Iterable[dict]) -> None:
+        self._rules: list[_Rule] = []
+        self._by_id: dict[str, list[_Rule]] = {}
+        self._by_ref_id: dict[str, list[_Rule]] = {}
+        self._by_name: dict[str, list[_Rule]] = {}
+        self._by_name_prefix: dict[str, list[_Rule]] = {}
+        self._name_prefix_lengths: list[int] = []
+        self._by_location: dict[str, list[_Rule]] = {}
+        self._by_type: dict[str, list[_Rule]] = {}
+        self._scan: list[_Rule] = []
+
+        for definition in rules:
+            try:
+                rule = self._compile(len(self._rules), definition)
+            except (KeyError, ValueError, re.error) as exception:
+                self._logger.warning(f"Ignoring entity rule {definition!r}: {exception}.")
+                continue
+
+            self._rules.append(rule)
+            self._add_to_index(rule)
+
+        self._name_prefix_lengths = sorted({len(prefix) for prefix in self._by_name_prefix}, reverse=True)
+
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+
+    def classify(self, entity: QbusConfigEntity) -> EntityMapping:
+        if not self._rules:
+            return _DEFAULT_MAPPING
+
+        keys = _EntityKeys(entity)
+        candidates: dict[int, _Rule] = {}
+
+        def add(rules: list[_Rule] | None) -> None:
+            for rule in rules or ():
+                candidates[rule.index] = rule
+
+        add(self._by_id.get(keys.id))
+
+        for ref_id in keys.ref_ids:
+            add(self._by_ref_id.get(ref_id))
+
+        add(self._by_name.get(keys.name))
+
+        for length in self._name_prefix_lengths:
+            if length <= len(keys.name):
+                add(self._by_name_prefix.get(keys.name[:length]))
+
+        add(self._by_location.get(keys.location))
+        add(self._by_type.get(keys.type))
+        add(self._scan)
+
+        mapping: dict = {}
+
+        for index in sorted(candidates):
+            rule = candidates[index]
+
+            if rule.matches(keys):
+                mapping.update(rule.mapping)
+
+        if not mapping:
+            return _DEFAULT_MAPPING
+
+        domain = mapping.get("domain")
+
+        if domain is not None and domain not in _DOMAINS.get(keys.type, ()):
+            domain = None
+
+        name = mapping.get("name")
+
+        if name is not None:
+            name = name.format_map({
+                "id": entity.id or "",
+                "location": entity.location or "",
+                "name": entity.name or "",
+                "refId": entity.refId or "",
+            })
+
+        return EntityMapping(domain, mapping.get("device_class"), mapping.get("exclude", False), name)
+
+
+    def _compile(self, index: int, definition: dict) -> _Rule:
+        if not isinstance(definition, dict) or not isinstance(definition.get("match"), dict):
+            raise ValueError("a rule needs a 'match' object")
+
+        match = definition["match"]
+        unknown = [key for key in match if key not in _MATCH_KEYS]
+
+        if unknown:
+            raise ValueError(f"unknown match keys {unknown}")
+
+        mapping = {key: definition[key] for key in ("domain", "device_class", "exclude", "name") if key in definition}
+
+        if not mapping:
+            raise ValueError("a rule needs a 'domain', 'device_class', 'exclude' or 'name'")
+
+        for key in ("domain", "device_class", "name"):
+            if key in mapping and not isinstance(mapping[key], str):
+                raise ValueError(f"'{key}' should be a string")
+
+        if "exclude" in mapping and not isinstance(mapping["exclude"], bool):
+            raise ValueError("'exclude' should be true or false")
+
+        if "domain" in mapping and not any(mapping["domain"] in domains for domains in _DOMAINS.values()):
+            raise ValueError(f"unsupported domain '{mapping['domain']}'")
+
+        if "name" in mapping:
+            # Fails on unknown fields now instead of for every entity
+            mapping["name"].format_map({"id": "", "location": "", "name": "", "refId": ""})
+
+        rule = _Rule(index, mapping)
+
+        if "id" in match:
+            rule.ids = frozenset(value.upper() for value in self._values(match["id"]))
+
+        if "refId" in match:
+            # Either the full ref id or the short one, like "12" or "12-3"
+            rule.ref_ids = frozenset(self._values(match["refId"]))
+
+        if "name" in match:
+            names = [value.casefold() for value in self._values(match["name"])]
+            globs = [name for name in names if _GLOB_CHARACTERS.search(name)]
+
+            if globs:
+                if len(globs) != len(names):
+                    raise ValueError("a name can not mix exact names and globs")
+
+                rule.name_patterns = [re.compile("^" + fnmatch.translate(name)) for name in globs]
+                prefixes = [name[:_GLOB_CHARACTERS.search(name).start()] for name in globs]
+                rule.name_prefixes = prefixes if all(prefixes) else None
+            else:
+                rule.names = frozenset(names)
+
+        if "name_regex" in match:
+            if rule.name_patterns is not None:
+                raise ValueError("a name glob can not be combined with a name regex")
+
+            rule.name_patterns = [re.compile(value, re.IGNORECASE) for value in self._values(match["name_regex"])]
+
+        if "location" in match:
+            rule.locations = frozenset(value.casefold() for value in self._values(match["location"]))
+
+        if "type" in match:
+            rule.types = frozenset(value.lower() for value in self._values(match["type"]))
+
+        return rule
+
+
+    def _add_to_index(self, rule: _Rule) -> None:
+        # The most selective key of the rule decides its bucket
+        if rule.ids is not None:
+            self._add(self._by_id, rule.ids, rule)
+        elif rule.ref_ids is not None:
+            self._add(self._by_ref_id, rule.ref_ids, rule)
+        elif rule.names is not None:
+            self._add(self._by_name, rule.names, rule)
+        elif rule.name_prefixes is not None:
+            self._add(self._by_name_prefix, rule.name_prefixes, rule)
+        elif rule.locations is not None:
+            self._add(self._by_location, rule.locations, rule)
+        elif rule.types is not None:
+            self._add(self._by_type, rule.types, rule)
+        else:
+            self._scan.append(rule)
+
+
+    def _add(self, index: dict[str, list[_Rule]], keys: Iterable[str], rule: _Rule) -> None:
+        for key in keys:
+            index.setdefault(key, []).append(rule)
+
+
+    def _values(self, value) -> list[str]:
+        values = value if isinstance(value, list) else [value]
+
+        if not values or not all(isinstance(item, str) and item for item in values):
+            raise ValueError(f"invalid match value {value!r}")
+
+        return values
+
+
+class EntityRulesService:
+    """The entity rules of a gateway, from `entityrules.json` in its data folder.
+
+    The `BINARY_SENSORS` setting is compiled into the first rules, so the
+    rules in the file can override it. The rules are recompiled when the
+    file or the setting changes.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+
+
+    def __init__(self, data_folder: str | None = None) -> None:
+        self._path = f"{data_folder or self._settings.DataFolder}entityrules.json"
+        self._version: tuple | None = None
+        self.rules = EntityRules([])
+        self.refresh()
+
+
+    def refresh(self) -> bool:
+        """Recompiles the rules if their sources changed, returns whether they did."""
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            mtime = None
+
+        version = (mtime, tuple(self._settings.BinarySensors))
+
+        if version == self._version:
+            return False
+
+        self._version = version
+        self.rules = EntityRules(self._binary_sensor_rules() + self._load())
+        self._logger.debug(f"Compiled {len(self.rules)} entity rules.")
+
+        return True
+
+
+    def _binary_sensor_rules(self) -> list[dict]:
+        rules = []
+
+        for value in self._settings.BinarySensors:
+            value = value.strip()
+
+            # An id, name or ref id, names are never globs here
+            for key in ("id", "refId"):
+                rules.append({"match": {key: value, "type": "onoff"}, "domain": "binary_sensor"})
+
+            rules.append({"match": {"name": _escape_glob(value), "type": "onoff"}, "domain": "binary_sensor"})
+
+        return rules
+
+
+    def _load(self) -> list[dict]:
+        if not os.path.isfile(self._path):
+            return []
+
+        try:
+            with open(self._path, "r") as file:
+                rules = json.load(file)
+        except (OSError, ValueError) as exception:
+            self._logger.warning(f"Ignoring invalid entity rules: {exception}.")
+            return []
+
+        if not isinstance(rules, list):
+            self._logger.warning("Ignoring entity rules, expected a list of rules.")
+            return []
+
+        return rules
+
+
+def _escape_glob(value: str) -> str:
+    return _GLOB_CHARACTERS.sub(lambda match: f"[{match.group(0)}]", value)
@@ -0,0 +1,139 @@
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+from Metrics import Metrics
+from QbusGateway import QbusGateway
+from QbusHelpers import publish_get_state
+from Scheduler import ScheduledCall, Scheduler
+from Settings import Settings
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Entities a user interacts with are refreshed before plain measurements
+_PRIORITY_BY_TYPE = {
+    "analog": PRIORITY_HIGH,
+    "onoff": PRIORITY_HIGH,
+    "scene": PRIORITY_HIGH,
+    "shutter": PRIORITY_HIGH,
+    "thermo": PRIORITY_HIGH,
+    "gauge": PRIORITY_LOW,
+    "ventilation": PRIORITY_LOW,
+}
+
+
+class GetStateService:
+    """Sends all getState requests to a gateway.
+
+    Requested ids are merged with the ones still pending, sent in chunks,
+    highest priority first, and paced with a token bucket so a large
+    refresh does not flood the gateway.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+
+
+    def __init__(self, client: mqtt.Client, scheduler: Scheduler, gateway: QbusGateway) -> None:
+        self._client = client
+        self._scheduler = scheduler
+        self._gateway = gateway
+        self._chunk_size = self._settings.GetStateChunkSize
+        self._rate = self._settings.GetStateRate
+        self._lock = threading.Lock()
+        # One insertion ordered set of ids per priority
+        self._pending: list[dict[str, None]] = [{}, {}, {}]
+        self._tokens = float(max(1, self._rate))
+        self._refilled = scheduler.time()
+        self._timer: ScheduledCall | None = None
+
+        metrics = Metrics()
+        metrics.gauge("qbha_getstate_pending", "Number of ids waiting to be requested.", gateway.labels, callback=lambda: sum(len(ids) for ids in self._pending))
+        self._merged = metrics.counter("qbha_getstate_merged_total", "Requested ids that were already pending.", gateway.labels)
+
+
+    def request(self, ids: list[str], priority: int | None = None) -> None:
+        with self._lock:
+            for id in ids:
+                id_priority = self._get_priority(id) if priority is None else priority
+                current = self._find(id)
+
+                if current is not None:
+                    self._merged.inc()
+
+                    if current <= id_priority:
+                        continue
+
+                    del self._pending[current][id]
+
+                self._pending[id_priority][id] = None
+
+            if self._timer is None:
+                self._timer = self._scheduler.call_soon(self._send)
+
+
+    def _send(self) -> None:
+        chunks: list[list[str]] = []
+
+        with self._lock:
+            self._timer = None
+            self._refill()
+
+            while self._tokens >= 1 and self._has_pending():
+                chunks.append(self._take_chunk())
+                self._tokens -= 1
+
+            if self._has_pending():
+                delay = (1 - self._tokens) / self._rate
+                self._logger.debug(f"Delaying getState of {sum(len(ids) for ids in self._pending)} ids by {delay:.2f}s.")
+                self._timer = self._scheduler.call_later(delay, self._send)
+
+        for chunk in chunks:
+            publish_get_state(self._client, self._gateway.prefix, chunk)
+
+
+    def _refill(self) -> None:
+        now = self._scheduler.time()
+
+        if self._rate <= 0:
+            self._tokens = float("inf")
+        else:
+            self._tokens = min(float(self._rate), self._tokens + (now - self._refilled) * self._rate)
+
+        self._refilled = now
+
+
+    def _take_chunk(self) -> list[str]:
+        chunk: list[str] = []
+
+        for ids in self._pending:
+            while ids and (self._chunk_size <= 0 or len(chunk) < self._chunk_size):
+                id = next(iter(ids))
+                del ids[id]
+                chunk.append(id)
+
+        return chunk
+
+
+    def _has_pending(self) -> bool:
+        return any(self._pending)
+
+
+    def _find(self, id: str) -> int | None:
+        for priority, ids in enumerate(self._pending):
+            if id in ids:
+                return priority
+
+        return None
+
+
+    def _get_priority(self, id: str) -> int:
+        entity = self._gateway.config.find_entity_by_id(id)
+
+        if entity is None or not isinstance(entity.type, str):
+            return PRIORITY_NORMAL
+
+        return _PRIORITY_BY_TYPE.get(entity.type.lower(), PRIORITY_NORMAL)
@@ -1,5 +1,8 @@
 from HomeAssistantModels.HomeAssistantPayload import HomeAssistantPayload
 
+# Serialized message: (topic, payload, qos, retain)
+DiscoveryMessage = tuple[str, str | None, int, bool]
+
 
 class HomeAssistantMessage:
     topic: str | None = None
@@ -0,0 +1,166 @@
+import collections
+import logging
+import threading
+from typing import Any, Callable, Hashable
+
+from Settings import BACKPRESSURE_BLOCK, BACKPRESSURE_COALESCE, BACKPRESSURE_POLICIES
+
+
+class _Worker:
+    def __init__(self, executor: "KeyedExecutor", index: int) -> None:
+        self.executor = executor
+        # Entries are [key, callback, args] lists so coalescing can replace
+        # the callback and args in place, keeping the position in the queue.
+        self.queue: collections.deque[list] = collections.deque()
+        # The last queued entry per key, only while it may be replaced
+        self.pending: dict[Hashable, list] = {}
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=f"qbha-worker-{index}", daemon=True)
+
+
+    def run(self) -> None:
+        executor = self.executor
+
+        while True:
+            with self.condition:
+                while not self.queue and not executor._closed:
+                    self.condition.wait()
+
+                if executor._closed:
+                    break
+
+                entry = self.queue.popleft()
+                key, callback, args = entry
+
+                if executor.policy == BACKPRESSURE_COALESCE and self.pending.get(key) is entry:
+                    del self.pending[key]
+
+                # Wake up a producer waiting for room
+                self.condition.notify_all()
+
+            try:
+                callback(*args)
+            except Exception as exception:
+                executor._logger.exception(exception)
+
+            with executor._counter_lock:
+                executor._processed += 1
+
+
+class KeyedExecutor:
+    """Bounded thread pool that keeps ordering per key.
+
+    Work items with the same key always run on the same worker, in the order
+    they were submitted. Items with different keys run in parallel.
+
+    With the coalesce policy an item replaces the queued item of its key,
+    as long as both were submitted with `coalesce` set: only an item that
+    fully supersedes the previous one, like a full state, may replace it.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, workers: int, queue_size: int, policy: str = BACKPRESSURE_BLOCK) -> None:
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}'.")
+
+        self.policy = policy
+        self.queue_size = max(1, queue_size)
+
+        self._closed = False
+        self._counter_lock = threading.Lock()
+        self._submitted = 0
+        self._processed = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._max_depth = 0
+
+        self._workers = [_Worker(self, i) for i in range(max(1, workers))]
+
+        for worker in self._workers:
+            worker.thread.start()
+
+
+    def submit(self, key: Hashable, callback: Callable[..., Any], *args, coalesce: bool = True) -> None:
+        if self._closed:
+            return
+
+        worker = self._workers[hash(key) % len(self._workers)]
+        dropped = False
+        coalesced = False
+
+        with worker.condition:
+            if self.policy == BACKPRESSURE_COALESCE:
+                entry = worker.pending.get(key) if coalesce else None
+
+                if entry is not None:
+                    entry[1] = callback
+                    entry[2] = args
+                    coalesced = True
+
+            if not coalesced:
+                if self.policy == BACKPRESSURE_BLOCK:
+                    while len(worker.queue) >= self.queue_size and not self._closed:
+                        worker.condition.wait()
+                elif len(worker.queue) >= self.queue_size:
+                    # Both drop_oldest and coalesce make room by dropping the oldest item
+                    oldest = worker.queue.popleft()
+
+                    if worker.pending.get(oldest[0]) is oldest:
+                        del worker.pending[oldest[0]]
+                    dropped = True
+
+                entry = [key, callback, args]
+                worker.queue.append(entry)
+
+                if self.policy == BACKPRESSURE_COALESCE:
+                    if coalesce:
+                        worker.pending[key] = entry
+                    else:
+                        # Later items must stay behind this one
+                        worker.pending.pop(key, None)
+
+                worker.condition.notify_all()
+
+            depth = len(worker.queue)
+
+        with self._counter_lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, depth)
+
+            if coalesced:
+                self._coalesced += 1
+
+            if dropped:
+                self._dropped += 1
+
+                if self._dropped == 1 or self._dropped % 1000 == 0:
+                    self._logger.warning(f"Worker queue full, {self._dropped} message(s) dropped so far.")
+
+
+    def queue_depths(self) -> list[int]:
+        return [len(worker.queue) for worker in self._workers]
+
+
+    def stats(self) -> dict[str, int]:
+        with self._counter_lock:
+            return {
+                "workers": len(self._workers),
+                "queue_depth": sum(self.queue_depths()),
+                "max_queue_depth": self._max_depth,
+                "submitted": self._submitted,
+                "processed": self._processed,
+                "dropped": self._dropped,
+                "coalesced": self._coalesced,
+            }
+
+
+    def close(self) -> None:
+        self._closed = True
+
+        for worker in self._workers:
+            with worker.condition:
+                worker.condition.notify_all()
+
+        self._logger.debug(f"Worker pool closed: {self.stats()}.")
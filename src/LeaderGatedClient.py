@@ -0,0 +1,50 @@
+import paho.mqtt.client as mqtt
+
+from Metrics import Metrics
+from Subscribers.LeaderElectionSubscriber import LeaderElectionSubscriber
+
+
+class LeaderGatedClient:
+    """Drops publishes while this instance is not the leader, everything else is delegated.
+
+    A dropped message is reported as published, so a standby runs exactly
+    the same code as the leader and keeps its config and caches warm. The
+    will goes to a topic of this instance, so a standby that stops does not
+    take the leader offline.
+    """
+
+    _dropped = Metrics().counter("qbha_leader_dropped_publishes_total", "Messages not published because this instance is a standby.")
+
+
+    def __init__(self, client: mqtt.Client, election: LeaderElectionSubscriber) -> None:
+        self._client = client
+        self._election = election
+
+
+    @property
+    def on_publish(self):
+        return self._client.on_publish
+
+
+    @on_publish.setter
+    def on_publish(self, callback) -> None:
+        self._client.on_publish = callback
+
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> mqtt.MQTTMessageInfo:
+        if self._election.is_leader:
+            return self._client.publish(topic, payload, qos, retain, properties)
+
+        self._dropped.inc()
+        info = mqtt.MQTTMessageInfo(0)
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        info._set_as_published()
+        return info
+
+
+    def will_set(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> None:
+        self._client.will_set(f"{topic}/{self._election.instance_id}", payload, qos, retain, properties)
+
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
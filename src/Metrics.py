@@ -0,0 +1,175 @@
+import bisect
+import threading
+from typing import Callable
+
+_DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value", "callback")
+
+    def __init__(self, callback: Callable[[], float] | None = None) -> None:
+        self.value = 0
+        self.callback = callback
+
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+    def get(self) -> float:
+        return self.callback() if self.callback is not None else self.value
+
+
+class Histogram:
+    __slots__ = ("bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Family:
+    def __init__(self, name: str, type: str, help: str) -> None:
+        self.name = name
+        self.type = type
+        self.help = help
+        self.metrics: dict[tuple[tuple[str, str], ...], Counter | Gauge | Histogram] = {}
+
+
+class Metrics:
+    """Registry of the internal metrics of qbha.
+
+    Metric objects are looked up once and kept by the caller, so recording
+    on the hot path is a plain attribute increment. Updates are not locked,
+    the rare lost increment is an acceptable trade-off.
+    """
+
+    def __new__(cls):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super(Metrics, cls).__new__(cls)
+            cls.instance._lock = threading.Lock()
+            cls.instance._families = {}
+
+        return cls.instance
+
+
+    def counter(self, name: str, help: str, labels: dict[str, str] | None = None) -> Counter:
+        return self._get(name, "counter", help, labels, Counter)
+
+
+    def gauge(self, name: str, help: str, labels: dict[str, str] | None = None, callback: Callable[[], float] | None = None) -> Gauge:
+        gauge = self._get(name, "gauge", help, labels, Gauge)
+
+        if callback is not None:
+            gauge.callback = callback
+
+        return gauge
+
+
+    def histogram(self, name: str, help: str, labels: dict[str, str] | None = None, buckets: tuple[float, ...] = _DEFAULT_BUCKETS) -> Histogram:
+        return self._get(name, "histogram", help, labels, lambda: Histogram(buckets))
+
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+
+        for family in self._snapshot_families():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+
+            for labels, metric in list(family.metrics.items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+
+                    for bound, count in zip(metric.bounds + (float("inf"),), metric.buckets):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{family.name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+
+                    lines.append(f"{family.name}_sum{self._labels(labels)} {metric.sum}")
+                    lines.append(f"{family.name}_count{self._labels(labels)} {metric.count}")
+                elif isinstance(metric, Gauge):
+                    lines.append(f"{family.name}{self._labels(labels)} {metric.get()}")
+                else:
+                    lines.append(f"{family.name}{self._labels(labels)} {metric.value}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def snapshot(self) -> dict:
+        result: dict = {}
+
+        for family in self._snapshot_families():
+            values = []
+
+            for labels, metric in list(family.metrics.items()):
+                item: dict = {"labels": dict(labels)} if labels else {}
+
+                if isinstance(metric, Histogram):
+                    item["count"] = metric.count
+                    item["sum"] = metric.sum
+                elif isinstance(metric, Gauge):
+                    item["value"] = metric.get()
+                else:
+                    item["value"] = metric.value
+
+                values.append(item)
+
+            result[family.name] = values
+
+        return result
+
+
+    def _get(self, name: str, type: str, help: str, labels: dict[str, str] | None, factory):
+        key = tuple(sorted((labels or {}).items()))
+
+        with self._lock:
+            family = self._families.get(name)
+
+            if family is None:
+                family = self._families[name] = _Family(name, type, help)
+            elif family.type != type:
+                raise ValueError(f"Metric '{name}' already registered as {family.type}.")
+
+            metric = family.metrics.get(key)
+
+            if metric is None:
+                metric = family.metrics[key] = factory()
+
+            return metric
+
+
+    def _snapshot_families(self) -> list[_Family]:
+        with self._lock:
+            return sorted(self._families.values(), key=lambda family: family.name)
+
+
+    def _labels(self, labels: tuple[tuple[str, str], ...]) -> str:
+        if not labels:
+            return ""
+
+        return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
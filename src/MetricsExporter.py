@@ -0,0 +1,68 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paho.mqtt.client as mqtt
+
+from Metrics import Metrics
+from Scheduler import Scheduler
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = Metrics().render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class MetricsExporter:
+    """Exposes the metrics as a Prometheus endpoint and/or a periodic MQTT message."""
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, client: mqtt.Client, scheduler: Scheduler, topic: str = "qbha/metrics") -> None:
+        self._client = client
+        self._scheduler = scheduler
+        self._topic = topic
+        self._server: ThreadingHTTPServer | None = None
+        self._interval = 0
+        self._publish_call = None
+
+
+    def start_http(self, port: int, host: str = "127.0.0.1") -> None:
+        self._server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="qbha-metrics", daemon=True).start()
+        self._logger.info(f"Serving metrics on {host}:{port}.")
+
+
+    def start_mqtt(self, interval: int) -> None:
+        self._interval = interval
+        self._publish_call = self._scheduler.call_later(interval, self._publish)
+
+
+    def close(self) -> None:
+        if self._publish_call is not None:
+            self._publish_call.cancel()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+    def _publish(self) -> None:
+        self._client.publish(self._topic, json.dumps(Metrics().snapshot()))
+        self._publish_call = self._scheduler.call_later(self._interval, self._publish)
@@ -1,14 +1,19 @@
+import hashlib
+import json
 import logging
 import re
 
+from DiscoveryCache import DiscoveryCache
+from EntityRules import EntityMapping, EntityRulesService
 from HomeAssistantModels.HomeAssistantDevice import HomeAssistantDevice
-from HomeAssistantModels.HomeAssistantMessage import HomeAssistantMessage
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage, HomeAssistantMessage
 from HomeAssistantModels.HomeAssistantPayload import HomeAssistantPayload
+from QbusGateway import QbusGateway
+from QbusHelpers import parse_ref_id
 from QbusMqttModels.QbusConfigDevice import QbusConfigDevice
 from QbusMqttModels.QbusConfigEntity import QbusConfigEntity
 from Settings import Settings
 
-_REF_ID_REGEX = re.compile(r"^\d+\/(\d+(?:\/\d+)?)$")
 _TO_SNAKE_CASE_REGEX = re.compile(r"(?<=[a-z0-9])([A-Z])")
 
 _SUPPORTED_OUTPUTS = [
@@ -33,18 +38,13 @@ _SUPPORTED_GAUGE_PROPERTIES = [
     "consumptionValue",
     "currentValue",
 ]
-
-
-def _parse_ref_id(ref_id: str) -> str:
-    matches = re.findall(_REF_ID_REGEX, ref_id)
-
-    if len(matches) > 0:
-        ref_id = matches[0]
-
-        if ref_id:
-            return ref_id.replace("/", "-")
-
-    return ""
+# Domains of the created messages that have a device class in Home Assistant
+_DEVICE_CLASS_DOMAINS = [
+    "binary_sensor",
+    "cover",
+    "sensor",
+    "switch",
+]
 
 
 def _to_snake_case(key: str) -> str:
@@ -57,7 +57,65 @@ class MqttMessageFactory:
     _logger = logging.getLogger("qbha." + __name__)
     _settings = Settings()
 
-    def create_homeassistant_message(self, entity: QbusConfigEntity, controller: QbusConfigDevice) -> HomeAssistantMessage | list[HomeAssistantMessage] | None:
+    def __init__(self, gateway: QbusGateway, cache: DiscoveryCache | None = None, rules: EntityRulesService | None = None) -> None:
+        self.gateway = gateway
+        self.cache = cache
+        self.rules = rules or EntityRulesService(gateway.data_folder)
+
+
+    def create_discovery_messages(self, entity: QbusConfigEntity, controller: QbusConfigDevice, changed_only: bool = False) -> list[DiscoveryMessage] | None:
+        key = f"{controller.id}/{entity.id}"
+        mapping = self.rules.rules.classify(entity)
+        fingerprint = self._fingerprint(entity, controller, mapping)
+
+        if self.cache is not None:
+            messages = self.cache.get(key, fingerprint)
+
+            if messages is not None:
+                return [] if changed_only else messages
+
+        message = self.create_homeassistant_message(entity, controller, mapping)
+
+        if message is None:
+            return None
+
+        messages = [
+            (m.topic, None if m.payload is None else m.payload.model_dump_json(), m.qos, m.retain)
+            for m in (message if isinstance(message, list) else [message])
+        ]
+
+        if self.cache is not None:
+            self.cache.put(key, fingerprint, messages)
+
+        return messages
+
+
+    def create_homeassistant_message(self, entity: QbusConfigEntity, controller: QbusConfigDevice, mapping: EntityMapping | None = None) -> HomeAssistantMessage | list[HomeAssistantMessage] | None:
+        if mapping is None:
+            mapping = self.rules.rules.classify(entity)
+
+        if mapping.name is not None:
+            entity = entity.model_copy(update={"name": mapping.name})
+
+        message = self._create_messages(entity, controller, mapping)
+
+        if message is None:
+            return None
+
+        for m in (message if isinstance(message, list) else [message]):
+            if m.payload is None:
+                continue
+
+            # An empty payload removes the entity from Home Assistant
+            if mapping.exclude:
+                m.payload = None
+            elif mapping.device_class is not None and m.topic.split("/")[1] in _DEVICE_CLASS_DOMAINS:
+                m.payload.device_class = mapping.device_class
+
+        return message
+
+
+    def _create_messages(self, entity: QbusConfigEntity, controller: QbusConfigDevice, mapping: EntityMapping) -> HomeAssistantMessage | list[HomeAssistantMessage] | None:
         entityType = entity.type.lower()
 
         if entityType not in _SUPPORTED_OUTPUTS:
@@ -82,7 +140,7 @@ class MqttMessageFactory:
                 onoff_message = self._create_switch_message(entity, controller)
                 binarysensor_message = self._create_binarysensor_message(entity, controller)
 
-                if self._onoff_as_binarysensor(entity):
+                if mapping.domain == "binary_sensor":
                     onoff_message.payload = None
                 else:
                     binarysensor_message.payload = None
@@ -115,8 +173,8 @@ class MqttMessageFactory:
 
 
     def _create_base_message(self, entity: QbusConfigEntity, controller: QbusConfigDevice, domain: str, *, id_suffix: str = "", suffix_in_name: bool = False) -> HomeAssistantMessage:
-        ref_id = _parse_ref_id(entity.refId)
-        unique_id = f"qbus_{controller.id}_{ref_id}{id_suffix}"
+        ref_id = parse_ref_id(entity.refId)
+        unique_id = f"{self.gateway.unique_id_prefix}{controller.id}_{ref_id}{id_suffix}"
 
         device = HomeAssistantDevice()
         device.name = "Qbus"
@@ -136,12 +194,12 @@ class MqttMessageFactory:
         payload.unique_id = unique_id
         payload.object_id = unique_id
         payload.device = device
-        payload.state_topic = f"cloudapp/QBUSMQTTGW/{controller.id}/{entity.id}/state"
-        payload.json_attributes_topic = f"cloudapp/QBUSMQTTGW/{controller.id}/{entity.id}/state"
+        payload.state_topic = self.gateway.topic(controller.id, entity.id, "state")
+        payload.json_attributes_topic = self.gateway.topic(controller.id, entity.id, "state")
         payload.json_attributes_template = '{ "controller_id": "' + controller.id + '", "entity_id": "{{ value_json.id }}", "ref_id": "' + ref_id + '" }'
 
         if not domain.endswith("sensor"):
-            payload.command_topic = f"cloudapp/QBUSMQTTGW/{controller.id}/{entity.id}/setState"
+            payload.command_topic = self.gateway.topic(controller.id, entity.id, "setState")
 
         message = HomeAssistantMessage()
         message.topic = f"homeassistant/{domain}/{unique_id}/config"
@@ -193,6 +251,7 @@ class MqttMessageFactory:
 
     def _create_sensor_message_for_gauge_with_variant(self, entity: QbusConfigEntity, controller: QbusConfigDevice) -> HomeAssistantMessage:
         message = self._create_base_message(entity, controller, "sensor")
+        self._use_gauge_topic(message, entity, controller)
 
         variant = _SUPPORTED_GAUGE_VARIANTS.get(entity.variant) if isinstance(entity.variant, str) else None
         unit = entity.properties.get("currentValue").get("unit")
@@ -226,6 +285,7 @@ class MqttMessageFactory:
             unit = value.get("unit")
 
             message = self._create_base_message(entity, controller, "sensor", id_suffix=f"_{_to_snake_case(key)}", suffix_in_name=True)
+            self._use_gauge_topic(message, entity, controller)
             message.payload.value_template = "{%- if '" + key + "' in value_json.properties -%}{{ value_json.properties." + key + " }}{%- endif -%}"
             message.payload.unit_of_measurement = unit
             message.payload.suggested_display_precision = 2
@@ -329,14 +389,39 @@ class MqttMessageFactory:
         return message
 
 
-    def _onoff_as_binarysensor(self, entity: QbusConfigEntity) -> bool:
-        for bs in self._settings.BinarySensors:
-            bs = bs.upper()
+    def _use_gauge_topic(self, message: HomeAssistantMessage, entity: QbusConfigEntity, controller: QbusConfigDevice) -> None:
+        # Aggregated by QbusGaugeAggregationSubscriber
+        if self._settings.GaugeAggregation:
+            topic = self.gateway.qbha_topic("gauge", controller.id, entity.id, "state")
+            message.payload.state_topic = topic
+            message.payload.json_attributes_topic = topic
+
+
+    def _fingerprint(self, entity: QbusConfigEntity, controller: QbusConfigDevice, mapping: EntityMapping) -> str:
+        # Everything the messages are created from
+        digest = hashlib.sha1()
+        digest.update(entity.model_dump_json().encode())
+        digest.update(controller.model_dump_json(exclude={"functionBlocks"}).encode())
+        digest.update(json.dumps([
+            self._settings.Version,
+            self.gateway.prefix,
+            self.gateway.unique_id_prefix,
+            mapping,
+            *self._settings_fingerprint(entity),
+        ]).encode())
+
+        return digest.hexdigest()
 
-            if (bs == entity.id or
-                bs == entity.name.upper() or
-                bs == entity.refId or
-                bs == _parse_ref_id(entity.refId)):  # noqa: E129
-                return True
 
-        return False
+    def _settings_fingerprint(self, entity: QbusConfigEntity) -> list:
+        # Only the settings the messages of this entity depend on, so a
+        # changed setting only rebuilds the entities it affects. The entity
+        # rules, including BINARY_SENSORS, are in its mapping.
+        match entity.type.lower() if isinstance(entity.type, str) else "":
+            case "thermo":
+                return [self._settings.ClimatePresets, self._settings.ClimateSensors]
+
+            case "gauge":
+                return [self._settings.GaugeAggregation]
+
+        return []
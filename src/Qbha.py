@@ -1,55 +1,190 @@
+import json
 import logging
+import time
 import paho.mqtt.client as mqtt
-from Settings import Settings
+from KeyedExecutor import KeyedExecutor
+from Metrics import Metrics
+from Settings import BACKPRESSURE_COALESCE, Settings
+from StartupProfiler import StartupProfiler
 from Subscribers.Subscriber import Subscriber
+from TopicTrie import TopicTrie
+
+
+class _CountingClient:
+    """Counts the messages a subscriber publishes, everything else is delegated."""
+
+    def __init__(self, client: mqtt.Client, counter) -> None:
+        self._client = client
+        self._counter = counter
+
+
+    def publish(self, *args, **kwargs) -> mqtt.MQTTMessageInfo:
+        self._counter.inc()
+        return self._client.publish(*args, **kwargs)
+
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+class _SubscriberMetrics:
+    def __init__(self, client: mqtt.Client, name: str, labels: dict[str, str]) -> None:
+        metrics = Metrics()
+        labels = {**labels, "subscriber": name}
+
+        self.name = name
+        self.messages_in = metrics.counter("qbha_messages_in_total", "Messages processed per subscriber.", labels)
+        self.messages_out = metrics.counter("qbha_messages_out_total", "Messages published per subscriber.", labels)
+        self.validation_failures = metrics.counter("qbha_validation_failures_total", "Payloads that failed validation per subscriber.", labels)
+        self.errors = metrics.counter("qbha_processing_errors_total", "Errors while processing a message per subscriber.", labels)
+        self.duration = metrics.histogram("qbha_processing_seconds", "Processing time per subscriber.", labels)
+        self.client = _CountingClient(client, self.messages_out)
 
 
 class Qbha:
     _QBHA_AVAILABILITY_TOPIC = "qbha/availability"
     _logger = logging.getLogger("qbha." + __name__)
     _settings = Settings()
+    _connects = Metrics().counter("qbha_mqtt_connects_total", "Number of (re)connections to the MQTT broker.")
+    _disconnects = Metrics().counter("qbha_mqtt_disconnects_total", "Number of disconnections from the MQTT broker.")
 
 
-    def __init__(self, client: mqtt.Client, subscribers: list[Subscriber]) -> None:
+    def __init__(self, client: mqtt.Client, subscribers: list[Subscriber], executor: KeyedExecutor | None = None, publish_client: mqtt.Client | None = None) -> None:
         self.mqtt_client = client
-        self.subscribers = subscribers
+        # What the subscribers publish with, e.g. a LeaderGatedClient
+        self.publish_client = publish_client or client
+        self.subscribers: list[Subscriber] = []
+        self.executor = executor
+
+        # Compile all subscriber filters once, values are indexes in the
+        # subscriber list so dispatch order follows registration order.
+        self._router: TopicTrie[int] = TopicTrie()
+        self._metrics: list[_SubscriberMetrics] = []
+        self.add_subscribers(subscribers)
+
+        if executor is not None:
+            for key in ("queue_depth", "max_queue_depth", "dropped", "coalesced"):
+                Metrics().gauge(f"qbha_worker_{key}", f"Worker pool {key.replace('_', ' ')}.", callback=lambda key=key: executor.stats()[key])
+
+
+    def add_subscribers(self, subscribers: list[Subscriber]) -> None:
+        # Only before the client subscribes, i.e. before the network loop runs
+        for subscriber in subscribers:
+            index = len(self.subscribers)
+            self.subscribers.append(subscriber)
+            self._metrics.append(_SubscriberMetrics(self.publish_client, type(subscriber).__name__, subscriber.labels))
+
+            for topic in subscriber.get_topics():
+                self._router.add(topic, index)
 
 
     def start(self) -> None:
+        self.connect()
+        self.loop_forever()
+
+
+    def connect(self) -> None:
+        self._configure_client()
+        self.mqtt_client.connect(self._settings.MqttHost, self._settings.MqttPort, 60)
+        self.publish_online()
+
+
+    def loop_forever(self) -> None:
+        self.mqtt_client.loop_forever()
+
+
+    def publish_online(self) -> None:
+        # Queued right behind the CONNECT packet, so HA sees qbha online
+        # before the subscribers are even created.
+        self.publish_client.publish(self._QBHA_AVAILABILITY_TOPIC, "online")
+
+
+    def _configure_client(self) -> None:
         self.mqtt_client.on_connect = self._on_connect
         self.mqtt_client.on_message = self._on_message
         self.mqtt_client.on_disconnect = self._on_disconnect
 
-        self.mqtt_client.will_set(self._QBHA_AVAILABILITY_TOPIC, "offline")
+        self.publish_client.will_set(self._QBHA_AVAILABILITY_TOPIC, "offline")
         self.mqtt_client.username_pw_set(self._settings.MqttUser, self._settings.MqttPassword)
 
         self._logger.info(f"MQTT client connecting to {self._settings.MqttHost}:{self._settings.MqttPort} with user '{self._settings.MqttUser}'.")
-        self.mqtt_client.connect(self._settings.MqttHost, self._settings.MqttPort, 60)
-        self.mqtt_client.loop_forever()
 
 
     def _on_connect(self, client: mqtt.Client, userdata, flags, rc) -> None:
         self._logger.debug(f"MQTT client connected ({str(rc)}).")
-        client.publish(self._QBHA_AVAILABILITY_TOPIC, "online")
+        self._connects.inc()
+        self.publish_client.publish(self._QBHA_AVAILABILITY_TOPIC, "online")
 
         # Subscribing in on_connect() means that if we lose the connection and
         # reconnect then subscriptions will be renewed.
-        topics: list[tuple[str, int]] = []
+        self._subscribe(client, self.subscribers)
+        StartupProfiler().mark("subscribed")
+
+
+    def _subscribe(self, client: mqtt.Client, subscribers: list[Subscriber]) -> None:
+        topics: dict[str, int] = {}
+
+        for subscriber in subscribers:
+            for topic in subscriber.get_topics():
+                topics[topic] = max(topics.get(topic, 0), subscriber.qos)
 
-        for subscriber in self.subscribers:
-            self._logger.debug(f"MQTT client subscribing to {subscriber.topic}.")
-            topics.append((subscriber.topic, subscriber.qos))
+        for topic in topics:
+            self._logger.debug(f"MQTT client subscribing to {topic}.")
 
-        client.subscribe(topics)
+        if topics:
+            client.subscribe(list(topics.items()))
 
 
     def _on_message(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
-        for subscriber in self.subscribers:
-            if subscriber.can_process(msg):
-                self._logger.debug(f"Processing {msg.topic} with {type(subscriber).__name__}.")
-                subscriber.process(client, msg)
+        indexes = self._router.match(msg.topic)
+
+        if not indexes:
+            return
+
+        if self.executor is None:
+            self._dispatch(client, msg, indexes)
+        else:
+            # Keyed by topic, which holds the entity id for state messages,
+            # so messages of one entity are processed in order.
+            coalesce = self.executor.policy == BACKPRESSURE_COALESCE and self._is_full_state(msg)
+            self.executor.submit(msg.topic, self._dispatch, client, msg, indexes, coalesce=coalesce)
+
+
+    def _is_full_state(self, msg: mqtt.MQTTMessage) -> bool:
+        # Only a full state replaces the previous one. Events only hold the
+        # changed properties, and commands, configs, ... must all be processed.
+        try:
+            payload = json.loads(msg.payload)
+        except ValueError:
+            return False
+
+        return isinstance(payload, dict) and payload.get("type") == "state" and isinstance(payload.get("properties"), dict)
+
+
+    def _dispatch(self, client: mqtt.Client, msg: mqtt.MQTTMessage, indexes: list[int]) -> None:
+        for index in sorted(indexes):
+            self._process(self.subscribers[index], self._metrics[index], msg)
+
+
+    def _process(self, subscriber: Subscriber, metrics: _SubscriberMetrics, msg: mqtt.MQTTMessage) -> None:
+        self._logger.debug(f"Processing {msg.topic} with {metrics.name}.")
+        metrics.messages_in.inc()
+        start = time.perf_counter()
+
+        try:
+            subscriber.process(metrics.client, msg)
+        except ValueError:
+            # pydantic's ValidationError, but also invalid JSON
+            metrics.validation_failures.inc()
+            raise
+        except Exception:
+            metrics.errors.inc()
+            raise
+        finally:
+            metrics.duration.observe(time.perf_counter() - start)
 
 
     def _on_disconnect(self, client: mqtt.Client, userdata, rc) -> None:
         self._logger.debug(f"MQTT client disconnected ({str(rc)}).")
-        client.publish(self._QBHA_AVAILABILITY_TOPIC, "offline")
+        self._disconnects.inc()
+        self.publish_client.publish(self._QBHA_AVAILABILITY_TOPIC, "offline")
@@ -0,0 +1,119 @@
+import logging
+from typing import Iterator
+from QbusHelpers import parse_ref_id
+from QbusMqttModels.QbusConfig import QbusConfig
+from QbusMqttModels.QbusConfigDevice import QbusConfigDevice
+from QbusMqttModels.QbusConfigEntity import QbusConfigEntity
+
+EntityWithController = tuple[QbusConfigEntity, QbusConfigDevice]
+
+
+class QbusConfigIndex:
+    """Immutable lookup tables for a Qbus configuration.
+
+    An index is fully built before it is published, so readers either see the
+    previous configuration or the new one, never a partially built mix.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, config: QbusConfig | None) -> None:
+        self.config = config
+
+        self._entities: list[EntityWithController] = []
+        self._by_id: dict[str, EntityWithController] = {}
+        self._by_ref_id: dict[str, EntityWithController] = {}
+        self._by_parsed_ref_id: dict[str, EntityWithController] = {}
+        self._controllers: dict[str, QbusConfigDevice] = {}
+        self._by_controller: dict[str, list[EntityWithController]] = {}
+        self._by_type: dict[str, list[EntityWithController]] = {}
+        self._by_location: dict[str, list[EntityWithController]] = {}
+        self._ids_by_type: dict[str, frozenset[str]] = {}
+
+        if config is None:
+            return
+
+        # The parsed ref id (e.g. "12-3") leaves out the controller address
+        parsed_ref_ids: dict[str, list[EntityWithController]] = {}
+
+        for controller in config.devices or []:
+            self._controllers[controller.id] = controller
+            controller_entities = self._by_controller.setdefault(controller.id, [])
+
+            for entity in controller.functionBlocks or []:
+                item = (entity, controller)
+                self._entities.append(item)
+                controller_entities.append(item)
+
+                if entity.id is not None:
+                    self._by_id.setdefault(entity.id, item)
+
+                if entity.refId:
+                    self._by_ref_id.setdefault(entity.refId, item)
+
+                    parsed_ref_id = parse_ref_id(entity.refId)
+
+                    if parsed_ref_id:
+                        parsed_ref_ids.setdefault(parsed_ref_id, []).append(item)
+
+                if isinstance(entity.type, str):
+                    self._by_type.setdefault(entity.type.lower(), []).append(item)
+
+                if entity.location:
+                    self._by_location.setdefault(entity.location, []).append(item)
+
+        ambiguous = []
+
+        for parsed_ref_id, items in parsed_ref_ids.items():
+            if len({controller.id for (_, controller) in items}) == 1:
+                self._by_parsed_ref_id[parsed_ref_id] = items[0]
+            else:
+                ambiguous.append(parsed_ref_id)
+
+        if ambiguous:
+            self._logger.warning(f"Ref ids {ambiguous} are used on several controllers, they can only be found by their full ref id.")
+
+        for type, items in self._by_type.items():
+            self._ids_by_type[type] = frozenset(entity.id for (entity, _) in items if entity.id is not None)
+
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+    def entities(self) -> Iterator[EntityWithController]:
+        return iter(self._entities)
+
+
+    def find_by_id(self, id: str) -> EntityWithController | None:
+        return self._by_id.get(id)
+
+
+    def find_by_ref_id(self, ref_id: str) -> EntityWithController | None:
+        # A parsed ref id of several controllers is not found, it could be any of them
+        return self._by_ref_id.get(ref_id) or self._by_parsed_ref_id.get(ref_id)
+
+
+    def find_controller(self, controller_id: str) -> QbusConfigDevice | None:
+        return self._controllers.get(controller_id)
+
+
+    def controllers(self) -> list[QbusConfigDevice]:
+        return list(self._controllers.values())
+
+
+    def by_controller(self, controller_id: str) -> list[EntityWithController]:
+        return self._by_controller.get(controller_id, [])
+
+
+    def by_type(self, type: str) -> list[EntityWithController]:
+        return self._by_type.get(type.lower(), [])
+
+
+    def ids_by_type(self, type: str) -> frozenset[str]:
+        return self._ids_by_type.get(type.lower(), frozenset())
+
+
+    def by_location(self, location: str) -> list[EntityWithController]:
+        return self._by_location.get(location, [])
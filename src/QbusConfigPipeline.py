@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from BulkPublisher import BulkPublish, BulkPublisher
+from DiscoveryCache import DiscoveryCache
+from GetStateService import PRIORITY_HIGH, GetStateService
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage
+from Metrics import Metrics
+from MqttMessageFactory import MqttMessageFactory
+from QbusGateway import QbusGateway
+from QbusMqttModels.QbusConfig import QbusConfig
+from Scheduler import Scheduler
+from Subscribers.HomeAssistantDiscoverySubscriber import HomeAssistantDiscoverySubscriber
+
+
+class _PipelineRun:
+    def __init__(self, client: mqtt.Client, source: bytes | bytearray, config: QbusConfig) -> None:
+        self.client = client
+        self.source = source
+        self.config = config
+        self.pending_controllers: set[str] = set()
+        self.timeout = None
+        self.publish: BulkPublish | None = None
+        self.cancelled = False
+        self.controllers_done = False
+        self.started = time.monotonic()
+        self.stage_started = self.started
+        self.durations: list[tuple[str, float]] = []
+
+
+    def end_stage(self, name: str) -> None:
+        now = time.monotonic()
+        self.durations.append((name, now - self.stage_started))
+        self.stage_started = now
+
+
+class QbusConfigPipeline:
+    """Processes a new Qbus config in stages on the scheduler thread.
+
+    1. Request the controller states.
+    2. Wait until every controller responded, or until the timeout expires.
+    3. Save the config and publish the Home Assistant discovery messages.
+    4. Once they are all published, request the entity states.
+
+    The MQTT network thread is never blocked while waiting.
+    """
+
+    _CONTROLLER_TIMEOUT = 10
+    _ENTITY_STATE_DELAY = 2
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, gateway: QbusGateway, scheduler: Scheduler, get_state: GetStateService, publisher: BulkPublisher, reconciler: HomeAssistantDiscoverySubscriber | None = None) -> None:
+        self._gateway = gateway
+        self._scheduler = scheduler
+        self._get_state = get_state
+        self._publisher = publisher
+        self._reconciler = reconciler
+        self._message_factory = MqttMessageFactory(gateway, DiscoveryCache(gateway.data_folder))
+        self._lock = threading.Lock()
+        self._run: _PipelineRun | None = None
+        self._configs_processed = Metrics().counter("qbha_configs_processed_total", "Number of Qbus configs processed.", gateway.labels)
+        self._discovery_published_total = Metrics().counter("qbha_discovery_messages_total", "Number of discovery messages published.", gateway.labels)
+        self._discovery_last_config = Metrics().gauge("qbha_discovery_messages_last_config", "Number of discovery messages published for the last config.", gateway.labels)
+
+
+    def start(self, client: mqtt.Client, source: bytes | bytearray, config: QbusConfig) -> None:
+        run = _PipelineRun(client, source, config)
+
+        with self._lock:
+            # A newer config supersedes the one being processed
+            if self._run is not None:
+                self._cancel(self._run)
+
+            self._run = run
+
+        self._scheduler.call_soon(self._request_controller_states, run)
+
+
+    def rediscover(self, client: mqtt.Client) -> None:
+        """Republishes the discovery messages of the entities whose messages changed, e.g. after a settings reload."""
+        self._scheduler.call_soon(self._rediscover, client)
+
+
+    def check_rules(self, client: mqtt.Client) -> None:
+        """Rediscovers when the entity rules changed."""
+        self._scheduler.call_soon(self._check_rules, client)
+
+
+    def controller_state_received(self, controller_id: str) -> None:
+        with self._lock:
+            run = self._run
+
+            if run is None or run.controllers_done or controller_id not in run.pending_controllers:
+                return
+
+            run.pending_controllers.discard(controller_id)
+
+            if len(run.pending_controllers) > 0:
+                return
+
+            if run.timeout is not None:
+                run.timeout.cancel()
+
+        self._scheduler.call_soon(self._controllers_ready, run)
+
+
+    def _request_controller_states(self, run: _PipelineRun) -> None:
+        if run.cancelled:
+            return
+
+        device_ids = [controller.id for controller in run.config.devices]
+
+        if len(device_ids) <= 0:
+            self._controllers_ready(run)
+            return
+
+        with self._lock:
+            run.pending_controllers.update(device_ids)
+            run.timeout = self._scheduler.call_later(self._CONTROLLER_TIMEOUT, self._controllers_ready, run)
+
+        self._logger.debug("Requesting controller states from Qbus.")
+        self._get_state.request(device_ids, PRIORITY_HIGH)
+
+
+    def _controllers_ready(self, run: _PipelineRun) -> None:
+        with self._lock:
+            if run.cancelled or run.controllers_done:
+                return
+
+            run.controllers_done = True
+
+            if len(run.pending_controllers) > 0:
+                self._logger.warning(f"No state received for controller(s) {sorted(run.pending_controllers)}, continuing.")
+
+        run.end_stage("controller states")
+        total_entities = sum(len(controller.functionBlocks) for controller in run.config.devices)
+
+        if total_entities <= 0:
+            self._finish(run)
+            return
+
+        self._logger.info("New Qbus config, updating Home Assistant entities.")
+
+        # Save qbus configuration in file
+        self._gateway.config.save(run.source, run.config)
+        run.end_stage("save")
+
+        # Create HA entities
+        entity_ids, discovery = self._create_discovery_messages()
+        run.end_stage("create discovery")
+
+        if self._reconciler is not None:
+            discovery = self._reconciler.reconcile(discovery)
+            run.end_stage("reconcile discovery")
+
+        # Publish HA entities to MQTT
+        self._logger.debug("Publishing Home Assistant MQTT messages.")
+        run.publish = self._publisher.publish(run.client, discovery, lambda publish: self._discovery_published(run, publish, entity_ids))
+
+
+    def _discovery_published(self, run: _PipelineRun, publish: BulkPublish, entity_ids: list[str]) -> None:
+        if run.cancelled:
+            return
+
+        run.end_stage(f"publish discovery ({publish.total} messages, {publish.retries} retries)")
+        self._configs_processed.inc()
+        self._discovery_published_total.inc(publish.total)
+        self._discovery_last_config.set(publish.total)
+
+        # Give Home Assistant time to subscribe to the new state topics
+        self._scheduler.call_later(self._ENTITY_STATE_DELAY, self._request_entity_states, run, entity_ids)
+
+
+    def _request_entity_states(self, run: _PipelineRun, entity_ids: list[str]) -> None:
+        if run.cancelled:
+            return
+
+        run.end_stage("settle")
+
+        if len(entity_ids) > 0:
+            self._logger.debug("Requesting entity states from Qbus.")
+            self._get_state.request(entity_ids)
+
+        run.end_stage("entity states")
+        self._finish(run)
+
+
+    def _finish(self, run: _PipelineRun) -> None:
+        with self._lock:
+            if self._run is run:
+                self._run = None
+
+        durations = ", ".join(f"{name} {duration:.2f}s" for name, duration in run.durations)
+        self._logger.info(f"Qbus config processed in {time.monotonic() - run.started:.2f}s: {durations}.")
+
+
+    def _cancel(self, run: _PipelineRun) -> None:
+        run.cancelled = True
+
+        if run.timeout is not None:
+            run.timeout.cancel()
+
+        if run.publish is not None:
+            run.publish.cancel()
+
+
+    def _check_rules(self, client: mqtt.Client) -> None:
+        if self._message_factory.rules.refresh():
+            self._logger.info("Entity rules changed.")
+            self._rediscover(client)
+
+
+    def _rediscover(self, client: mqtt.Client) -> None:
+        # On the scheduler thread, like the stages that use the cache
+        started = time.monotonic()
+        self._message_factory.rules.refresh()
+        entity_ids: list[str] = []
+        discovery: list[DiscoveryMessage] = []
+
+        for (entity, controller) in self._gateway.config.get_entities_with_controller():
+            messages = self._message_factory.create_discovery_messages(entity, controller, changed_only=True)
+
+            if messages:
+                # Excluded entities only have removals, they have no state
+                if any(message[1] for message in messages):
+                    entity_ids.append(entity.id)
+
+                discovery.extend(messages)
+
+        self._message_factory.cache.save()
+        self._logger.info(f"Rediscovering {len(entity_ids)} entities ({len(discovery)} messages) in {time.monotonic() - started:.2f}s.")
+
+        if len(discovery) > 0:
+            # Their state topics may have changed as well
+            self._publisher.publish(client, discovery, lambda publish: self._scheduler.call_later(self._ENTITY_STATE_DELAY, self._get_state.request, entity_ids))
+
+
+    def _create_discovery_messages(self) -> tuple[list[str], list[DiscoveryMessage]]:
+        entity_ids: list[str] = []
+        discovery: list[DiscoveryMessage] = []
+        keys: set[str] = set()
+        self._message_factory.rules.refresh()
+
+        for (entity, controller) in self._gateway.config.get_entities_with_controller():
+            keys.add(f"{controller.id}/{entity.id}")
+            messages = self._message_factory.create_discovery_messages(entity, controller)
+
+            if messages is None:
+                continue
+
+            # Excluded entities only have removals, they have no state
+            if any(message[1] for message in messages):
+                entity_ids.append(entity.id)
+
+            for message in messages:
+                if message[1]:
+                    self._logger.debug(f"Adding entity {message[0]}.")
+                else:
+                    self._logger.debug(f"Removing entity {message[0]}.")
+
+                discovery.append(message)
+
+        # Entities that are gone will not come back with the same fingerprint
+        cache = self._message_factory.cache
+        evicted = cache.evict_missing(keys)
+
+        if evicted > 0:
+            self._logger.debug(f"Evicted {evicted} entities from the discovery cache.")
+
+        cache.save()
+
+        return entity_ids, discovery
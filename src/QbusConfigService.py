@@ -1,73 +1,185 @@
+import functools
+import hashlib
+import json
 import logging
 import os
+import pickle
+import threading
 from typing import Iterator
-from pydantic import TypeAdapter
+import pydantic
+from QbusConfigIndex import EntityWithController, QbusConfigIndex
+from QbusHelpers import get_type_adapter
 from QbusMqttModels.QbusConfig import QbusConfig
 from QbusMqttModels.QbusConfigDevice import QbusConfigDevice
 from QbusMqttModels.QbusConfigEntity import QbusConfigEntity
 from Settings import Settings
 
 
+@functools.cache
+def _snapshot_schema() -> str:
+    # Changes with the models that make up QbusConfig, so a snapshot of older models is never used
+    schema = json.dumps(QbusConfig.model_json_schema(), sort_keys=True)
+    return f"{pydantic.VERSION}-{hashlib.sha256(schema.encode()).hexdigest()}"
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    # A snapshot only contains config models, anything else is refused
+    def find_class(self, module: str, name: str):
+        if module.startswith("QbusMqttModels."):
+            cls = super().find_class(module, name)
+
+            if isinstance(cls, type) and issubclass(cls, pydantic.BaseModel):
+                return cls
+
+        raise pickle.UnpicklingError(f"'{module}.{name}' is not allowed in a config snapshot")
+
+
 class QbusConfigService(object):
-    _config: QbusConfig = None
     _settings = Settings()
     _logger = logging.getLogger("qbha." + __name__)
 
 
-    @staticmethod
-    def save(source: bytes | bytearray, config: QbusConfig) -> None:
+    def __init__(self, data_folder: str | None = None) -> None:
+        self._data_folder = data_folder or self._settings.DataFolder
+        # Config and its lookup tables live in one object and are replaced with a
+        # single assignment, so readers on other threads never see a mix.
+        self._index: QbusConfigIndex = None
+        # The warmup thread and the MQTT thread may both load the config, only
+        # one of them loads it and writes the snapshot
+        self._lock = threading.Lock()
+
+
+    def save(self, source: bytes | bytearray, config: QbusConfig) -> None:
+        index = QbusConfigIndex(config)
+
         # Save to file
-        with open(f"{__class__._settings.DataFolder}qbusconfig.json", "w") as file:
-            file.write(config.model_dump_json())
+        content = config.model_dump_json()
+
+        with self._lock:
+            with open(f"{self._data_folder}qbusconfig.json", "w") as file:
+                file.write(content)
+
+            self._save_snapshot(content, config)
+
+            with open(f"{self._data_folder}qbusconfig.source.json", "w") as file:
+                file.write(source.decode())
+
+            # Set prop
+            self._index = index
+
+
+    def load(self) -> QbusConfig | None:
+        return self._get_index().config
+
+
+    def warmup(self) -> None:
+        # Loads the config ahead of the first lookup, without warning when there is none yet
+        if os.path.isfile(f"{self._data_folder}qbusconfig.json"):
+            self._get_index()
+
+
+    def get_entities(self) -> Iterator[QbusConfigEntity]:
+        for (entity, _) in self._get_index().entities():
+            yield entity
+
+
+    def get_entities_with_controller(self) -> Iterator[EntityWithController]:
+        return self._get_index().entities()
+
+
+    def get_entities_by_controller(self, controller_id: str) -> list[EntityWithController]:
+        return self._get_index().by_controller(controller_id)
+
+
+    def get_entities_by_type(self, type: str) -> list[EntityWithController]:
+        return self._get_index().by_type(type)
+
+
+    def get_entity_ids_by_type(self, type: str) -> frozenset[str]:
+        return self._get_index().ids_by_type(type)
+
+
+    def get_entities_by_location(self, location: str) -> list[EntityWithController]:
+        return self._get_index().by_location(location)
+
+
+    def find_controller_by_id(self, id: str) -> QbusConfigDevice | None:
+        return self._get_index().find_controller(id)
+
+
+    def find_entity_by_id(self, id: str) -> QbusConfigEntity | None:
+        item = self._get_index().find_by_id(id)
+        return item[0] if item else None
+
+
+    def find_entity_with_controller_by_id(self, id: str) -> EntityWithController | None:
+        return self._get_index().find_by_id(id)
+
+
+    def find_entity_with_controller_by_ref_id(self, ref_id: str) -> EntityWithController | None:
+        # Accepts the raw refId (e.g. '1/12/3') as well as the parsed one ('12-3')
+        return self._get_index().find_by_ref_id(ref_id)
+
+
+    def _get_index(self) -> QbusConfigIndex:
+        index = self._index
+
+        if index is not None:
+            return index
 
-        with open(f"{__class__._settings.DataFolder}qbusconfig.source.json", "w") as file:
-            file.write(source.decode())
+        with self._lock:
+            # Loaded by another thread while waiting for the lock
+            if self._index is not None:
+                return self._index
 
-        # Set prop
-        __class__._config = config
+            if os.path.isfile(f"{self._data_folder}qbusconfig.json"):
+                with open(f"{self._data_folder}qbusconfig.json", "r") as file:
+                    content = file.read()
 
+                config = self._load_snapshot(content)
 
-    @staticmethod
-    def load() -> QbusConfig | None:
-        if __class__._config is None:
-            if os.path.isfile(f"{__class__._settings.DataFolder}qbusconfig.json"):
-                with open(f"{__class__._settings.DataFolder}qbusconfig.json", "r") as file:
-                    config = file.read()
-                    __class__._config = TypeAdapter(QbusConfig).validate_json(config)
-            else:
-                __class__._logger.warning("File 'qbusconfig.json' does not exist. Try to restart the Qbus MQTT service.")
+                if config is None:
+                    config = get_type_adapter(QbusConfig).validate_json(content)
+                    self._save_snapshot(content, config)
 
-        return __class__._config
+                index = QbusConfigIndex(config)
+                self._index = index
+                return index
 
+        self._logger.warning("File 'qbusconfig.json' does not exist. Try to restart the Qbus MQTT service.")
+        return QbusConfigIndex(None)
 
-    @staticmethod
-    def get_entities() -> Iterator[QbusConfigEntity]:
-        __class__.load()
 
-        if __class__._config is None:
-            return []
+    def _load_snapshot(self, content: str) -> QbusConfig | None:
+        # The snapshot is the already validated config, it is only used when it
+        # was made from exactly this JSON with the current models.
+        path = f"{self._data_folder}qbusconfig.snapshot"
 
-        for controller in __class__._config.devices or []:
-            for entity in controller.functionBlocks or []:
-                yield entity
+        if not os.path.isfile(path):
+            return None
 
+        try:
+            with open(path, "rb") as file:
+                (schema, digest, config) = _SnapshotUnpickler(file).load()
+        except Exception as exception:
+            self._logger.warning(f"Ignoring invalid config snapshot: {exception}.")
+            return None
 
-    @staticmethod
-    def get_entities_with_controller() -> Iterator[tuple[QbusConfigEntity, QbusConfigDevice]]:
-        __class__.load()
+        if schema != _snapshot_schema() or digest != hashlib.sha256(content.encode()).hexdigest() or not isinstance(config, QbusConfig):
+            self._logger.debug("Config snapshot is outdated, validating qbusconfig.json.")
+            return None
 
-        if __class__._config is None:
-            return []
+        return config
 
-        for controller in __class__._config.devices or []:
-            for entity in controller.functionBlocks or []:
-                yield (entity, controller)
 
+    def _save_snapshot(self, content: str, config: QbusConfig) -> None:
+        path = f"{self._data_folder}qbusconfig.snapshot"
+        digest = hashlib.sha256(content.encode()).hexdigest()
 
-    @staticmethod
-    def find_entity_by_id(id: str) -> QbusConfigEntity | None:
-        for entity in __class__.get_entities():
-            if entity.id == id:
-                return entity
+        try:
+            with open(f"{path}.tmp", "wb") as file:
+                pickle.dump((_snapshot_schema(), digest, config), file, pickle.HIGHEST_PROTOCOL)
 
-        return None
+            os.replace(f"{path}.tmp", path)
+        except (OSError, pickle.PicklingError) as exception:
+            self._logger.warning(f"Unable to save config snapshot: {exception}.")
@@ -0,0 +1,58 @@
+import os
+
+from QbusConfigService import QbusConfigService
+from Settings import DEFAULT_GATEWAY_PREFIX, Settings
+
+
+class QbusGateway:
+    """A Qbus MQTT gateway served by qbha.
+
+    Every gateway has its own topic prefix, data folder and config. The
+    gateway on the default prefix keeps the data folder and unique IDs qbha
+    always used, the unique IDs of other gateways include the gateway name
+    so they stay stable when gateways are added or removed.
+    """
+
+    _settings = Settings()
+
+
+    def __init__(self, name: str, prefix: str, others: list[str] | None = None) -> None:
+        self.name = name
+        self.prefix = prefix
+        self.is_default = prefix == DEFAULT_GATEWAY_PREFIX
+        self.unique_id_prefix = "qbus_" if self.is_default else f"qbus_{name}_"
+        self.data_folder = self._settings.DataFolder if self.is_default else f"{self._settings.DataFolder}{name}/"
+        self.labels: dict[str, str] = {} if self.is_default else {"gateway": name}
+        # Unique ID prefixes of the other gateways, the default one is a prefix of all of them
+        self._other_unique_id_prefixes = [f"qbus_{other}_" for other in others or [] if other != name]
+
+        os.makedirs(self.data_folder, exist_ok=True)
+        self.config = QbusConfigService(self.data_folder)
+
+
+    def topic(self, *parts: str) -> str:
+        return "/".join((self.prefix,) + parts)
+
+
+    def qbha_topic(self, *parts: str) -> str:
+        # Topics owned by qbha, the other gateways get their name in between
+        return "/".join(("qbha",) + parts if self.is_default else ("qbha", self.name) + parts)
+
+
+    def owns_unique_id(self, unique_id: str) -> bool:
+        if not unique_id.startswith(self.unique_id_prefix):
+            return False
+
+        return not self.is_default or not any(unique_id.startswith(prefix) for prefix in self._other_unique_id_prefixes)
+
+
+def create_gateways() -> list[QbusGateway]:
+    settings = Settings()
+    configured = settings.QbusGateways
+    names = [name for (name, _) in configured]
+
+    return [
+        QbusGateway(name, prefix, names)
+        for (name, prefix) in configured
+        if not settings.QbusGateway or settings.QbusGateway == name
+    ]
@@ -0,0 +1,46 @@
+import functools
+import json
+import re
+from typing import Any
+
+import paho.mqtt.client as mqtt
+from pydantic import TypeAdapter
+
+from Metrics import Metrics
+
+_REF_ID_REGEX = re.compile(r"^\d+\/(\d+(?:\/\d+)?)$")
+
+# Set in the states republished from the state shadow, they are not news from the gateway
+SHADOW_REPLAY_KEY = "qbhaReplay"
+
+_GET_STATE_REQUESTS = Metrics().counter("qbha_getstate_requests_total", "Number of getState requests sent to the gateway.")
+_GET_STATE_IDS = Metrics().histogram("qbha_getstate_ids", "Number of IDs per getState request.", buckets=(1, 5, 10, 50, 100, 500, 1000))
+
+
+def is_shadow_replay(state: dict) -> bool:
+    return state.get(SHADOW_REPLAY_KEY) is True
+
+
+def parse_ref_id(ref_id: str) -> str:
+    matches = re.findall(_REF_ID_REGEX, ref_id or "")
+
+    if len(matches) > 0:
+        ref_id = matches[0]
+
+        if ref_id:
+            return ref_id.replace("/", "-")
+
+    return ""
+
+
+@functools.cache
+def get_type_adapter(type: Any) -> TypeAdapter:
+    # Building an adapter compiles the validator, only do it once per type and
+    # only when it is first needed.
+    return TypeAdapter(type)
+
+
+def publish_get_state(client: mqtt.Client, prefix: str, ids: list[str]) -> mqtt.MQTTMessageInfo:
+    _GET_STATE_REQUESTS.inc()
+    _GET_STATE_IDS.observe(len(ids))
+    return client.publish(f"{prefix}/getState", json.dumps(ids))
@@ -0,0 +1,102 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+
+class ScheduledCall:
+    def __init__(self, when: float, callback: Callable[..., Any], args: tuple) -> None:
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self._cancelled = False
+
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+
+class Scheduler:
+    """Runs delayed callbacks on a single background thread.
+
+    The interface mirrors `asyncio.AbstractEventLoop.call_later`, so code
+    written against it can also be driven by an event loop.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self) -> None:
+        self._queue: list[tuple[float, int, ScheduledCall]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="qbha-scheduler", daemon=True)
+        self._thread.start()
+
+
+    def time(self) -> float:
+        return time.monotonic()
+
+
+    def call_soon(self, callback: Callable[..., Any], *args) -> ScheduledCall:
+        return self.call_later(0, callback, *args)
+
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        return self.call_at(self.time() + max(0, delay), callback, *args)
+
+
+    def call_at(self, when: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        call = ScheduledCall(when, callback, args)
+
+        with self._condition:
+            heapq.heappush(self._queue, (when, next(self._counter), call))
+
+            # Only wake up the thread when the new call is the first one due
+            if self._queue[0][2] is call:
+                self._condition.notify()
+
+        return call
+
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._queue:
+                        timeout = self._queue[0][0] - self.time()
+
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+
+                    self._condition.wait(timeout)
+
+                if self._closed:
+                    break
+
+                _, _, call = heapq.heappop(self._queue)
+
+            if call.cancelled():
+                continue
+
+            try:
+                call.callback(*call.args)
+            except Exception as exception:
+                self._logger.exception(exception)
+
+        self._logger.debug("Killing thread.")
@@ -1,8 +1,22 @@
 import logging
 import os
 from pathlib import Path
+import re
 import socket
 
+DEFAULT_GATEWAY_PREFIX = "cloudapp/QBUSMQTTGW"
+_GATEWAY_NAME_REGEX = re.compile(r"^[a-z0-9]+$")
+_GATEWAY_PREFIX_REGEX = re.compile(r"^[^/+#]+/[^/+#]+$")
+
+# Worker queue backpressure policies, see KeyedExecutor
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"
+BACKPRESSURE_COALESCE = "coalesce"
+BACKPRESSURE_POLICIES = [BACKPRESSURE_BLOCK, BACKPRESSURE_DROP_OLDEST, BACKPRESSURE_COALESCE]
+
+# Settings that can be changed while running, see reload()
+RELOADABLE_SETTINGS = ("BINARY_SENSORS", "CLIMATE_PRESETS", "CLIMATE_SENSORS")
+
 
 class Settings:
     _VERSION = "v1.0.0"
@@ -16,21 +30,31 @@ class Settings:
 
 
     def __init__(self) -> None:
+        # __new__ returns the same instance, only initialize it once
+        if hasattr(self, "_initialized"):
+            return
+
+        self._initialized = True
+
         # Docker
         cgroup = Path('/proc/self/cgroup')
         self._is_docker = Path('/.dockerenv').is_file() or cgroup.is_file() and 'docker' in cgroup.read_text()
         self._is_ha_addon: bool = os.environ.get("IS_HA_ADDON", "False").lower() in ("true", "1")
 
         # Data folder
-        if self._is_ha_addon:
+        data_folder = os.environ.get("DATA_FOLDER")
+
+        if data_folder:
+            self._data_folder = data_folder.rstrip("/") + "/"
+        elif self._is_ha_addon:
             self._data_folder = "/config/"
         elif self._is_docker:
             self._data_folder = "/data/"
         else:
             self._data_folder = "data/"
 
-        # Hostname
-        self._hostname = socket.gethostname()
+        # Hostname, or a name to tell instances on the same host apart
+        self._hostname = os.environ.get("INSTANCE_ID", "").strip() or socket.gethostname()
 
         # MQTT settings
         self._mqtt_port: int = 1883
@@ -48,13 +72,51 @@ class Settings:
 
         # Other
         self._qbus_capture: bool = os.environ.get("QBUS_CAPTURE", "False").lower() in ("true", "1")
-        self._climate_sensors: bool = os.environ.get("CLIMATE_SENSORS", "False").lower() in ("true", "1")
+        self._qbus_capture_compress: bool = os.environ.get("QBUS_CAPTURE_COMPRESS", "True").lower() in ("true", "1")
 
-        climate_presets = os.environ.get("CLIMATE_PRESETS", "MANUEEL,VORST,NACHT,ECONOMY,COMFORT").split(",")
-        self._climate_presets: list[str] = [x for x in climate_presets if x.strip()]
+        qbus_capture_format = os.environ.get("QBUS_CAPTURE_FORMAT", "text").lower()
+        self._qbus_capture_format: str = qbus_capture_format if qbus_capture_format in ("text", "binary") else "text"
 
-        binary_sensors = os.environ.get("BINARY_SENSORS", "").split(",")
-        self._binary_sensors: list[str] = [x for x in binary_sensors if x.strip()]
+        # Reloadable, overridden per source
+        self._overrides: dict[str, dict[str, str]] = {}
+        self._load_reloadable()
+
+        # Gateways
+        self._qbus_gateways: list[tuple[str, str]] = self._get_gateways()
+        self._qbus_gateway: str = os.environ.get("QBUS_GATEWAY", "").strip().lower()
+        self._gateway_processes: bool = os.environ.get("GATEWAY_PROCESSES", "False").lower() in ("true", "1")
+
+        # getState
+        self._getstate_chunk_size: int = self._get_int("GETSTATE_CHUNK_SIZE", 100)
+        self._getstate_rate: int = self._get_int("GETSTATE_RATE", 5)
+
+        # Gauge aggregation
+        self._gauge_aggregation: bool = os.environ.get("GAUGE_AGGREGATION", "False").lower() in ("true", "1")
+        self._gauge_interval: int = max(self._get_int("GAUGE_INTERVAL", 10), 1)
+        self._gauge_deadband: float = self._get_float("GAUGE_DEADBAND", 1.0)
+
+        self._state_shadow: bool = os.environ.get("STATE_SHADOW", "True").lower() in ("true", "1")
+        self._discovery_reconcile: bool = os.environ.get("DISCOVERY_RECONCILE", "False").lower() in ("true", "1")
+
+        # Leader election
+        self._leader_election: bool = os.environ.get("LEADER_ELECTION", "False").lower() in ("true", "1")
+        self._leader_lease: int = max(self._get_int("LEADER_LEASE", 10), 1)
+
+        # Metrics
+        self._metrics_host: str = os.environ.get("METRICS_HOST", "127.0.0.1")
+        self._metrics_port: int = self._get_int("METRICS_PORT", 0)
+        self._metrics_interval: int = self._get_int("METRICS_INTERVAL", 0)
+
+        # Runtime
+        runtime = os.environ.get("RUNTIME", "thread").lower()
+        self._runtime: str = runtime if runtime in ("thread", "asyncio") else "thread"
+
+        # Workers
+        self._worker_threads: int = self._get_int("WORKER_THREADS", 0)
+        self._worker_queue_size: int = self._get_int("WORKER_QUEUE_SIZE", 1000)
+
+        worker_backpressure = os.environ.get("WORKER_BACKPRESSURE", BACKPRESSURE_BLOCK).lower()
+        self._worker_backpressure: str = worker_backpressure if worker_backpressure in BACKPRESSURE_POLICIES else BACKPRESSURE_BLOCK
 
 
     @property
@@ -77,16 +139,76 @@ class Settings:
         return self._data_folder
 
 
+    @property
+    def DiscoveryReconcile(self) -> bool:
+        return self._discovery_reconcile
+
+
+    @property
+    def GatewayProcesses(self) -> bool:
+        return self._gateway_processes
+
+
+    @property
+    def GaugeAggregation(self) -> bool:
+        return self._gauge_aggregation
+
+
+    @property
+    def GaugeDeadband(self) -> float:
+        return self._gauge_deadband
+
+
+    @property
+    def GaugeInterval(self) -> int:
+        return self._gauge_interval
+
+
+    @property
+    def GetStateChunkSize(self) -> int:
+        return self._getstate_chunk_size
+
+
+    @property
+    def GetStateRate(self) -> int:
+        return self._getstate_rate
+
+
     @property
     def Hostname(self) -> str:
         return self._hostname
 
 
+    @property
+    def LeaderElection(self) -> bool:
+        return self._leader_election
+
+
+    @property
+    def LeaderLease(self) -> int:
+        return self._leader_lease
+
+
     @property
     def LogLevel(self) -> int:
         return self._log_level
 
 
+    @property
+    def MetricsHost(self) -> str:
+        return self._metrics_host
+
+
+    @property
+    def MetricsInterval(self) -> int:
+        return self._metrics_interval
+
+
+    @property
+    def MetricsPort(self) -> int:
+        return self._metrics_port
+
+
     @property
     def MqttHost(self) -> str:
         return os.environ.get("MQTT_HOST")
@@ -112,6 +234,130 @@ class Settings:
         return self._qbus_capture
 
 
+    @property
+    def QbusCaptureCompress(self) -> bool:
+        return self._qbus_capture_compress
+
+
+    @property
+    def QbusCaptureFormat(self) -> str:
+        return self._qbus_capture_format
+
+
+    @property
+    def QbusGateway(self) -> str:
+        return self._qbus_gateway
+
+
+    @property
+    def QbusGateways(self) -> list[tuple[str, str]]:
+        return self._qbus_gateways
+
+
+    @property
+    def Runtime(self) -> str:
+        return self._runtime
+
+
+    @property
+    def StateShadow(self) -> bool:
+        return self._state_shadow
+
+
     @property
     def Version(self) -> str:
         return self._VERSION
+
+
+    @property
+    def WorkerBackpressure(self) -> str:
+        return self._worker_backpressure
+
+
+    @property
+    def WorkerQueueSize(self) -> int:
+        return self._worker_queue_size
+
+
+    @property
+    def WorkerThreads(self) -> int:
+        return self._worker_threads
+
+
+    def reload(self, source: str, values: dict[str, str]) -> list[str]:
+        """Overrides the reloadable settings with the values of a source and returns the changed keys.
+
+        The values of a source replace its previous values, a key that is
+        no longer given falls back to the environment.
+        """
+        before = self._reloadable()
+        self._overrides[source] = {key: value for key, value in values.items() if key in RELOADABLE_SETTINGS}
+        self._load_reloadable()
+        after = self._reloadable()
+
+        return [key for key in RELOADABLE_SETTINGS if before[key] != after[key]]
+
+
+    def _load_reloadable(self) -> None:
+        values = dict(os.environ)
+
+        for overrides in list(self._overrides.values()):
+            values.update(overrides)
+
+        self._climate_sensors: bool = values.get("CLIMATE_SENSORS", "False").lower() in ("true", "1")
+
+        climate_presets = values.get("CLIMATE_PRESETS", "MANUEEL,VORST,NACHT,ECONOMY,COMFORT").split(",")
+        self._climate_presets: list[str] = [x for x in climate_presets if x.strip()]
+
+        binary_sensors = values.get("BINARY_SENSORS", "").split(",")
+        self._binary_sensors: list[str] = [x for x in binary_sensors if x.strip()]
+
+
+    def _reloadable(self) -> dict[str, object]:
+        return {
+            "BINARY_SENSORS": self._binary_sensors,
+            "CLIMATE_PRESETS": self._climate_presets,
+            "CLIMATE_SENSORS": self._climate_sensors,
+        }
+
+
+    def _get_int(self, key: str, default: int) -> int:
+        value = os.environ.get(key, "")
+
+        try:
+            number = int(value)
+        except ValueError:
+            return default
+
+        return number if number >= 0 else default
+
+
+    def _get_float(self, key: str, default: float) -> float:
+        value = os.environ.get(key, "")
+
+        try:
+            number = float(value)
+        except ValueError:
+            return default
+
+        return number if number >= 0 else default
+
+
+    def _get_gateways(self) -> list[tuple[str, str]]:
+        # name=prefix,name=prefix: the prefix has two levels, like the one of the Qbus gateway
+        gateways: list[tuple[str, str]] = []
+
+        for item in os.environ.get("QBUS_GATEWAYS", "").split(","):
+            name, _, prefix = item.strip().rpartition("=")
+            name = name.strip().lower() or prefix.split("/")[0].lower()
+            prefix = prefix.strip().strip("/")
+
+            if not _GATEWAY_NAME_REGEX.match(name) or not _GATEWAY_PREFIX_REGEX.match(prefix):
+                continue
+
+            if any(name == other or prefix == other_prefix for (other, other_prefix) in gateways):
+                continue
+
+            gateways.append((name, prefix))
+
+        return gateways or [("qbus", DEFAULT_GATEWAY_PREFIX)]
@@ -0,0 +1,171 @@
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Iterator
+
+
+class _TimingLoader:
+    def __init__(self, loader, profiler: "StartupProfiler", name: str) -> None:
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+
+    def exec_module(self, module) -> None:
+        # Time spent in nested imports is subtracted, per thread
+        stack = self._profiler._import_stack()
+        start = time.perf_counter()
+        stack.append(0.0)
+
+        try:
+            self._loader.exec_module(module)
+        finally:
+            duration = time.perf_counter() - start
+            nested = stack.pop()
+
+            if stack:
+                stack[-1] += duration
+
+            self._profiler.imports[self._name] = duration - nested
+
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+
+class _TimingFinder:
+    def __init__(self, profiler: "StartupProfiler") -> None:
+        self._profiler = profiler
+
+
+    def find_spec(self, fullname: str, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+
+            spec = finder.find_spec(fullname, path, target)
+
+            if spec is None:
+                continue
+
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimingLoader(spec.loader, self._profiler, fullname)
+
+            return spec
+
+        return None
+
+
+class StartupProfiler:
+    """Reports where the startup time goes, enabled with STARTUP_PROFILE=True.
+
+    Records the time spent importing every module (excluding the modules it
+    imports itself), the time to initialize components and the moments of
+    startup milestones, relative to the start of the profiler.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __new__(cls):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super(StartupProfiler, cls).__new__(cls)
+            # Read before the .env file is loaded, the profiler starts before anything else
+            cls.instance.enabled = os.environ.get("STARTUP_PROFILE", "False").lower() in ("true", "1")
+            cls.instance.started = time.perf_counter()
+            cls.instance.imports = {}
+            cls.instance.components = []
+            cls.instance.milestones = []
+            cls.instance._local = threading.local()
+            cls.instance._finder = None
+            cls.instance._lock = threading.Lock()
+            cls.instance._expected = set()
+            cls.instance._reported = False
+
+        return cls.instance
+
+
+    def install_import_hook(self) -> None:
+        if self.enabled and self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+
+    @contextlib.contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.components.append((name, time.perf_counter() - start))
+
+
+    def expect(self, *names: str) -> None:
+        # The report is logged once all these milestones are reached
+        self._expected.update(names)
+
+
+    def mark(self, name: str) -> None:
+        if not self.enabled or self._reported:
+            return
+
+        with self._lock:
+            self.milestones.append((name, time.perf_counter() - self.started))
+            self._expected.discard(name)
+            complete = not self._expected and not self._reported
+
+        if complete:
+            self.report()
+
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+
+        self._reported = True
+
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+        # Third party modules are grouped by package, qbha modules are listed one by one
+        groups: dict[str, float] = {}
+        src = os.path.dirname(os.path.abspath(__file__))
+
+        for name, duration in self.imports.items():
+            module = sys.modules.get(name)
+            path = getattr(module, "__file__", None) or ""
+            key = name if path.startswith(src) else name.split(".")[0]
+            groups[key] = groups.get(key, 0.0) + duration
+
+        lines = ["Startup profile:", f"  imports ({sum(groups.values()) * 1000:.1f}ms):"]
+        lines += [f"    {name:<48} {duration * 1000:8.1f}ms" for name, duration in sorted(groups.items(), key=lambda item: -item[1])[:25]]
+        lines.append("  components:")
+        lines += [f"    {name:<48} {duration * 1000:8.1f}ms" for name, duration in self.components]
+        lines.append("  milestones:")
+        lines += [f"    {name:<48} {at * 1000:8.1f}ms" for name, at in self.milestones]
+
+        self._logger.info("\n".join(lines))
+
+
+    def _import_stack(self) -> list[float]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        return self._local.stack
+
+
+# Installed on import, so importing this module first times all other imports
+StartupProfiler().install_import_hook()
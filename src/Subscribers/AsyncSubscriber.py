@@ -0,0 +1,46 @@
+import abc
+
+import paho.mqtt.client as mqtt
+
+from Subscribers.Subscriber import Subscriber
+
+
+class AsyncSubscriber(Subscriber, abc.ABC):
+    """Subscriber processed as a coroutine by `AsyncQbha`.
+
+    `process` is used by the thread runtime and `process_async` by the
+    asyncio runtime, so an async subscriber works with both.
+    """
+
+    @abc.abstractmethod
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        ...
+
+
+    @abc.abstractmethod
+    async def process_async(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        ...
+
+
+class SyncSubscriberAdapter(AsyncSubscriber):
+    """Runs a synchronous subscriber on the event loop.
+
+    The wrapped subscriber runs inline on the loop thread, so it must not
+    block. Waiting should be done through the scheduler instead.
+    """
+
+    def __init__(self, subscriber: Subscriber) -> None:
+        super().__init__()
+        self.subscriber = subscriber
+        self.topic = getattr(subscriber, "topic", None)
+        self.topics = subscriber.topics
+        self.qos = subscriber.qos
+        self.labels = subscriber.labels
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        self.subscriber.process(client, msg)
+
+
+    async def process_async(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        self.subscriber.process(client, msg)
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage
+from QbusGateway import QbusGateway
+from Subscribers.Subscriber import Subscriber
+
+
+class HomeAssistantDiscoverySubscriber(Subscriber):
+    """Tracks the retained discovery configs of qbha on the broker.
+
+    Used to only publish discovery messages that are new or changed, and to
+    remove entities that are no longer part of the Qbus config. One per
+    gateway, it only tracks the configs with the unique IDs of its gateway.
+    """
+
+    _DOMAINS = ["binary_sensor", "climate", "cover", "light", "scene", "sensor", "switch"]
+    _logger = logging.getLogger("qbha." + __name__)
+
+    def __init__(self, gateway: QbusGateway) -> None:
+        super().__init__()
+        self.labels = gateway.labels
+        self.topics = [f"homeassistant/{domain}/+/config" for domain in self._DOMAINS]
+        self._gateway = gateway
+        self._lock = threading.Lock()
+        self._retained: dict[str, bytes] = {}
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        if not self._is_owned(msg.topic):
+            return
+
+        with self._lock:
+            if len(msg.payload) <= 0:
+                self._retained.pop(msg.topic, None)
+            else:
+                self._retained[msg.topic] = self._hash(msg.payload)
+
+
+    def reconcile(self, messages: list[DiscoveryMessage]) -> list[DiscoveryMessage]:
+        result: list[DiscoveryMessage] = []
+        desired: set[str] = set()
+        unchanged = 0
+
+        with self._lock:
+            for (topic, payload, qos, retain) in messages:
+                desired.add(topic)
+                current = self._retained.get(topic)
+
+                if payload is None:
+                    if current is None:
+                        continue
+
+                    self._retained.pop(topic)
+                else:
+                    digest = self._hash(payload.encode())
+
+                    if current == digest:
+                        unchanged += 1
+                        continue
+
+                    self._retained[topic] = digest
+
+                result.append((topic, payload, qos, retain))
+
+            orphans = [topic for topic in self._retained if topic not in desired]
+
+            for topic in orphans:
+                self._logger.debug(f"Removing orphaned entity {topic}.")
+                self._retained.pop(topic)
+                result.append((topic, None, 2, True))
+
+        self._logger.info(f"Discovery reconciled: {len(result) - len(orphans)} new or changed, {unchanged} unchanged, {len(orphans)} orphaned.")
+        return result
+
+
+    def _is_owned(self, topic: str) -> bool:
+        # homeassistant/<domain>/<object_id>/config
+        parts = topic.split("/")
+        return len(parts) == 4 and self._gateway.owns_unique_id(parts[2])
+
+
+    def _hash(self, payload: bytes) -> bytes:
+        return hashlib.sha1(payload).digest()
@@ -1,6 +1,7 @@
-import json
 import logging
-from QbusConfigService import QbusConfigService
+from GetStateService import GetStateService
+from QbusGateway import QbusGateway
+from Subscribers.QbusEntityShadowSubscriber import QbusEntityShadowSubscriber
 from Subscribers.Subscriber import Subscriber
 import paho.mqtt.client as mqtt
 
@@ -8,9 +9,13 @@ import paho.mqtt.client as mqtt
 class HomeAssistantStatusSubscriber(Subscriber):
     _logger = logging.getLogger("qbha." + __name__)
 
-    def __init__(self) -> None:
+    def __init__(self, gateway: QbusGateway, get_state: GetStateService, shadow: QbusEntityShadowSubscriber | None = None) -> None:
         super().__init__()
+        self.labels = gateway.labels
         self.topic = "homeassistant/status"
+        self._gateway = gateway
+        self._get_state = get_state
+        self._shadow = shadow
 
 
     def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
@@ -22,9 +27,13 @@ class HomeAssistantStatusSubscriber(Subscriber):
         # Gather IDs to retrieve state for
         states = []
 
-        for entity in QbusConfigService.get_entities():
+        for entity in self._gateway.config.get_entities():
             states.append(entity.id)
 
+        # Known states are answered right away, only stale ones go to the gateway
+        if self._shadow is not None:
+            states = self._shadow.republish(client, states)
+
         if len(states) > 0:
             # Publish to MQTT
-            client.publish("cloudapp/QBUSMQTTGW/getState", json.dumps(states))
+            self._get_state.request(states)
@@ -0,0 +1,142 @@
+import json
+import logging
+import threading
+from typing import Callable
+
+import paho.mqtt.client as mqtt
+
+from Metrics import Metrics
+from Scheduler import ScheduledCall, Scheduler
+from Settings import Settings
+from Subscribers.Subscriber import Subscriber
+
+_STANDBY = "standby"
+_CANDIDATE = "candidate"
+_LEADER = "leader"
+
+
+class LeaderElectionSubscriber(Subscriber):
+    """Elects one leader among the qbha instances connected to the broker.
+
+    The leader holds a retained lock with a lease and renews it every third
+    of the lease. A standby claims the lock when there is none or when it
+    was not renewed within its lease, and becomes leader when its claim is
+    still the last one a heartbeat later. Should two instances end up as
+    leader, the one with the lowest instance id keeps the lock.
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+
+
+    def __init__(self, client: mqtt.Client, scheduler: Scheduler, instance_id: str, lock_topic: str = "qbha/leader") -> None:
+        super().__init__()
+        self.topic = lock_topic
+        self.qos = 1
+
+        self._client = client
+        self._scheduler = scheduler
+        self._instance_id = instance_id
+        self._lease = self._settings.LeaderLease
+        self._interval = self._lease / 3
+        self._lock = threading.Lock()
+        self._state = _STANDBY
+        self._owner: str | None = None
+        self._owner_lease = self._lease
+        # Last lock message, a missing lock is claimed one heartbeat after the start
+        self._seen = scheduler.time()
+        self._listeners: list[Callable[[], None]] = []
+        self._closed = False
+        self._tick: ScheduledCall | None = scheduler.call_later(self._interval, self._on_tick)
+
+        metrics = Metrics()
+        metrics.gauge("qbha_leader", "1 when this instance is the leader.", callback=lambda: 1 if self.is_leader else 0)
+        self._elections = metrics.counter("qbha_leader_elections_total", "Number of times this instance became the leader.")
+
+
+    @property
+    def instance_id(self) -> str:
+        return self._instance_id
+
+
+    @property
+    def is_leader(self) -> bool:
+        return self._state == _LEADER
+
+
+    def on_elected(self, callback: Callable[[], None]) -> None:
+        self._listeners.append(callback)
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        owner: str | None = None
+        lease = self._lease
+
+        if len(msg.payload) > 0:
+            try:
+                lock = json.loads(msg.payload)
+                owner = str(lock["owner"])
+                lease = float(lock.get("lease", self._lease))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self._logger.warning(f"Ignoring invalid leader lock {msg.payload!r}.")
+                return
+
+        with self._lock:
+            self._owner = owner
+            self._owner_lease = lease
+            self._seen = self._scheduler.time()
+
+            if self._state != _LEADER or owner is None or owner >= self._instance_id:
+                return
+
+            self._state = _STANDBY
+
+        self._logger.warning(f"Instance '{owner}' also holds the leader lock, continuing as standby.")
+
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+            if self._tick is not None:
+                self._tick.cancel()
+                self._tick = None
+
+
+    def _on_tick(self) -> None:
+        claim = False
+        elected = False
+
+        with self._lock:
+            if self._closed:
+                return
+
+            expired = self._scheduler.time() - self._seen > (self._owner_lease if self._owner is not None else self._interval)
+
+            if not self._client.is_connected():
+                # Someone else takes over when we cannot renew the lease
+                if self._state != _STANDBY:
+                    self._logger.warning("Disconnected from MQTT, continuing as standby.")
+
+                self._state = _STANDBY
+            elif self._state == _LEADER:
+                claim = True
+            elif self._state == _CANDIDATE:
+                elected = self._owner == self._instance_id
+                self._state = _LEADER if elected else _STANDBY
+                claim = elected
+            elif self._owner == self._instance_id or expired:
+                self._state = _CANDIDATE
+                claim = True
+
+            self._tick = self._scheduler.call_later(self._interval, self._on_tick)
+
+        if claim:
+            self._client.publish(self.topic, json.dumps({"owner": self._instance_id, "lease": self._lease}), 1, True)
+
+        if elected:
+            self._logger.info(f"Instance '{self._instance_id}' is now the leader.")
+            self._elections.inc()
+
+            for callback in self._listeners:
+                callback()
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import paho.mqtt.client as mqtt
+
+from BulkPublisher import BulkPublish, BulkPublisher
+from HomeAssistantModels.HomeAssistantMessage import DiscoveryMessage
+from Metrics import Metrics
+from QbusConfigIndex import EntityWithController
+from QbusGateway import QbusGateway
+from Subscribers.AsyncSubscriber import AsyncSubscriber
+from Subscribers.QbusEntityShadowSubscriber import QbusEntityShadowSubscriber
+
+# Entities that only report a state
+_READ_ONLY_TYPES = ("gauge", "ventilation")
+
+
+class QbhaCommandSubscriber(AsyncSubscriber):
+    """Executes a batch of entity commands received on the qbha command topic.
+
+    A command names entities (by id or ref id) with the properties to set,
+    and/or a group: a named group from `commandgroups.json` in the data
+    folder or a Qbus location, optionally filtered on entity type, with the
+    properties to set on all of them. For example:
+
+        {"id": "all-off", "group": "Floor 1", "type": "onoff", "properties": {"value": false}}
+        {"entities": {"UL15": {"value": 50}, "1/12/3": {"state": "down"}}}
+
+    The gateway only accepts a setState per entity, so those are grouped per
+    controller and interleaved, entities already in the requested state are
+    skipped (unless "force" is set) and the messages go out through the bulk
+    publisher. The result is published to the command topic + "/result".
+    """
+
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, gateway: QbusGateway, publisher: BulkPublisher, shadow: QbusEntityShadowSubscriber | None = None) -> None:
+        super().__init__()
+        self.labels = gateway.labels
+        self.topic = gateway.qbha_topic("command")
+        self.qos = 1
+
+        self._gateway = gateway
+        self._publisher = publisher
+        self._shadow = shadow
+        self._groups_path = f"{gateway.data_folder}commandgroups.json"
+
+        metrics = Metrics()
+        self._commands = metrics.counter("qbha_commands_total", "Number of bulk commands received.", gateway.labels)
+        self._sent = metrics.counter("qbha_command_entities_sent_total", "Number of setState messages sent for bulk commands.", gateway.labels)
+        self._skipped = metrics.counter("qbha_command_entities_skipped_total", "Number of entities of bulk commands already in the requested state.", gateway.labels)
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        started = time.monotonic()
+        command = self._parse(client, msg)
+
+        if command is None:
+            return
+
+        groups = self._load_groups() if command.get("group") is not None else {}
+        self._execute(client, command, groups, started)
+
+
+    async def process_async(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        started = time.monotonic()
+        command = self._parse(client, msg)
+
+        if command is None:
+            return
+
+        # The groups file is read off the loop
+        groups = await asyncio.get_running_loop().run_in_executor(None, self._load_groups) if command.get("group") is not None else {}
+        self._execute(client, command, groups, started)
+
+
+    def _parse(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> dict | None:
+        if len(msg.payload) <= 0:
+            return None
+
+        try:
+            command = json.loads(msg.payload)
+        except ValueError as exception:
+            self._reject(client, None, f"invalid JSON: {exception}")
+            return None
+
+        if not isinstance(command, dict):
+            self._reject(client, None, "expected a JSON object")
+            return None
+
+        if not isinstance(command.get("entities") or {}, dict):
+            self._reject(client, command.get("id"), "'entities' should be an object")
+            return None
+
+        return command
+
+
+    def _execute(self, client: mqtt.Client, command: dict, groups: dict[str, list[str]], started: float) -> None:
+        self._commands.inc()
+        result: dict = {"id": command.get("id"), "unknown": [], "unsupported": [], "skipped": 0, "controllers": {}}
+        targets: dict[str, tuple[EntityWithController, dict]] = {}
+
+        # Named entities are resolved first, so they override the group properties
+        properties = command.get("properties")
+
+        if command.get("group") is not None and isinstance(properties, dict):
+            for item in self._resolve_group(groups, str(command["group"]), command.get("type")):
+                targets[item[0].id] = (item, properties)
+
+        for key, entity_properties in (command.get("entities") or {}).items():
+            item = self._gateway.config.find_entity_with_controller_by_id(key) or self._gateway.config.find_entity_with_controller_by_ref_id(key)
+
+            if item is None:
+                result["unknown"].append(key)
+                continue
+
+            if not isinstance(entity_properties, dict):
+                entity_properties = {"value": entity_properties}
+
+            targets[item[0].id] = (item, entity_properties)
+
+        messages = self._create_messages(targets, bool(command.get("force")), result)
+        self._logger.debug(f"Command {result['id']}: {len(messages)} setState messages, {result['skipped']} skipped, {len(result['unknown'])} unknown.")
+        self._sent.inc(len(messages))
+        self._skipped.inc(result["skipped"])
+
+        self._publisher.publish(client, messages, lambda publish: self._completed(client, publish, result, started))
+
+
+    def _resolve_group(self, groups: dict[str, list[str]], group: str, type: str | None) -> list[EntityWithController]:
+        members = groups.get(group)
+
+        if members is None:
+            items = self._gateway.config.get_entities_by_location(group)
+        else:
+            items = []
+
+            for key in members:
+                item = self._gateway.config.find_entity_with_controller_by_id(key) or self._gateway.config.find_entity_with_controller_by_ref_id(key)
+
+                if item is not None:
+                    items.append(item)
+
+        if type is None:
+            return items
+
+        return [item for item in items if isinstance(item[0].type, str) and item[0].type.lower() == str(type).lower()]
+
+
+    def _create_messages(self, targets: dict[str, tuple[EntityWithController, dict]], force: bool, result: dict) -> list[DiscoveryMessage]:
+        per_controller: dict[str, list[DiscoveryMessage]] = {}
+
+        for entity_id, ((entity, controller), properties) in targets.items():
+            type = entity.type.lower() if isinstance(entity.type, str) else ""
+
+            if type in _READ_ONLY_TYPES:
+                result["unsupported"].append(entity_id)
+                continue
+
+            if type == "scene":
+                payload = {"id": entity_id, "type": "action", "action": "active"}
+            elif not force and self._shadow is not None and self._shadow.matches(entity_id, properties):
+                result["skipped"] += 1
+                continue
+            else:
+                payload = {"id": entity_id, "type": "state", "properties": properties}
+
+            topic = self._gateway.topic(controller.id, entity_id, "setState")
+            per_controller.setdefault(controller.id, []).append((topic, json.dumps(payload), 1, False))
+
+        result["controllers"] = {controller_id: len(items) for controller_id, items in per_controller.items()}
+
+        # Round robin over the controllers, a large controller does not hold up the others
+        messages: list[DiscoveryMessage] = []
+        queues = list(per_controller.values())
+
+        for index in range(max((len(queue) for queue in queues), default=0)):
+            messages.extend(queue[index] for queue in queues if index < len(queue))
+
+        return messages
+
+
+    def _completed(self, client: mqtt.Client, publish: BulkPublish, result: dict, started: float) -> None:
+        result["sent"] = publish.published
+        result["status"] = "cancelled" if publish.cancelled else "done"
+        result["duration"] = round(time.monotonic() - started, 3)
+        client.publish(f"{self.topic}/result", json.dumps(result), 1)
+
+
+    def _reject(self, client: mqtt.Client, id, error: str) -> None:
+        self._logger.warning(f"Ignoring invalid command: {error}.")
+        client.publish(f"{self.topic}/result", json.dumps({"id": id, "status": "error", "error": error}), 1)
+
+
+    def _load_groups(self) -> dict[str, list[str]]:
+        if not os.path.isfile(self._groups_path):
+            return {}
+
+        try:
+            with open(self._groups_path, "r") as file:
+                groups = json.load(file)
+        except (OSError, ValueError) as exception:
+            self._logger.warning(f"Ignoring invalid command groups: {exception}.")
+            return {}
+
+        return {str(name): [str(member) for member in members] for name, members in groups.items() if isinstance(members, list)} if isinstance(groups, dict) else {}
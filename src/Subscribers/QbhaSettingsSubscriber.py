@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+
+import paho.mqtt.client as mqtt
+
+from QbusConfigPipeline import QbusConfigPipeline
+from Scheduler import ScheduledCall, Scheduler
+from Settings import RELOADABLE_SETTINGS, Settings
+from Subscribers.Subscriber import Subscriber
+
+
+class QbhaSettingsSubscriber(Subscriber):
+    """Reloads settings from `settings.json` in the data folder or the qbha/settings topic.
+
+    Both take a JSON object with the settings to override, e.g.
+    {"BINARY_SENSORS": ["UL15", "Garage"], "CLIMATE_SENSORS": true}. When a
+    setting changes, only the discovery messages of the entities that depend
+    on it are rebuilt and republished. The entity rules of the gateways
+    are checked for changes at the same interval.
+    """
+
+    _POLL_INTERVAL = 5
+    _SETTINGS_TOPIC = "qbha/settings"
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+
+
+    def __init__(self, client: mqtt.Client, scheduler: Scheduler, pipelines: list[QbusConfigPipeline]) -> None:
+        super().__init__()
+        self.topic = self._SETTINGS_TOPIC
+
+        self._client = client
+        self._scheduler = scheduler
+        self._pipelines = pipelines
+        self._path = f"{self._settings.DataFolder}settings.json"
+        self._lock = threading.Lock()
+        self._mtime: float | None = None
+        self._closed = False
+
+        # Before any config is processed, so no rediscovery is needed yet
+        self._check_file(rediscover=False)
+        self._poll: ScheduledCall | None = scheduler.call_later(self._POLL_INTERVAL, self._on_poll)
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        try:
+            values = json.loads(msg.payload) if len(msg.payload) > 0 else {}
+        except ValueError as exception:
+            self._logger.warning(f"Ignoring invalid settings message: {exception}.")
+            return
+
+        self._reload("mqtt", values, True)
+
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+            if self._poll is not None:
+                self._poll.cancel()
+                self._poll = None
+
+
+    def _on_poll(self) -> None:
+        self._check_file(rediscover=True)
+
+        for pipeline in self._pipelines:
+            pipeline.check_rules(self._client)
+
+        with self._lock:
+            if not self._closed:
+                self._poll = self._scheduler.call_later(self._POLL_INTERVAL, self._on_poll)
+
+
+    def _check_file(self, rediscover: bool) -> None:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime == self._mtime:
+            return
+
+        self._mtime = mtime
+        values = {}
+
+        if mtime is not None:
+            try:
+                with open(self._path, "r") as file:
+                    values = json.load(file)
+            except (OSError, ValueError) as exception:
+                self._logger.warning(f"Ignoring invalid settings file: {exception}.")
+                return
+
+        self._reload("file", values, rediscover)
+
+
+    def _reload(self, source: str, values: dict, rediscover: bool) -> None:
+        if not isinstance(values, dict):
+            self._logger.warning(f"Ignoring invalid settings ({source}), expected an object.")
+            return
+
+        unknown = [key for key in values if key not in RELOADABLE_SETTINGS]
+
+        if unknown:
+            self._logger.warning(f"Settings {unknown} can not be reloaded, only {list(RELOADABLE_SETTINGS)}.")
+
+        with self._lock:
+            changed = self._settings.reload(source, {key: self._to_str(value) for key, value in values.items()})
+
+        if not changed:
+            return
+
+        self._logger.info(f"Settings {changed} changed ({source}).")
+
+        if rediscover:
+            for pipeline in self._pipelines:
+                pipeline.rediscover(self._client)
+
+
+    def _to_str(self, value) -> str:
+        if isinstance(value, list):
+            return ",".join(str(item) for item in value)
+
+        return str(value)
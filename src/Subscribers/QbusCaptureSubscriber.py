@@ -1,15 +1,38 @@
+from __future__ import annotations
+
 import logging
+from typing import TYPE_CHECKING
+from Capture.CaptureWriter import CaptureWriter
+from Settings import Settings
 from Subscribers.Subscriber import Subscriber
 import paho.mqtt.client as mqtt
 
+# Imported by main before anything heavy, QbusGateway pulls in the models
+if TYPE_CHECKING:
+    from QbusGateway import QbusGateway
+
 
 class QbusCaptureSubscriber(Subscriber):
     _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
 
-    def __init__(self) -> None:
+    def __init__(self, gateway: QbusGateway) -> None:
         super().__init__()
-        self.topic = "cloudapp/QBUSMQTTGW/#"
+        self.labels = gateway.labels
+        self.topic = gateway.topic("#")
+        self._writer: CaptureWriter | None = None
+
+        if self._settings.QbusCaptureFormat == "binary":
+            self._writer = CaptureWriter(gateway.data_folder, compress=self._settings.QbusCaptureCompress)
 
 
     def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
-        self._logger.debug(f"{msg.topic} {msg.payload.decode().strip()}")
+        if self._writer is not None:
+            self._writer.append(msg.topic, msg.payload)
+        else:
+            self._logger.debug(f"{msg.topic} {msg.payload.decode().strip()}")
+
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import threading
+
+import paho.mqtt.client as mqtt
+
+from BulkPublisher import BulkPublisher
+from Metrics import Metrics
+from QbusGateway import QbusGateway
+from QbusHelpers import SHADOW_REPLAY_KEY, is_shadow_replay
+from Scheduler import ScheduledCall, Scheduler
+from Subscribers.Subscriber import Subscriber
+
+
+class _ShadowEntry:
+    __slots__ = ("topic", "properties", "fresh")
+
+    def __init__(self, topic: str, properties: dict, fresh: bool) -> None:
+        self.topic = topic
+        self.properties = properties
+        # Only a state received from the gateway since the last (re)connect is fresh
+        self.fresh = fresh
+
+
+class QbusEntityShadowSubscriber(Subscriber):
+    """Keeps the last known state of every entity.
+
+    Full states replace the properties of an entity, events are merged into
+    them. The shadow is snapshotted to the data folder and entries loaded
+    from the snapshot, or kept over a reconnect, are stale until the gateway
+    reports them again.
+    """
+
+    _SNAPSHOT_INTERVAL = 60
+    _QBHA_AVAILABILITY_TOPIC = "qbha/availability"
+    _VERSION = 1
+    _logger = logging.getLogger("qbha." + __name__)
+
+
+    def __init__(self, gateway: QbusGateway, scheduler: Scheduler, publisher: BulkPublisher) -> None:
+        super().__init__()
+        self.labels = gateway.labels
+        self.topic = gateway.topic("+", "+", "state")
+        # Our own birth message tells us we (re)connected and may have missed events
+        self.topics = [self._QBHA_AVAILABILITY_TOPIC]
+
+        self._scheduler = scheduler
+        self._publisher = publisher
+        self._path = f"{gateway.data_folder}stateshadow.json"
+        self._lock = threading.Lock()
+        self._entries: dict[str, _ShadowEntry] = self._load()
+        self._dirty = False
+        self._snapshot: ScheduledCall | None = None
+
+        metrics = Metrics()
+        metrics.gauge("qbha_shadow_entities", "Number of entities in the state shadow.", gateway.labels, callback=lambda: len(self._entries))
+        self._republished = metrics.counter("qbha_shadow_republished_total", "Number of states republished from the shadow.", gateway.labels)
+        self._stale = metrics.counter("qbha_shadow_stale_total", "Number of stale states requested from the gateway on a Home Assistant birth.", gateway.labels)
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        if msg.topic == self._QBHA_AVAILABILITY_TOPIC:
+            if msg.payload == b"online":
+                self._invalidate()
+
+            return
+
+        if len(msg.payload) <= 0:
+            return
+
+        try:
+            state = json.loads(msg.payload)
+        except ValueError:
+            return
+
+        # Our own republished states come back as well
+        if not isinstance(state, dict) or not isinstance(state.get("properties"), dict) or is_shadow_replay(state):
+            return
+
+        type = state.get("type")
+
+        if type != "state" and type != "event":
+            return
+
+        entity_id = msg.topic.rsplit("/", 2)[-2]
+
+        with self._lock:
+            entry = self._entries.get(entity_id)
+
+            if entry is None:
+                entry = self._entries[entity_id] = _ShadowEntry(msg.topic, {}, False)
+
+            if type == "state":
+                entry.properties = state["properties"]
+                entry.fresh = True
+            else:
+                entry.properties = {**entry.properties, **state["properties"]}
+
+            entry.topic = msg.topic
+            self._dirty = True
+
+            if self._snapshot is None:
+                self._snapshot = self._scheduler.call_later(self._SNAPSHOT_INTERVAL, self._save)
+
+
+    def republish(self, client: mqtt.Client, entity_ids: list[str]) -> list[str]:
+        """Republishes the known states and returns the ids to request from the gateway."""
+        messages = []
+        stale: list[str] = []
+
+        with self._lock:
+            for entity_id in entity_ids:
+                entry = self._entries.get(entity_id)
+
+                if entry is None:
+                    stale.append(entity_id)
+                    continue
+
+                if not entry.fresh:
+                    stale.append(entity_id)
+
+                payload = json.dumps({"id": entity_id, "type": "state", "properties": entry.properties, SHADOW_REPLAY_KEY: True})
+                messages.append((entry.topic, payload, 0, False))
+
+        self._republished.inc(len(messages))
+        self._stale.inc(len(stale))
+        self._logger.debug(f"Republishing {len(messages)} states from the shadow, {len(stale)} stale.")
+        self._publisher.publish(client, messages)
+
+        return stale
+
+
+    def matches(self, entity_id: str, properties: dict) -> bool:
+        """Whether the entity is known to be in a state with these properties."""
+        with self._lock:
+            entry = self._entries.get(entity_id)
+
+            if entry is None or not entry.fresh:
+                return False
+
+            return all(entry.properties.get(key) == value for key, value in properties.items())
+
+
+    def close(self) -> None:
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.cancel()
+
+        self._save()
+
+
+    def _invalidate(self) -> None:
+        with self._lock:
+            for entry in self._entries.values():
+                entry.fresh = False
+
+
+    def _load(self) -> dict[str, _ShadowEntry]:
+        if not os.path.isfile(self._path):
+            return {}
+
+        try:
+            with open(self._path, "r") as file:
+                data = json.load(file)
+
+            if data.get("version") != self._VERSION:
+                return {}
+
+            return {
+                entity_id: _ShadowEntry(topic, properties, False)
+                for entity_id, (topic, properties) in data["entities"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError) as exception:
+            self._logger.warning(f"Ignoring invalid state shadow: {exception}.")
+            return {}
+
+
+    def _save(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+            if not self._dirty:
+                return
+
+            data = {
+                "version": self._VERSION,
+                "entities": {entity_id: [entry.topic, entry.properties] for entity_id, entry in self._entries.items()},
+            }
+            self._dirty = False
+
+        try:
+            with open(f"{self._path}.tmp", "w") as file:
+                json.dump(data, file)
+
+            os.replace(f"{self._path}.tmp", self._path)
+        except OSError as exception:
+            self._logger.warning(f"Unable to save state shadow: {exception}.")
@@ -1,83 +1,134 @@
-import json
 import logging
-import queue
 import threading
 import paho.mqtt.client as mqtt
-from pydantic import TypeAdapter
-from QbusConfigService import QbusConfigService
+from GetStateService import PRIORITY_HIGH, GetStateService
+from Metrics import Metrics
+from QbusGateway import QbusGateway
+from QbusHelpers import get_type_adapter
 from QbusMqttModels.QbusEntityState import QbusEntityState
+from Scheduler import ScheduledCall, Scheduler
 from Subscribers.Subscriber import Subscriber
 
 
 class QbusEntityStateSubscriber(Subscriber):
-    _WAIT_TIME = 3
+    """Requests the state of thermostats after they report an event.
+
+    Every thermostat gets a deadline: a debounce after its last event, but
+    never later than a maximum wait after its first one. A single timer is
+    armed for the earliest deadline, so nothing wakes up while idle and
+    thermostats that are due around the same time share one getState.
+    """
+
+    _DEBOUNCE = 1.0
+    _MAX_WAIT = 3.0
+    # Thermostats due within this window are requested in the same batch
+    _BATCH_WINDOW = 0.5
     _logger = logging.getLogger("qbha." + __name__)
 
 
-    def __init__(self, client: mqtt.Client) -> None:
+    def __init__(self, gateway: QbusGateway, get_state: GetStateService, scheduler: Scheduler) -> None:
         super().__init__()
+        self.labels = gateway.labels
 
-        self.mqtt_client = client
+        self._gateway = gateway
+        self._get_state = get_state
 
-        self.topic = "cloudapp/QBUSMQTTGW/+/+/state"
-        self._type_adapter = TypeAdapter(QbusEntityState)
+        self.topic = gateway.topic("+", "+", "state")
 
-        self._items = queue.SimpleQueue()
-        self._kill = threading.Event()
-        self._throttle = threading.Thread(target=self._process_queue)
-        self._throttle.start()
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        # entity id -> (first event, deadline), insertion ordered
+        self._pending: dict[str, tuple[float, float]] = {}
+        self._timer: ScheduledCall | None = None
+        self._timer_deadline = 0.0
+        self._closed = False
+
+        metrics = Metrics()
+        metrics.gauge("qbha_thermostat_queue_depth", "Number of thermostats waiting for a state refresh.", gateway.labels, callback=lambda: len(self._pending))
+        self._events = metrics.counter("qbha_thermostat_events_total", "Number of thermostat events received.", gateway.labels)
+        self._refreshes = metrics.counter("qbha_thermostat_refreshes_total", "Number of thermostat states requested.", gateway.labels)
+        self._latency = metrics.histogram("qbha_thermostat_refresh_latency_seconds", "Time between the first event of a thermostat and its state request.", gateway.labels, buckets=(0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 5.0))
+        metrics.gauge("qbha_thermostat_coalescing_ratio", "Thermostat events per state request.", gateway.labels, callback=lambda: self._events.value / self._refreshes.value if self._refreshes.value else 0)
 
 
     def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
         if len(msg.payload) <= 0:
             return
 
-        payload = self._type_adapter.validate_json(msg.payload)
+        # Most state messages are not thermostat events, reject those before
+        # validating: the topic holds the entity id and an event payload
+        # always contains the literal "event".
+        if msg.topic.rsplit("/", 2)[-2] not in self._gateway.config.get_entity_ids_by_type("thermo"):
+            return
+
+        if b'"event"' not in msg.payload:
+            return
+
+        payload = get_type_adapter(QbusEntityState).validate_json(msg.payload)
 
         # Skip if not an event
         if payload.type != "event":
             return
 
         # Find entity
-        entity = QbusConfigService.find_entity_by_id(payload.id)
+        entity = self._gateway.config.find_entity_by_id(payload.id)
 
         if entity is None or entity.type != "thermo":
             return
 
-        # Add to queue
-        self._items.put(entity.id)
+        self._events.inc()
+        now = self._scheduler.time()
+
+        with self._lock:
+            if self._closed:
+                return
+
+            first, _ = self._pending.get(entity.id, (now, 0.0))
+            deadline = min(now + self._DEBOUNCE, first + self._MAX_WAIT)
+            self._pending[entity.id] = (first, deadline)
+
+            if self._timer is None or deadline < self._timer_deadline:
+                self._arm(deadline)
 
 
     def close(self) -> None:
-        self._kill.set()
+        with self._lock:
+            self._closed = True
 
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
 
-    def _process_queue(self) -> None:
-        self._kill.wait(self._WAIT_TIME)
 
-        while True:
-            size = self._items.qsize()
-            entity_ids = []
+    def _arm(self, deadline: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
 
-            try:
-                for _ in range(size):
-                    item = self._items.get()
+        self._timer = self._scheduler.call_at(deadline, self._process_queue)
+        self._timer_deadline = deadline
+
+
+    def _process_queue(self) -> None:
+        now = self._scheduler.time()
+        entity_ids: list[str] = []
 
-                    if item not in entity_ids:
-                        entity_ids.append(item)
-            except queue.Empty:
-                pass
+        with self._lock:
+            self._timer = None
 
-            # Publish to MQTT
-            if len(entity_ids) > 0:
-                self._logger.debug(f"Requesting state for thermostat {entity_ids}.")
-                self.mqtt_client.publish("cloudapp/QBUSMQTTGW/getState", json.dumps(entity_ids))
+            if self._closed:
+                return
 
-            # If no kill signal is set, sleep for the interval.
-            # If kill signal comes in while sleeping, immediately wake up and handle.
-            is_killed = self._kill.wait(self._WAIT_TIME)
+            for entity_id, (first, deadline) in list(self._pending.items()):
+                if deadline <= now + self._BATCH_WINDOW:
+                    del self._pending[entity_id]
+                    entity_ids.append(entity_id)
+                    self._latency.observe(now - first)
 
-            if is_killed:
-                break
+            if self._pending:
+                self._arm(min(deadline for (_, deadline) in self._pending.values()))
 
-        self._logger.debug("Killing thread.")
+        # Publish to MQTT
+        if len(entity_ids) > 0:
+            self._refreshes.inc(len(entity_ids))
+            self._logger.debug(f"Requesting state for thermostat {entity_ids}.")
+            self._get_state.request(entity_ids, PRIORITY_HIGH)
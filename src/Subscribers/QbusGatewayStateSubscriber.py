@@ -1,8 +1,9 @@
 import logging
 
 import paho.mqtt.client as mqtt
-from pydantic import TypeAdapter
 
+from QbusGateway import QbusGateway
+from QbusHelpers import get_type_adapter
 from QbusMqttModels.QbusGatewayState import QbusGatewayState
 from Subscribers.Subscriber import Subscriber
 
@@ -10,17 +11,18 @@ from Subscribers.Subscriber import Subscriber
 class QbusGatewayStateSubscriber(Subscriber):
     _logger = logging.getLogger("qbha." + __name__)
 
-    def __init__(self) -> None:
+    def __init__(self, gateway: QbusGateway) -> None:
         super().__init__()
-        self.topic = "cloudapp/QBUSMQTTGW/state"
-        self._type_adapter = TypeAdapter(QbusGatewayState)
+        self.labels = gateway.labels
+        self.topic = gateway.topic("state")
+        self._gateway = gateway
 
 
     def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
         if len(msg.payload) <= 0:
             return
 
-        state = self._type_adapter.validate_json(msg.payload)
+        state = get_type_adapter(QbusGatewayState).validate_json(msg.payload)
 
         if state is not None and state.online is True:
-            client.publish("cloudapp/QBUSMQTTGW/getConfig", b"")
+            client.publish(self._gateway.topic("getConfig"), b"")
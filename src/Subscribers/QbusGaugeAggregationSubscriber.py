@@ -0,0 +1,220 @@
+import collections
+import json
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+from Metrics import Metrics
+from QbusGateway import QbusGateway
+from QbusHelpers import is_shadow_replay
+from Scheduler import ScheduledCall, Scheduler
+from Settings import Settings
+from Subscribers.Subscriber import Subscriber
+
+# Units of meter readings, for those the last value is published instead of the mean
+_TOTAL_UNITS = ("kWh", "L", "l")
+
+
+class _GaugeSeries:
+    __slots__ = ("samples", "total", "published")
+
+    def __init__(self, size: int, total: bool) -> None:
+        self.samples: collections.deque[tuple[float, float]] = collections.deque(maxlen=size)
+        self.total = total
+        self.published: float | None = None
+
+
+class _GaugeEntity:
+    __slots__ = ("series", "flushed_at")
+
+    def __init__(self) -> None:
+        self.series: dict[str, _GaugeSeries] = {}
+        self.flushed_at = float("-inf")
+
+
+class QbusGaugeAggregationSubscriber(Subscriber):
+    """Downsamples gauge states to the qbha gauge topics Home Assistant subscribes to.
+
+    The numeric properties of every gauge are kept in ring buffers. A gauge
+    is published at most once per interval, with the mean of the samples in
+    the last interval (the last value for meter readings) and their min and
+    max. A measurement that changed less than the deadband since it was last
+    published is not published again.
+    """
+
+    _RING_SIZE = 256
+    _logger = logging.getLogger("qbha." + __name__)
+    _settings = Settings()
+
+
+    def __init__(self, gateway: QbusGateway, scheduler: Scheduler) -> None:
+        super().__init__()
+        self.labels = gateway.labels
+        self.topic = gateway.topic("+", "+", "state")
+
+        self._gateway = gateway
+        self._scheduler = scheduler
+        self._interval = self._settings.GaugeInterval
+        self._deadband = self._settings.GaugeDeadband / 100
+        self._lock = threading.Lock()
+        self._entities: dict[str, _GaugeEntity] = {}
+        # entity id -> (topic, deadline), insertion ordered
+        self._pending: dict[str, tuple[str, float]] = {}
+        self._timer: ScheduledCall | None = None
+        self._timer_deadline = 0.0
+        self._client: mqtt.Client | None = None
+        self._closed = False
+
+        metrics = Metrics()
+        self._samples = metrics.counter("qbha_gauge_samples_total", "Number of gauge states aggregated.", gateway.labels)
+        self._published = metrics.counter("qbha_gauge_published_total", "Number of aggregated gauge states published.", gateway.labels)
+        self._suppressed = metrics.counter("qbha_gauge_suppressed_total", "Number of aggregated gauge states within the deadband.", gateway.labels)
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        if len(msg.payload) <= 0:
+            return
+
+        (controller_id, entity_id) = msg.topic.rsplit("/", 3)[-3:-1]
+
+        if entity_id not in self._gateway.config.get_entity_ids_by_type("gauge"):
+            return
+
+        try:
+            state = json.loads(msg.payload)
+        except ValueError:
+            return
+
+        # States republished from the shadow are no new samples
+        properties = state.get("properties") if isinstance(state, dict) and not is_shadow_replay(state) else None
+
+        if not isinstance(properties, dict):
+            return
+
+        values = {
+            key: float(value)
+            for key, value in properties.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+
+        if not values:
+            return
+
+        self._samples.inc()
+        now = self._scheduler.time()
+
+        with self._lock:
+            if self._closed:
+                return
+
+            self._client = client
+            entity = self._entities.get(entity_id)
+
+            if entity is None:
+                entity = self._entities[entity_id] = _GaugeEntity()
+
+            for key, value in values.items():
+                series = entity.series.get(key)
+
+                if series is None:
+                    series = entity.series[key] = _GaugeSeries(self._RING_SIZE, self._is_total(entity_id, key))
+
+                series.samples.append((now, value))
+
+            if entity_id in self._pending:
+                return
+
+            deadline = max(now, entity.flushed_at + self._interval)
+            self._pending[entity_id] = (self._gateway.qbha_topic("gauge", controller_id, entity_id, "state"), deadline)
+
+            if self._timer is None or deadline < self._timer_deadline:
+                self._arm(deadline)
+
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+    def _arm(self, deadline: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+
+        self._timer = self._scheduler.call_at(deadline, self._flush)
+        self._timer_deadline = deadline
+
+
+    def _flush(self) -> None:
+        now = self._scheduler.time()
+        messages: list[tuple[str, str]] = []
+
+        with self._lock:
+            self._timer = None
+
+            if self._closed:
+                return
+
+            for entity_id, (topic, deadline) in list(self._pending.items()):
+                if deadline > now:
+                    continue
+
+                del self._pending[entity_id]
+                entity = self._entities[entity_id]
+                entity.flushed_at = now
+                payload = self._aggregate(entity_id, entity, now)
+
+                if payload is None:
+                    self._suppressed.inc()
+                else:
+                    messages.append((topic, payload))
+
+            if self._pending:
+                self._arm(min(deadline for (_, deadline) in self._pending.values()))
+
+            client = self._client
+
+        for (topic, payload) in messages:
+            client.publish(topic, payload, 0, True)
+
+        self._published.inc(len(messages))
+
+
+    def _aggregate(self, entity_id: str, entity: _GaugeEntity, now: float) -> str | None:
+        properties: dict[str, float] = {}
+        minimum: dict[str, float] = {}
+        maximum: dict[str, float] = {}
+        changed = False
+
+        for key, series in entity.series.items():
+            window = [value for (at, value) in series.samples if at > now - self._interval] or [series.samples[-1][1]]
+            value = window[-1] if series.total else sum(window) / len(window)
+
+            if series.published is None:
+                changed = True
+            elif series.total:
+                changed = changed or value != series.published
+            else:
+                changed = changed or abs(value - series.published) > abs(series.published) * self._deadband
+
+            properties[key] = round(value, 3)
+            minimum[key] = min(window)
+            maximum[key] = max(window)
+
+        if not changed:
+            return None
+
+        for key, series in entity.series.items():
+            series.published = properties[key]
+
+        return json.dumps({"id": entity_id, "type": "state", "properties": properties, "min": minimum, "max": maximum})
+
+
+    def _is_total(self, entity_id: str, key: str) -> bool:
+        entity = self._gateway.config.find_entity_by_id(entity_id)
+        definition = entity.properties.get(key) if entity is not None else None
+        return isinstance(definition, dict) and definition.get("unit") in _TOTAL_UNITS
@@ -5,13 +5,21 @@ import paho.mqtt.client as mqtt
 class Subscriber:
     def __init__(self) -> None:
         self.topic: str
+        self.topics: list[str] = []
         self.qos: int = 2
+        # Added to the metrics of the subscriber, e.g. its gateway
+        self.labels: dict[str, str] = {}
 
         atexit.register(self.close)
 
 
+    def get_topics(self) -> list[str]:
+        topics = [self.topic] if getattr(self, "topic", None) else []
+        return list(dict.fromkeys(topics + self.topics))
+
+
     def can_process(self, msg: mqtt.MQTTMessage) -> bool:
-        return self._is_match(msg.topic, self.topic)
+        return any(self._is_match(msg.topic, topic) for topic in self.get_topics())
 
 
     def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
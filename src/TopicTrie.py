@@ -0,0 +1,107 @@
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class _Node(Generic[T]):
+    __slots__ = ("children", "plus", "values", "hash_values")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node[T]] = {}
+        self.plus: _Node[T] | None = None
+        self.values: list[T] = []
+        self.hash_values: list[T] = []
+
+
+class TopicTrie(Generic[T]):
+    """MQTT topic filter trie.
+
+    Filters are compiled once with `add`, after which `match` routes a topic
+    in a single pass over its levels. The cost of a lookup depends on the
+    topic depth and the number of wildcard branches, not on the number of
+    registered filters.
+
+    Like `Subscriber` always did, surrounding whitespace and slashes of
+    filters and topics are ignored.
+    """
+
+    def __init__(self) -> None:
+        self._root: _Node[T] = _Node()
+        self._count = 0
+
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    def add(self, topic_filter: str, value: T) -> None:
+        node = self._root
+        levels = topic_filter.strip().strip("/").split("/")
+
+        for i, level in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    raise ValueError(f"Invalid topic filter '{topic_filter}': '#' must be the last level.")
+
+                node.hash_values.append(value)
+                self._count += 1
+                return
+
+            if level == "+":
+                if node.plus is None:
+                    node.plus = _Node()
+
+                node = node.plus
+            else:
+                if "+" in level or "#" in level:
+                    raise ValueError(f"Invalid topic filter '{topic_filter}': wildcards must occupy a whole level.")
+
+                child = node.children.get(level)
+
+                if child is None:
+                    child = node.children[level] = _Node()
+
+                node = child
+
+        node.values.append(value)
+        self._count += 1
+
+
+    def match(self, topic: str) -> list[T]:
+        """Return the values of all filters matching `topic`, without duplicates."""
+        topic = topic.strip().strip("/")
+
+        if not topic:
+            return []
+
+        levels = topic.split("/")
+        last = len(levels)
+        result: list[T] = []
+
+        # Topics starting with '$' are never matched by a leading wildcard.
+        skip_wildcards = topic[0] == "$"
+        stack: list[tuple[_Node[T], int]] = [(self._root, 0)]
+
+        while stack:
+            node, depth = stack.pop()
+
+            if not (skip_wildcards and depth == 0):
+                # 'a/#' matches 'a' as well as everything below it
+                result.extend(node.hash_values)
+
+            if depth == last:
+                result.extend(node.values)
+                continue
+
+            child = node.children.get(levels[depth])
+
+            if child is not None:
+                stack.append((child, depth + 1))
+
+            if node.plus is not None and not (skip_wildcards and depth == 0):
+                stack.append((node.plus, depth + 1))
+
+        if len(result) > 1:
+            result = list(dict.fromkeys(result))
+
+        return result
@@ -1,22 +1,47 @@
+from __future__ import annotations
+
+# First, so it can time all other imports when STARTUP_PROFILE is set
+from StartupProfiler import StartupProfiler
+
+# Before importing anything that creates Settings, it reads the environment once
 from dotenv import load_dotenv
+load_dotenv()
+
+import functools
 import logging
 from logging.handlers import RotatingFileHandler
+import os
 import paho.mqtt.client as mqtt
+import signal
+import subprocess
 import sys
+import threading
+import time
+from typing import TYPE_CHECKING
 
+from KeyedExecutor import KeyedExecutor
 from Qbha import Qbha
+from Scheduler import Scheduler
 from Settings import Settings
-from Subscribers.HomeAssistantStatusSubscriber import HomeAssistantStatusSubscriber
 from Subscribers.QbusCaptureSubscriber import QbusCaptureSubscriber
-from Subscribers.QbusConfigSubscriber import QbusConfigSubscriber
-from Subscribers.QbusControllerStateSubscriber import QbusControllerStateSubscriber
-from Subscribers.QbusEntityStateSubscriber import QbusEntityStateSubscriber
-from Subscribers.QbusGatewayStateSubscriber import QbusGatewayStateSubscriber
 from Subscribers.Subscriber import Subscriber
 
+# pydantic, the models and asyncio are only imported once qbha is connecting,
+# see create_subscribers() and run_async().
+if TYPE_CHECKING:
+    from AsyncScheduler import AsyncScheduler
+    from BulkPublisher import BulkPublisher
+    from MetricsExporter import MetricsExporter
+    from QbusGateway import QbusGateway
+    from Subscribers.LeaderElectionSubscriber import LeaderElectionSubscriber
+
 
-load_dotenv()
 settings = Settings()
+profiler = StartupProfiler()
+
+# A worker process serving one gateway of a multi gateway deployment
+suffix = f"-{settings.QbusGateway}" if settings.QbusGateway else ""
+client_id = f"qbha-{settings.Hostname}{suffix}"
 
 
 def configure_logging():
@@ -36,7 +61,7 @@ def configure_logging():
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(formatter)
 
-    file_handler = RotatingFileHandler(f"{settings.DataFolder}qbha.log", backupCount=3, maxBytes=10485760)
+    file_handler = RotatingFileHandler(f"{settings.DataFolder}qbha{suffix}.log", backupCount=3, maxBytes=10485760)
     file_handler.setLevel(settings.LogLevel)
     file_handler.setFormatter(formatter)
 
@@ -48,7 +73,7 @@ def configure_logging():
     logger.propagate = False
 
     # Specific logger for QbusCaptureSubscriber
-    capture_handler = RotatingFileHandler(f"{settings.DataFolder}qbuscapture.log", backupCount=1, maxBytes=10485760)
+    capture_handler = RotatingFileHandler(f"{settings.DataFolder}qbuscapture{suffix}.log", backupCount=1, maxBytes=10485760)
     capture_handler.setLevel(logging.DEBUG)
     capture_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
 
@@ -57,30 +82,271 @@ def configure_logging():
     QbusCaptureSubscriber._logger.propagate = False
 
 
+def create_gateways() -> list[QbusGateway]:
+    from QbusGateway import create_gateways
+
+    return create_gateways()
+
+
+def create_subscribers(mqtt_client: mqtt.Client, scheduler: Scheduler | AsyncScheduler, gateways: list[QbusGateway] | None = None) -> list[Subscriber]:
+    from BulkPublisher import BulkPublisher
+    from Subscribers.QbhaSettingsSubscriber import QbhaSettingsSubscriber
+    from Subscribers.QbusConfigSubscriber import QbusConfigSubscriber
+
+    # One connection, so one publisher paces the bulk publishes of all gateways
+    publisher = BulkPublisher(mqtt_client, scheduler)
+    subscribers: list[Subscriber] = []
+
+    for gateway in gateways if gateways is not None else create_gateways():
+        subscribers.extend(create_gateway_subscribers(mqtt_client, scheduler, publisher, gateway))
+
+    pipelines = [subscriber.pipeline for subscriber in subscribers if isinstance(subscriber, QbusConfigSubscriber)]
+    subscribers.append(QbhaSettingsSubscriber(mqtt_client, scheduler, pipelines))
+
+    return subscribers
+
+
+def create_gateway_subscribers(mqtt_client: mqtt.Client, scheduler: Scheduler | AsyncScheduler, publisher: BulkPublisher, gateway: QbusGateway) -> list[Subscriber]:
+    from GetStateService import GetStateService
+    from Subscribers.HomeAssistantDiscoverySubscriber import HomeAssistantDiscoverySubscriber
+    from Subscribers.HomeAssistantStatusSubscriber import HomeAssistantStatusSubscriber
+    from Subscribers.QbhaCommandSubscriber import QbhaCommandSubscriber
+    from Subscribers.QbusConfigSubscriber import QbusConfigSubscriber
+    from Subscribers.QbusControllerStateSubscriber import QbusControllerStateSubscriber
+    from Subscribers.QbusEntityShadowSubscriber import QbusEntityShadowSubscriber
+    from Subscribers.QbusEntityStateSubscriber import QbusEntityStateSubscriber
+    from Subscribers.QbusGaugeAggregationSubscriber import QbusGaugeAggregationSubscriber
+    from Subscribers.QbusGatewayStateSubscriber import QbusGatewayStateSubscriber
+
+    subscribers: list[Subscriber] = []
+
+    if settings.QbusCapture:
+        subscribers.append(QbusCaptureSubscriber(gateway))
+
+    # Shared by every subscriber that requests states from the gateway
+    get_state = GetStateService(mqtt_client, scheduler, gateway)
+    discovery_subscriber: HomeAssistantDiscoverySubscriber = None
+
+    if settings.DiscoveryReconcile:
+        discovery_subscriber = HomeAssistantDiscoverySubscriber(gateway)
+        subscribers.append(discovery_subscriber)
+
+    shadow_subscriber: QbusEntityShadowSubscriber = None
+
+    if settings.StateShadow:
+        shadow_subscriber = QbusEntityShadowSubscriber(gateway, scheduler, publisher)
+        subscribers.append(shadow_subscriber)
+
+    if settings.GaugeAggregation:
+        subscribers.append(QbusGaugeAggregationSubscriber(gateway, scheduler))
+
+    subscribers.extend([
+        QbhaCommandSubscriber(gateway, publisher, shadow_subscriber),
+        HomeAssistantStatusSubscriber(gateway, get_state, shadow_subscriber),
+        QbusConfigSubscriber(gateway, scheduler, get_state, publisher, discovery_subscriber),
+        QbusControllerStateSubscriber(gateway),
+        QbusEntityStateSubscriber(gateway, get_state, scheduler),
+        QbusGatewayStateSubscriber(gateway),
+    ])
+
+    return subscribers
+
+
+def create_leader_election(mqtt_client: mqtt.Client, scheduler: Scheduler | AsyncScheduler) -> LeaderElectionSubscriber | None:
+    if not settings.LeaderElection:
+        return None
+
+    from Subscribers.LeaderElectionSubscriber import LeaderElectionSubscriber
+
+    # Every gateway worker elects its own leader
+    lock_topic = f"qbha/leader/{settings.QbusGateway}" if settings.QbusGateway else "qbha/leader"
+
+    return LeaderElectionSubscriber(mqtt_client, scheduler, client_id, lock_topic)
+
+
+def create_publish_client(mqtt_client: mqtt.Client, election: LeaderElectionSubscriber | None) -> mqtt.Client:
+    if election is None:
+        return mqtt_client
+
+    from LeaderGatedClient import LeaderGatedClient
+
+    return LeaderGatedClient(mqtt_client, election)
+
+
+def refresh_on_elected(election: LeaderElectionSubscriber, publish_client: mqtt.Client, gateways: list[QbusGateway]) -> None:
+    # A new leader asks every gateway for its config. The standby processed
+    # the same configs, so the discovery messages come from its cache.
+    for gateway in gateways:
+        election.on_elected(functools.partial(publish_client.publish, gateway.topic("getConfig"), b""))
+
+
+def run_gateway_processes() -> None:
+    # Every gateway gets its own process, MQTT connection and paho loop
+    processes: list[subprocess.Popen] = []
+
+    # Terminate the workers when we are stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        for index, (name, prefix) in enumerate(settings.QbusGateways):
+            env = {**os.environ, "QBUS_GATEWAY": name, "GATEWAY_PROCESSES": "False"}
+
+            if settings.MetricsPort > 0:
+                env["METRICS_PORT"] = str(settings.MetricsPort + index)
+
+            logger.info(f"Starting worker process for gateway '{name}' ({prefix}).")
+            processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+
+        # Stop when one of the workers stops, so the deployment restarts them all
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+
+        logger.error("A gateway worker process stopped, stopping the others.")
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+        for process in processes:
+            process.wait()
+
+
+def warmup(gateways: list[QbusGateway]) -> None:
+    # Loads what the first messages need while the connection is set up
+    from QbusHelpers import get_type_adapter
+    from QbusMqttModels.QbusConfig import QbusConfig
+    from QbusMqttModels.QbusControllerState import QbusControllerState
+    from QbusMqttModels.QbusEntityState import QbusEntityState
+    from QbusMqttModels.QbusGatewayState import QbusGatewayState
+
+    with profiler.measure("warmup config"):
+        for gateway in gateways:
+            gateway.config.warmup()
+
+    with profiler.measure("warmup validators"):
+        for model in (QbusConfig, QbusControllerState, QbusEntityState, QbusGatewayState):
+            get_type_adapter(model)
+
+    profiler.mark("warmed up")
+
+
+def start_warmup(gateways: list[QbusGateway]) -> None:
+    threading.Thread(target=warmup, args=(gateways,), name="qbha-warmup", daemon=True).start()
+
+
+def start_metrics(mqtt_client: mqtt.Client, scheduler: Scheduler | AsyncScheduler) -> MetricsExporter | None:
+    if settings.MetricsPort <= 0 and settings.MetricsInterval <= 0:
+        return None
+
+    from MetricsExporter import MetricsExporter
+
+    exporter = MetricsExporter(mqtt_client, scheduler, f"qbha/metrics/{settings.QbusGateway}" if settings.QbusGateway else "qbha/metrics")
+
+    if settings.MetricsPort > 0:
+        exporter.start_http(settings.MetricsPort, settings.MetricsHost)
+
+    if settings.MetricsInterval > 0:
+        exporter.start_mqtt(settings.MetricsInterval)
+
+    return exporter
+
+
+async def run_async(mqtt_client: mqtt.Client, subscribers: list[Subscriber]) -> None:
+    import asyncio
+    from AsyncQbha import AsyncQbha
+    from AsyncScheduler import AsyncScheduler
+
+    # Timers run on the event loop, so everything shares one thread
+    scheduler = AsyncScheduler(asyncio.get_running_loop())
+    election = create_leader_election(mqtt_client, scheduler)
+    publish_client = create_publish_client(mqtt_client, election)
+    qbha = AsyncQbha(mqtt_client, [], publish_client)
+    metrics_exporter = None
+
+    try:
+        # Connect first, qbha online is queued right behind the CONNECT packet
+        run = asyncio.create_task(qbha.run())
+        await qbha.wait_connected()
+        qbha.publish_online()
+        profiler.mark("connecting")
+
+        with profiler.measure("create subscribers"):
+            gateways = create_gateways()
+
+            if election is not None:
+                subscribers.append(election)
+                # Only the leader publishes qbha online
+                election.on_elected(qbha.publish_online)
+                refresh_on_elected(election, publish_client, gateways)
+
+            subscribers.extend(create_subscribers(publish_client, scheduler, gateways))
+            qbha.add_subscribers(subscribers)
+
+        start_warmup(gateways)
+        metrics_exporter = start_metrics(mqtt_client, scheduler)
+        await run
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.close()
+
+
 if __name__ == '__main__':
     configure_logging()
     logger = logging.getLogger("qbha")
     logger.info(f"Starting QBHA {settings.Version}.")
 
+    profiler.expect("subscribed", "warmed up")
+    profiler.mark("imported")
+
     mqtt_client: mqtt.Client = None
+    scheduler: Scheduler = None
+    executor: KeyedExecutor = None
+    metrics_exporter: MetricsExporter = None
     subscribers: list[Subscriber] = []
 
     try:
-        mqtt_client = mqtt.Client(f"qbha-{settings.Hostname}")
+        if settings.GatewayProcesses and not settings.QbusGateway and len(settings.QbusGateways) > 1:
+            run_gateway_processes()
+        elif settings.Runtime == "asyncio":
+            import asyncio
 
-        if settings.QbusCapture:
-            subscribers.append(QbusCaptureSubscriber())
+            mqtt_client = mqtt.Client(client_id)
 
-        subscribers.extend([
-            HomeAssistantStatusSubscriber(),
-            QbusConfigSubscriber(),
-            QbusControllerStateSubscriber(),
-            QbusEntityStateSubscriber(mqtt_client),
-            QbusGatewayStateSubscriber(),
-        ])
+            logger.info("Using asyncio runtime.")
 
-        qbha = Qbha(mqtt_client, subscribers)
-        qbha.start()
+            if settings.WorkerThreads > 0:
+                logger.warning("WORKER_THREADS is ignored with the asyncio runtime, messages are processed on the event loop.")
+            asyncio.run(run_async(mqtt_client, subscribers))
+        else:
+            mqtt_client = mqtt.Client(client_id)
+            scheduler = Scheduler()
+
+            if settings.WorkerThreads > 0:
+                executor = KeyedExecutor(settings.WorkerThreads, settings.WorkerQueueSize, settings.WorkerBackpressure)
+
+            election = create_leader_election(mqtt_client, scheduler)
+            publish_client = create_publish_client(mqtt_client, election)
+
+            # Connect first, the subscribers are added before the network loop runs
+            qbha = Qbha(mqtt_client, [], executor, publish_client)
+            qbha.connect()
+            profiler.mark("connecting")
+
+            with profiler.measure("create subscribers"):
+                gateways = create_gateways()
+
+                if election is not None:
+                    subscribers.append(election)
+                    # Only the leader publishes qbha online
+                    election.on_elected(qbha.publish_online)
+                    refresh_on_elected(election, publish_client, gateways)
+
+                subscribers.extend(create_subscribers(publish_client, scheduler, gateways))
+                qbha.add_subscribers(subscribers)
+
+            start_warmup(gateways)
+            metrics_exporter = start_metrics(mqtt_client, scheduler)
+            qbha.loop_forever()
     except KeyboardInterrupt:
         pass
     except Exception as exception:
@@ -88,8 +354,17 @@ if __name__ == '__main__':
     finally:
         logger.info("Closing application.")
 
+        if metrics_exporter is not None:
+            metrics_exporter.close()
+
+        if executor is not None:
+            executor.close()
+
         for subscriber in subscribers:
             subscriber.close()
 
+        if scheduler is not None:
+            scheduler.close()
+
         if mqtt_client is not None:
             mqtt_client.disconnect()
@@ -0,0 +1,51 @@
+from QbusConfigIndex import QbusConfigIndex
+from QbusMqttModels.QbusConfig import QbusConfig
+
+
+def _controller(id: str, address: str, entities: list[tuple[str, str]]) -> dict:
+    return {
+        "id": id,
+        "ip": "192.168.1.10",
+        "mac": "00:0e:59:00:00:01",
+        "name": id,
+        "serialNr": "100000",
+        "type": "Qbus",
+        "version": "3.14.0",
+        "properties": {},
+        "functionBlocks": [
+            {"id": entity_id, "location": "Hal", "locationId": 0, "name": entity_id, "originalName": entity_id, "refId": f"{address}/{ref_id}", "type": "onoff", "variant": None, "actions": {}, "properties": {}}
+            for (entity_id, ref_id) in entities
+        ],
+    }
+
+
+def _index() -> QbusConfigIndex:
+    return QbusConfigIndex(QbusConfig.model_validate({
+        "app": "Qbus",
+        "version": "1.0",
+        "devices": [
+            _controller("UL1", "0001", [("UL10", "12/3"), ("UL11", "14")]),
+            _controller("UL2", "0002", [("UL20", "12/3"), ("UL21", "15")]),
+        ],
+    }))
+
+
+def test_full_ref_id_finds_the_entity_of_its_controller():
+    index = _index()
+
+    assert index.find_by_ref_id("0001/12/3")[0].id == "UL10"
+    assert index.find_by_ref_id("0002/12/3")[0].id == "UL20"
+
+
+def test_parsed_ref_id_of_several_controllers_is_not_found(caplog):
+    index = _index()
+
+    assert index.find_by_ref_id("12-3") is None
+    assert "12-3" in caplog.text
+
+
+def test_parsed_ref_id_of_one_controller_is_found():
+    index = _index()
+
+    assert index.find_by_ref_id("14")[0].id == "UL11"
+    assert index.find_by_ref_id("15")[0].id == "UL21"
@@ -0,0 +1,58 @@
+import json
+import os
+import pickle
+
+from qbus_config_generator import generate_config
+from QbusConfigService import QbusConfigService
+from QbusHelpers import get_type_adapter
+from QbusMqttModels.QbusConfig import QbusConfig
+
+
+class _Exploit:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+
+    def __reduce__(self):
+        return (os.mkdir, (self.path,))
+
+
+def _save(folder: str) -> tuple[bytes, QbusConfig]:
+    raw = json.dumps(generate_config(20, per_controller=10)).encode()
+    config = get_type_adapter(QbusConfig).validate_json(raw)
+    QbusConfigService(folder).save(raw, config)
+    return raw, config
+
+
+def test_snapshot_is_loaded(tmp_path):
+    folder = f"{tmp_path}/"
+    (_, config) = _save(folder)
+
+    assert os.path.isfile(f"{folder}qbusconfig.snapshot")
+    assert QbusConfigService(folder).load() == config
+
+
+def test_snapshot_of_other_models_is_ignored(tmp_path):
+    folder = f"{tmp_path}/"
+    (_, config) = _save(folder)
+
+    with open(f"{folder}qbusconfig.snapshot", "rb") as file:
+        (_, digest, snapshot) = pickle.load(file)
+
+    snapshot.devices.clear()
+
+    with open(f"{folder}qbusconfig.snapshot", "wb") as file:
+        pickle.dump(("0-outdated", digest, snapshot), file)
+
+    assert QbusConfigService(folder).load() == config
+
+
+def test_snapshot_only_unpickles_models(tmp_path):
+    folder = f"{tmp_path}/"
+    (_, config) = _save(folder)
+
+    with open(f"{folder}qbusconfig.snapshot", "wb") as file:
+        pickle.dump(_Exploit(f"{folder}exploited"), file)
+
+    assert QbusConfigService(folder).load() == config
+    assert not os.path.exists(f"{folder}exploited")
@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from KeyedExecutor import KeyedExecutor
+from Qbha import Qbha
+from Subscribers.Subscriber import Subscriber
+
+
+class _Recorder(Subscriber):
+    def __init__(self, topic: str) -> None:
+        super().__init__()
+        self.topic = topic
+        self.payloads: list[dict] = []
+
+
+    def process(self, client: mqtt.Client, msg: mqtt.MQTTMessage) -> None:
+        self.payloads.append(json.loads(msg.payload))
+
+
+def _message(topic: str, payload: dict) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = json.dumps(payload).encode()
+    return msg
+
+
+def test_coalesce_only_replaces_full_states():
+    executor = KeyedExecutor(1, 100, "coalesce")
+    states = _Recorder("qbus/UL1/UL10/state")
+    commands = _Recorder("qbha/command")
+    qbha = Qbha(mqtt.Client(), [states, commands], executor)
+    gate = threading.Event()
+
+    try:
+        # Holds the worker, so everything below is queued
+        executor.submit("gate", gate.wait)
+
+        for payload in (
+            {"id": "UL10", "type": "state", "properties": {"value": 1}},
+            {"id": "UL10", "type": "state", "properties": {"value": 2}},
+            {"id": "UL10", "type": "event", "properties": {"value": 3}},
+            {"id": "UL10", "type": "state", "properties": {"value": 4, "note": "event"}},
+            {"id": "UL10", "type": "state", "properties": {"value": 5, "note": "event"}},
+        ):
+            qbha._on_message(None, None, _message(states.topic, payload))
+
+        for id in ("a", "b"):
+            qbha._on_message(None, None, _message(commands.topic, {"id": id, "entities": {}}))
+
+        gate.set()
+        deadline = time.monotonic() + 5
+
+        while len(states.payloads) + len(commands.payloads) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        executor.close()
+
+    # A state with "event" in a value is still a full state
+    assert [payload["properties"]["value"] for payload in states.payloads] == [2, 3, 5]
+    assert [payload["id"] for payload in commands.payloads] == ["a", "b"]
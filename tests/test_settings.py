@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import SRC
+
+# Imports main with load_dotenv pointed at a .env file of the test, like it
+# finds the .env file next to main.py, and prints the settings it ended up with.
+_SCRIPT = """
+import json, sys
+import dotenv
+
+load_dotenv = dotenv.load_dotenv
+dotenv.load_dotenv = lambda *args, **kwargs: load_dotenv(sys.argv[1])
+
+import main
+from Settings import Settings
+
+settings = Settings()
+print(json.dumps([settings.LogLevel, settings.BinarySensors, settings.ClimateSensors, settings.DataFolder]))
+"""
+
+
+def test_main_reads_dotenv_before_settings(tmp_path):
+    data_folder = tmp_path / "data"
+    data_folder.mkdir()
+    dotenv = tmp_path / ".env"
+    dotenv.write_text(f"LOG_LEVEL=DEBUG\nBINARY_SENSORS=KETEL\nCLIMATE_SENSORS=true\nDATA_FOLDER={data_folder}\n")
+
+    env = {key: value for key, value in os.environ.items() if key not in ("LOG_LEVEL", "BINARY_SENSORS", "CLIMATE_SENSORS", "DATA_FOLDER")}
+    result = subprocess.run([sys.executable, "-c", _SCRIPT, str(dotenv)], cwd=SRC, env=env, capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stdout.splitlines()[-1]) == [10, ["KETEL"], True, f"{data_folder}/"]
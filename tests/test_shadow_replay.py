@@ -0,0 +1,69 @@
+import json
+import types
+
+import paho.mqtt.client as mqtt
+
+from Subscribers.QbusEntityShadowSubscriber import QbusEntityShadowSubscriber
+from Subscribers.QbusGaugeAggregationSubscriber import QbusGaugeAggregationSubscriber
+
+
+class _Scheduler:
+    def time(self) -> float:
+        return 0.0
+
+
+    def call_later(self, delay: float, callback, *args):
+        return types.SimpleNamespace(cancel=lambda: None)
+
+
+    def call_at(self, when: float, callback, *args):
+        return types.SimpleNamespace(cancel=lambda: None)
+
+
+class _Publisher:
+    def __init__(self) -> None:
+        self.messages: list[tuple] = []
+
+
+    def publish(self, client: mqtt.Client, messages: list[tuple]) -> None:
+        self.messages.extend(messages)
+
+
+def _gateway(data_folder: str):
+    return types.SimpleNamespace(
+        labels={},
+        data_folder=data_folder,
+        topic=lambda *parts: "/".join(("qbus",) + parts),
+        qbha_topic=lambda *parts: "/".join(("qbha",) + parts),
+        config=types.SimpleNamespace(get_entity_ids_by_type=lambda type: frozenset({"UL10"}), find_entity_by_id=lambda id: None),
+    )
+
+
+def _message(topic: str, payload: str) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = payload.encode()
+    return msg
+
+
+def test_replayed_states_are_no_new_states(tmp_path):
+    gateway = _gateway(f"{tmp_path}/")
+    publisher = _Publisher()
+    shadow = QbusEntityShadowSubscriber(gateway, _Scheduler(), publisher)
+    gauges = QbusGaugeAggregationSubscriber(gateway, _Scheduler())
+    samples = gauges._samples.value
+    state = _message("qbus/UL1/UL10/state", json.dumps({"id": "UL10", "type": "state", "properties": {"power": 10}}))
+
+    shadow.process(None, state)
+    gauges.process(None, state)
+    assert gauges._samples.value == samples + 1
+
+    shadow.republish(None, ["UL10"])
+    [(topic, payload, _, _)] = publisher.messages
+
+    # The replay comes back on the gateway topic, after the gateway reported a new state
+    shadow.process(None, _message("qbus/UL1/UL10/state", json.dumps({"id": "UL10", "type": "state", "properties": {"power": 20}})))
+    shadow.process(None, _message(topic, payload))
+    gauges.process(None, _message(topic, payload))
+
+    assert shadow.matches("UL10", {"power": 20})
+    assert gauges._samples.value == samples + 1
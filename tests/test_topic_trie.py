@@ -0,0 +1,39 @@
+from Subscribers.Subscriber import Subscriber
+from TopicTrie import TopicTrie
+
+
+def _trie(*filters: str) -> TopicTrie[str]:
+    trie: TopicTrie[str] = TopicTrie()
+
+    for topic_filter in filters:
+        trie.add(topic_filter, topic_filter)
+
+    return trie
+
+
+def test_wildcards():
+    trie = _trie("qbus/+/state", "qbus/+/+/state", "qbus/#", "homeassistant/status")
+
+    assert sorted(trie.match("qbus/UL1/state")) == ["qbus/#", "qbus/+/state"]
+    assert sorted(trie.match("qbus/UL1/UL10/state")) == ["qbus/#", "qbus/+/+/state"]
+    assert trie.match("homeassistant/status") == ["homeassistant/status"]
+    assert trie.match("homeassistant/status/x") == []
+
+
+def test_surrounding_whitespace_and_slashes_are_ignored():
+    trie = _trie("qbus/+/state", " /homeassistant/status/ ")
+
+    for topic in ("/qbus/UL1/state", "qbus/UL1/state/", " qbus/UL1/state "):
+        assert trie.match(topic) == ["qbus/+/state"]
+
+    assert trie.match("homeassistant/status") == [" /homeassistant/status/ "]
+
+
+def test_matches_like_subscriber():
+    filters = ["qbus/+/state", "qbus/+/+/state", "/qbha/command/", "a/+/c"]
+    topics = ["qbus/UL1/state", "/qbus/UL1/state/", "qbus/UL1/UL10/state", " qbha/command ", "a/b/c", "a/b/c/d", "a//c"]
+    trie = _trie(*filters)
+    subscriber = Subscriber()
+
+    for topic in topics:
+        assert sorted(trie.match(topic)) == sorted(f for f in filters if subscriber._is_match(topic, f)), topic
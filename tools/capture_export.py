@@ -0,0 +1,48 @@
+"""Export binary capture segments to the text format of qbuscapture.log.
+
+Usage:
+    python tools/capture_export.py data/ > qbuscapture.log
+    python tools/capture_export.py data/ --controller UL1 --start "2024-12-20 18:00:00" --end "2024-12-20 18:05:00"
+
+Accepts capture folders and .qcap segment files. Times are local time.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Capture.CaptureFormat import CaptureRecord  # noqa: E402
+from Capture.CaptureReader import CaptureReader  # noqa: E402
+
+
+def format_record(record: CaptureRecord) -> str:
+    # Same layout as the capture logger: '%(asctime)s %(message)s'
+    asctime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.timestamp))
+    msecs = int((record.timestamp - int(record.timestamp)) * 1000)
+    payload = record.payload.decode("utf-8", "backslashreplace").strip()
+    return f"{asctime},{msecs:03d} {record.topic} {payload}"
+
+
+def parse_time(value: str | None) -> float | None:
+    return None if value is None else datetime.fromisoformat(value).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export a binary Qbus capture to text.")
+    parser.add_argument("paths", nargs="+", help="Capture folders or .qcap files")
+    parser.add_argument("--start", help="Only export messages from this time on (ISO format)")
+    parser.add_argument("--end", help="Only export messages up to this time (ISO format)")
+    parser.add_argument("--controller", help="Only export messages of this controller")
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.paths)
+
+    for record in reader.read(parse_time(args.start), parse_time(args.end), args.controller):
+        sys.stdout.write(format_record(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
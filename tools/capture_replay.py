@@ -0,0 +1,300 @@
+"""Replay a Qbus capture through the real Qbha dispatch and subscriber stack.
+
+Reads the qbuscapture.log written with QBUS_CAPTURE=True (or a folder or
+.qcap segments of a binary capture) and feeds every
+message to Qbha, either directly with a fake MQTT client or through a local
+broker. Reports the throughput, latency percentiles per subscriber and the
+number of publishes each message produces.
+
+Usage:
+    python tools/capture_replay.py data/qbuscapture.log
+    python tools/capture_replay.py data/qbuscapture.log --speed 10
+    python tools/capture_replay.py data/qbuscapture.log --speed 0 --workers 4
+    python tools/capture_replay.py data/qbuscapture.log --broker localhost:1883
+
+--speed 1 replays at the original pace, 10 ten times faster and 0 as fast
+as possible. The Qbus config is written to a temporary data folder unless
+--data is given.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Iterator
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+sys.path.insert(0, os.path.join(_ROOT, "tools"))
+
+from Capture.CaptureFormat import SEGMENT_EXTENSION, CaptureRecord  # noqa: E402
+from Capture.CaptureReader import CaptureReader  # noqa: E402
+
+_TIMESTAMP_REGEX = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) (\S+)(?: (.*))?$")
+
+# Requests to the gateway, replaying them against a real gateway would trigger it
+_REQUEST_SUFFIXES = ("/getConfig", "/getState", "/setState")
+
+
+def read_text_capture(path: str) -> Iterator[CaptureRecord]:
+    record: list | None = None
+
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            match = _TIMESTAMP_REGEX.match(line)
+
+            if match is None:
+                # Continuation of a payload that contained new lines
+                if record is not None:
+                    record[2] += "\n" + line
+
+                continue
+
+            if record is not None:
+                yield CaptureRecord(record[0], record[1], record[2].encode("utf-8", "surrogateescape"))
+
+            timestamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S,%f").timestamp()
+            record = [timestamp, match.group(2), match.group(3) or ""]
+
+    if record is not None:
+        yield CaptureRecord(record[0], record[1], record[2].encode("utf-8", "surrogateescape"))
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    if os.path.isdir(path) or path.endswith(SEGMENT_EXTENSION):
+        return CaptureReader([path]).read()
+
+    return read_text_capture(path)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class ReplayStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.publishes_per_message: list[int] = []
+        self.dispatched = 0
+
+
+    def instrument(self, subscriber) -> None:
+        name = type(subscriber).__name__
+        process = subscriber.process
+        latencies = self.latencies.setdefault(name, [])
+
+        def timed(client, msg) -> None:
+            start = time.perf_counter()
+
+            try:
+                process(client, msg)
+            finally:
+                duration = time.perf_counter() - start
+
+                with self.lock:
+                    latencies.append(duration)
+
+        subscriber.process = timed
+
+
+    def report(self, messages: int, duration: float, publishes: int) -> dict:
+        per_message = self.publishes_per_message
+
+        return {
+            "messages": messages,
+            "dispatched": self.dispatched,
+            "duration_s": duration,
+            "messages_per_s": messages / duration if duration > 0 else 0,
+            "publishes": publishes,
+            "publishes_per_message": {
+                "mean": sum(per_message) / len(per_message) if per_message else 0,
+                "max": max(per_message) if per_message else 0,
+            },
+            "subscribers": {
+                name: {
+                    "count": len(values),
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p90_ms": percentile(values, 90) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                    "max_ms": max(values) * 1000 if values else 0,
+                }
+                for name, values in self.latencies.items()
+            },
+        }
+
+
+def print_report(report: dict) -> None:
+    print(f"messages:     {report['messages']} ({report['dispatched']} dispatched) in {report['duration_s']:.2f}s")
+    print(f"throughput:   {report['messages_per_s']:.0f} msg/s")
+    print(f"publishes:    {report['publishes']} (mean {report['publishes_per_message']['mean']:.2f}, max {report['publishes_per_message']['max']} per message)")
+    print()
+    print(f"{'subscriber':<36} {'count':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+    for name, values in report["subscribers"].items():
+        print(f"{name:<36} {values['count']:>8} {values['p50_ms']:>9.3f} {values['p90_ms']:>9.3f} {values['p99_ms']:>9.3f} {values['max_ms']:>9.3f}")
+
+
+def pace(records: list[CaptureRecord], speed: float) -> Iterator[CaptureRecord]:
+    if not records:
+        return
+
+    first = records[0].timestamp
+    start = time.monotonic()
+
+    for record in records:
+        if speed > 0:
+            delay = start + (record.timestamp - first) / speed - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        yield record
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a Qbus capture through qbha.")
+    parser.add_argument("capture", help="Path to qbuscapture.log, a binary capture folder or a .qcap segment")
+    parser.add_argument("--speed", type=float, default=0, help="Replay speed, 1 is the original pace, 0 is as fast as possible (default)")
+    parser.add_argument("--workers", type=int, default=0, help="Number of worker threads (default: dispatch inline)")
+    parser.add_argument("--broker", help="host:port of a local broker to replay through instead of the fake client")
+    parser.add_argument("--data", help="Data folder to use (default: temporary folder)")
+    parser.add_argument("--drain", type=float, default=0, help="Seconds to wait for scheduled work after the replay")
+    parser.add_argument("--all", action="store_true", help="Also replay requests sent to the gateway (getConfig, getState, setState)")
+    parser.add_argument("--json", help="Write the report as JSON to this file")
+    parser.add_argument("--log-level", default="ERROR", help="Log level of qbha during the replay (default: ERROR)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s - %(message)s")
+    logging.getLogger("qbha").setLevel(args.log_level.upper())
+
+    os.environ["DATA_FOLDER"] = args.data or tempfile.mkdtemp(prefix="qbha-replay-")
+    os.environ["QBUS_CAPTURE"] = "False"
+
+    import paho.mqtt.client as mqtt
+    from fake_mqtt_client import FakeMqttClient, create_message
+    from KeyedExecutor import KeyedExecutor
+    from main import create_subscribers
+    from Qbha import Qbha
+    from Scheduler import Scheduler
+
+    records = [
+        record for record in read_capture(args.capture)
+        if args.all or not record.topic.endswith(_REQUEST_SUFFIXES)
+    ]
+
+    stats = ReplayStats()
+    publish_count = [0]
+
+    if args.broker:
+        client = mqtt.Client(f"qbha-replay-{os.getpid()}")
+        publish = client.publish
+
+        def counting_publish(*a, **kw):
+            publish_count[0] += 1
+            return publish(*a, **kw)
+
+        client.publish = counting_publish
+    else:
+        client = FakeMqttClient()
+
+    scheduler = Scheduler()
+    executor = KeyedExecutor(args.workers, 10000) if args.workers > 0 else None
+    subscribers = create_subscribers(client, scheduler)
+
+    for subscriber in subscribers:
+        stats.instrument(subscriber)
+
+    qbha = Qbha(client, subscribers, executor)
+
+    def published() -> int:
+        return publish_count[0] if args.broker else client.publish_count
+
+    start = time.monotonic()
+
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        received = threading.Semaphore(0)
+        on_message = qbha._on_message
+
+        def counting_on_message(c, userdata, msg) -> None:
+            stats.dispatched += 1
+            on_message(c, userdata, msg)
+            received.release()
+
+        qbha._on_message = counting_on_message
+        qbha._configure_client()
+        client.connect(host, int(port or 1883), 60)
+        client.loop_start()
+        time.sleep(1)
+
+        source = mqtt.Client(f"qbha-replay-source-{os.getpid()}")
+        source.connect(host, int(port or 1883), 60)
+        source.loop_start()
+        start = time.monotonic()
+
+        for record in pace(records, args.speed):
+            source.publish(record.topic, record.payload, 0)
+
+        # Wait until every message went through qbha, or give up after a while
+        for _ in records:
+            if not received.acquire(timeout=5):
+                break
+
+        source.loop_stop()
+        source.disconnect()
+    else:
+        for record in pace(records, args.speed):
+            before = client.publish_count
+            stats.dispatched += 1
+            qbha._on_message(client, None, create_message(record.topic, record.payload))
+            stats.publishes_per_message.append(client.publish_count - before)
+
+    duration = time.monotonic() - start
+
+    if args.drain > 0:
+        time.sleep(args.drain)
+
+    if executor is not None:
+        # Wait for the queues to drain before reporting
+        while True:
+            executor_stats = executor.stats()
+
+            if executor_stats["processed"] >= executor_stats["submitted"] - executor_stats["dropped"] - executor_stats["coalesced"]:
+                break
+
+            time.sleep(0.01)
+
+        duration = time.monotonic() - start
+        executor.close()
+
+    for subscriber in subscribers:
+        subscriber.close()
+
+    scheduler.close()
+
+    if args.broker:
+        client.loop_stop()
+        client.disconnect()
+
+    report = stats.report(len(records), duration, published())
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
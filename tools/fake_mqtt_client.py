@@ -0,0 +1,44 @@
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class FakeMqttClient:
+    """Stand-in for `mqtt.Client` that records publishes instead of sending them."""
+
+    def __init__(self, keep: bool = False) -> None:
+        self.publish_count = 0
+        self.published: list[tuple[str, bytes | str | None, int, bool]] = []
+        self._keep = keep
+        self._lock = threading.Lock()
+        self._mid = 0
+
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        with self._lock:
+            self.publish_count += 1
+            self._mid += 1
+            mid = self._mid
+
+            if self._keep:
+                self.published.append((topic, payload, qos, retain))
+
+        info = mqtt.MQTTMessageInfo(mid)
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        info._set_as_published()
+        return info
+
+
+    def is_connected(self) -> bool:
+        return True
+
+
+    def subscribe(self, topic, qos: int = 0) -> tuple[int, int]:
+        return (mqtt.MQTT_ERR_SUCCESS, 0)
+
+
+def create_message(topic: str, payload: bytes, retain: bool = False) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = payload
+    msg.retain = retain
+    return msg
@@ -0,0 +1,162 @@
+"""Synthetic Qbus configs and entity states for benchmarks and the gateway simulator.
+
+The first function blocks of a config cover every supported kind of entity,
+the rest follow a mix like a typical installation. The same size and seed
+always give the same config.
+
+Usage: python tools/qbus_config_generator.py 1000 > qbusconfig.json
+"""
+import argparse
+import json
+import random
+import sys
+
+# (kind, weight): kinds are entity types, with variations that create different discovery messages
+_KINDS = [
+    ("onoff", 30),
+    ("analog", 25),
+    ("shutter_position", 8),
+    ("shutter_state", 7),
+    ("thermo", 10),
+    ("gauge_variant", 10),
+    ("gauge_properties", 3),
+    ("scene", 5),
+    ("ventilation", 2),
+]
+_GAUGE_VARIANTS = [
+    ("Power", "W"),
+    ("Energy", "kWh"),
+    ("Current", "A"),
+    ("Voltage", "V"),
+    ("Temperature", "°C"),
+    ("Water", "l"),
+    ("Volume", "l"),
+]
+_LOCATIONS = ["Living", "Keuken", "Garage", "Bureau", "Slaapkamer", "Badkamer", "Hal", "Tuin", "Zolder", "Kelder"]
+_REGIMES = ["MANUEEL", "VORST", "NACHT", "ECONOMY", "COMFORT"]
+
+
+def generate_config(function_blocks: int, per_controller: int = 250, seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    controllers = max(1, -(-function_blocks // per_controller))
+    width = len(str(per_controller))
+    kinds = [kind for (kind, _) in _KINDS]
+    weights = [weight for (_, weight) in _KINDS]
+    devices = []
+
+    for c in range(controllers):
+        count = min(per_controller, function_blocks - c * per_controller)
+        blocks = []
+
+        for i in range(count):
+            index = c * per_controller + i
+            kind = kinds[index] if index < len(kinds) else rnd.choices(kinds, weights)[0]
+            blocks.append(_create_entity(kind, f"UL{c + 1}{i + 1:0{width}d}", f"{c + 1}/{i + 1}", index))
+
+        devices.append({
+            "id": f"UL{c + 1}",
+            "ip": f"192.168.1.{10 + c % 240}",
+            "mac": f"00:0e:59:00:{c // 256:02x}:{c % 256:02x}",
+            "name": f"CTD {c + 1}",
+            "serialNr": f"{100000 + c}",
+            "type": "Qbus",
+            "version": "3.14.0",
+            "properties": {"connectable": {"type": "boolean"}, "connected": {"type": "boolean"}},
+            "functionBlocks": blocks,
+        })
+
+    return {"app": "Qbus", "version": "1.0", "devices": devices}
+
+
+def entity_state(entity: dict, rnd: random.Random, type: str = "event") -> dict:
+    """A random but valid state of an entity of a generated config.
+
+    The gateway sends an "event" when an entity changes and a "state" as
+    the answer to a getState request.
+    """
+    properties: dict = {}
+
+    match entity["type"]:
+        case "onoff":
+            properties["value"] = rnd.random() < 0.5
+        case "analog":
+            properties["value"] = rnd.randrange(101)
+        case "shutter":
+            if "state" in entity["properties"]:
+                properties["state"] = rnd.choice(["up", "down", "stop"])
+            else:
+                properties["shutterPosition"] = rnd.randrange(101)
+                properties["slatPosition"] = rnd.randrange(101)
+        case "thermo":
+            properties["currTemp"] = round(rnd.uniform(15, 24), 1)
+            properties["setTemp"] = round(rnd.uniform(15, 24) * 2) / 2
+            properties["currRegime"] = rnd.choice(_REGIMES)
+        case "gauge":
+            for key in entity["properties"]:
+                properties[key] = round(rnd.uniform(0, 5000), 3)
+        case "ventilation":
+            properties["co2"] = rnd.randrange(400, 2000)
+        case "scene":
+            return {"id": entity["id"], "type": "event", "action": "active"}
+
+    return {"id": entity["id"], "type": type, "properties": properties}
+
+
+def _create_entity(kind: str, id: str, ref_id: str, index: int) -> dict:
+    location = _LOCATIONS[index % len(_LOCATIONS)]
+    entity = {
+        "id": id,
+        "location": location,
+        "locationId": index % len(_LOCATIONS),
+        "name": f"{location} {kind.split('_')[0]} {index + 1}",
+        "originalName": f"{kind.split('_')[0]} {index + 1}",
+        "refId": ref_id,
+        "type": kind.split("_")[0],
+        "variant": None,
+        "actions": {},
+        "properties": {},
+    }
+
+    match kind:
+        case "onoff":
+            entity["properties"] = {"value": {"type": "boolean"}}
+        case "analog":
+            entity["properties"] = {"value": {"type": "number", "min": 0, "max": 100}}
+        case "shutter_position":
+            entity["properties"] = {"shutterPosition": {"type": "percentage"}, "slatPosition": {"type": "percentage"}}
+            entity["actions"] = {"shutterStop": {}}
+        case "shutter_state":
+            entity["properties"] = {"state": {"type": "enumString", "enumValues": ["up", "down", "stop"]}}
+            entity["actions"] = {"shutterStop": {}}
+        case "thermo":
+            entity["properties"] = {
+                "currRegime": {"type": "enumString", "enumValues": _REGIMES},
+                "currTemp": {"type": "number", "unit": "°C"},
+                "setTemp": {"type": "number", "unit": "°C"},
+            }
+        case "gauge_variant":
+            (variant, unit) = _GAUGE_VARIANTS[index % len(_GAUGE_VARIANTS)]
+            entity["variant"] = variant
+            entity["properties"] = {"currentValue": {"type": "number", "unit": unit}}
+        case "gauge_properties":
+            entity["properties"] = {"currentValue": {"type": "number", "unit": "W"}, "consumptionValue": {"type": "number", "unit": "kWh"}}
+        case "scene":
+            entity["actions"] = {"active": {}}
+        case "ventilation":
+            entity["properties"] = {"co2": {"type": "number", "unit": "ppm"}}
+
+    return entity
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Print a synthetic Qbus config.")
+    parser.add_argument("function_blocks", type=int)
+    parser.add_argument("--per-controller", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    json.dump(generate_config(args.function_blocks, args.per_controller, args.seed), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
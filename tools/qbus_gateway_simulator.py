@@ -0,0 +1,534 @@
+"""Simulate a Qbus MQTT gateway against a broker and measure how QBHA keeps up.
+
+The simulator takes the role of QBUSMQTTGW: it announces itself online,
+answers getConfig with a synthetic config (tools/qbus_config_generator.py)
+or a config file, answers getState for controllers and entities, applies
+setState and emits state events. Next to it, a Home Assistant like client
+watches the discovery and state topics. Start QBHA against the same broker
+(it does not matter whether before or after the simulator) and run:
+
+    python tools/qbus_gateway_simulator.py --function-blocks 1000 --rate 200
+
+The scenarios run in order and each one is reported:
+
+    discovery   time from the config to all discovery messages and entity state requests
+    events      state events at --rate per second with a --pattern, their delivery
+                latency and how long QBHA takes to refresh thermostats
+    commands    setState round trips like Home Assistant sends them, and a bulk
+                command on qbha/command
+    birth       a Home Assistant birth message and how long until every entity
+                has a state again
+
+The broker is not part of the simulator, use e.g. mosquitto or the broker
+QBHA already uses.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from capture_replay import percentile  # noqa: E402
+from qbus_config_generator import entity_state, generate_config  # noqa: E402
+
+_DEFAULT_PREFIX = "cloudapp/QBUSMQTTGW"
+_SCENARIOS = ("discovery", "events", "commands", "birth")
+_PATTERNS = ("uniform", "burst", "hotspot", "thermo")
+
+_logger = logging.getLogger("qbha.simulator")
+
+
+def latency_summary(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000 if values else 0,
+    }
+
+
+class QbusGatewaySimulator:
+    """The gateway side: answers QBHA's requests and emits events."""
+
+    def __init__(self, client: mqtt.Client, prefix: str, config: dict, seed: int) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.config = config
+        self.lock = threading.Lock()
+        self.rnd = random.Random(seed)
+        self.controllers: dict[str, dict] = {controller["id"]: controller for controller in config["devices"]}
+        # entity id -> (controller id, entity)
+        self.entities: dict[str, tuple[str, dict]] = {
+            entity["id"]: (controller["id"], entity)
+            for controller in config["devices"]
+            for entity in controller["functionBlocks"]
+        }
+        self.states: dict[str, dict] = {id: entity_state(entity, self.rnd, "state") for id, (_, entity) in self.entities.items()}
+
+        self.config_requests: list[float] = []
+        self.config_published_at: float | None = None
+        # entity or controller id -> times it was requested
+        self.state_requests: dict[str, list[float]] = {}
+        self.set_states: list[tuple[float, str]] = []
+        self.on_get_state = None
+
+        client.message_callback_add(f"{prefix}/getConfig", self._on_get_config)
+        client.message_callback_add(f"{prefix}/getState", self._on_get_state)
+        client.message_callback_add(f"{prefix}/+/+/setState", self._on_set_state)
+
+
+    def subscribe(self) -> None:
+        self.client.subscribe([(f"{self.prefix}/getConfig", 0), (f"{self.prefix}/getState", 0), (f"{self.prefix}/+/+/setState", 1)])
+
+
+    def announce(self) -> None:
+        # Retained like the real gateway, QBHA asks for the config when it sees it
+        self.client.publish(f"{self.prefix}/state", json.dumps({"id": "QBUSMQTTGW", "online": True}), 0, True)
+
+
+    def publish_config(self) -> None:
+        with self.lock:
+            self.config_published_at = time.monotonic()
+
+        self.client.publish(f"{self.prefix}/config", json.dumps(self.config), 1)
+
+
+    def emit_event(self, entity_id: str) -> tuple[str, bytes]:
+        (controller_id, entity) = self.entities[entity_id]
+        state = entity_state(entity, self.rnd)
+
+        with self.lock:
+            if "properties" in state:
+                self.states[entity_id]["properties"].update(state["properties"])
+
+        topic = f"{self.prefix}/{controller_id}/{entity_id}/state"
+        payload = json.dumps(state).encode()
+        self.client.publish(topic, payload)
+
+        return (topic, payload)
+
+
+    def _on_get_config(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        with self.lock:
+            self.config_requests.append(time.monotonic())
+
+        self.publish_config()
+
+
+    def _on_get_state(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        now = time.monotonic()
+
+        try:
+            ids = json.loads(msg.payload)
+        except ValueError:
+            return
+
+        messages = []
+
+        with self.lock:
+            for id in ids if isinstance(ids, list) else []:
+                self.state_requests.setdefault(id, []).append(now)
+
+                if id in self.controllers:
+                    state = {"id": id, "type": "state", "properties": {"connectable": True, "connected": True}}
+                    messages.append((f"{self.prefix}/{id}/state", json.dumps(state)))
+                elif id in self.entities:
+                    messages.append((f"{self.prefix}/{self.entities[id][0]}/{id}/state", json.dumps(self.states[id])))
+
+        for (topic, payload) in messages:
+            client.publish(topic, payload)
+
+        if self.on_get_state is not None:
+            self.on_get_state(now, ids)
+
+
+    def _on_set_state(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        entity_id = msg.topic.split("/")[-2]
+
+        try:
+            command = json.loads(msg.payload)
+        except ValueError:
+            return
+
+        if entity_id not in self.entities or not isinstance(command, dict):
+            return
+
+        with self.lock:
+            self.set_states.append((time.monotonic(), entity_id))
+            state = self.states[entity_id]
+
+            if command.get("type") == "action":
+                event = {"id": entity_id, "type": "event", "action": command.get("action")}
+            else:
+                state["properties"].update(command.get("properties") or {})
+                event = {"id": entity_id, "type": "event", "properties": dict(state["properties"])}
+
+        client.publish(f"{self.prefix}/{self.entities[entity_id][0]}/{entity_id}/state", json.dumps(event))
+
+
+class HomeAssistantProbe:
+    """The Home Assistant side: records discovery and state messages as they arrive."""
+
+    def __init__(self, client: mqtt.Client, prefix: str) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.discovery: list[tuple[float, str, bool]] = []
+        self.states: list[tuple[float, str, bytes]] = []
+        self.gauges: list[float] = []
+        self.command_results: list[tuple[float, dict]] = []
+        self.on_state = None
+
+        client.message_callback_add("homeassistant/+/+/config", self._on_discovery)
+        client.message_callback_add(f"{prefix}/+/+/state", self._on_state)
+        client.message_callback_add("qbha/gauge/#", self._on_gauge)
+        client.message_callback_add("qbha/command/result", self._on_command_result)
+
+
+    def subscribe(self) -> None:
+        self.client.subscribe([("homeassistant/+/+/config", 0), (f"{self.prefix}/+/+/state", 0), ("qbha/gauge/#", 0), ("qbha/command/result", 1)])
+
+
+    def _on_discovery(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        with self.lock:
+            self.discovery.append((time.monotonic(), msg.topic, len(msg.payload) > 0))
+
+
+    def _on_state(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        now = time.monotonic()
+
+        with self.lock:
+            self.states.append((now, msg.topic, msg.payload))
+
+        if self.on_state is not None:
+            self.on_state(now, msg.topic, msg.payload)
+
+
+    def _on_gauge(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        with self.lock:
+            self.gauges.append(time.monotonic())
+
+
+    def _on_command_result(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        with self.lock:
+            self.command_results.append((time.monotonic(), json.loads(msg.payload)))
+
+
+def wait_until_quiet(messages: list[tuple], lock: threading.Lock, since: float, settle: float, timeout: float) -> None:
+    # Until something arrived after `since` and then nothing for `settle` seconds
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        with lock:
+            last = messages[-1][0] if messages else 0.0
+
+        if last >= since and time.monotonic() - last >= settle:
+            return
+
+        time.sleep(0.05)
+
+
+def run_discovery(gateway: QbusGatewaySimulator, probe: HomeAssistantProbe, args) -> dict:
+    gateway.announce()
+    deadline = time.monotonic() + args.timeout
+
+    # QBHA asks for the config when it sees the gateway online, push it if it is already past that
+    while not gateway.config_requests and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    if not gateway.config_requests:
+        _logger.warning("No getConfig received, publishing the config anyway.")
+        gateway.publish_config()
+
+    started = gateway.config_published_at
+    wait_until_quiet(probe.discovery, probe.lock, started, args.settle, args.timeout)
+
+    # QBHA requests the entity states a moment after the last discovery message
+    deadline = time.monotonic() + args.settle + 3
+
+    while time.monotonic() < deadline and any(id not in gateway.state_requests for id in gateway.entities):
+        time.sleep(0.05)
+
+    requested = [id for id in gateway.entities if id in gateway.state_requests]
+
+    with probe.lock:
+        discovery = [(at, topic, added) for (at, topic, added) in probe.discovery if at >= started]
+
+    with gateway.lock:
+        requested_at = [min(gateway.state_requests[id]) for id in requested]
+
+    return {
+        "entities": len(gateway.entities),
+        "config_requests": len(gateway.config_requests),
+        "discovery_messages": len(discovery),
+        "discovery_removed": sum(1 for (_, _, added) in discovery if not added),
+        "first_discovery_s": discovery[0][0] - started if discovery else None,
+        "all_discovery_s": discovery[-1][0] - started if discovery else None,
+        "entities_state_requested": len(requested),
+        "all_states_requested_s": max(requested_at) - started if requested_at else None,
+    }
+
+
+def run_events(gateway: QbusGatewaySimulator, probe: HomeAssistantProbe, args) -> dict:
+    entity_ids = list(gateway.entities)
+    thermostats = [id for id, (_, entity) in gateway.entities.items() if entity["type"] == "thermo"]
+    hotspot = entity_ids[:max(1, len(entity_ids) // 20)]
+    pending: dict[tuple[str, bytes], list[float]] = {}
+    delivery: list[float] = []
+    # thermostat id -> time of its first event that was not refreshed yet
+    thermo_pending: dict[str, float] = {}
+    thermo_refresh: list[float] = []
+    lock = threading.Lock()
+
+    def on_state(now: float, topic: str, payload: bytes) -> None:
+        with lock:
+            sent = pending.get((topic, payload))
+
+            if sent:
+                delivery.append(now - sent.pop(0))
+
+    def on_get_state(now: float, ids: list) -> None:
+        with lock:
+            for id in ids:
+                if id in thermo_pending:
+                    thermo_refresh.append(now - thermo_pending.pop(id))
+
+    def pick() -> str:
+        match args.pattern:
+            case "hotspot":
+                return gateway.rnd.choice(hotspot) if gateway.rnd.random() < 0.8 else gateway.rnd.choice(entity_ids)
+            case "thermo":
+                return gateway.rnd.choice(thermostats or entity_ids)
+            case _:
+                return gateway.rnd.choice(entity_ids)
+
+    probe.on_state = on_state
+    gateway.on_get_state = on_get_state
+    gauges_before = len(probe.gauges)
+    sent = 0
+    started = time.monotonic()
+    end = started + args.duration
+
+    # Bursts send a second of events at once, the other patterns spread them evenly
+    batch = max(1, int(args.rate)) if args.pattern == "burst" else 1
+
+    while time.monotonic() < end:
+        for _ in range(batch):
+            entity_id = pick()
+            now = time.monotonic()
+            (topic, payload) = gateway.emit_event(entity_id)
+            sent += 1
+
+            with lock:
+                pending.setdefault((topic, payload), []).append(now)
+
+                if entity_id in thermostats:
+                    thermo_pending.setdefault(entity_id, now)
+
+        time.sleep(max(0.0, started + sent / args.rate - time.monotonic()))
+
+    elapsed = time.monotonic() - started
+    # QBHA debounces thermostats, wait for the last refreshes
+    time.sleep(args.settle + 3)
+    probe.on_state = None
+    gateway.on_get_state = None
+
+    with lock:
+        return {
+            "pattern": args.pattern,
+            "events": sent,
+            "events_per_s": sent / elapsed if elapsed > 0 else 0,
+            "delivery": latency_summary(delivery),
+            "lost": sent - len(delivery),
+            "thermostat_refresh": latency_summary(thermo_refresh),
+            "thermostats_not_refreshed": len(thermo_pending),
+            "aggregated_gauge_states": len(probe.gauges) - gauges_before,
+        }
+
+
+def run_commands(gateway: QbusGatewaySimulator, probe: HomeAssistantProbe, args) -> dict:
+    targets = [id for id, (_, entity) in gateway.entities.items() if entity["type"] in ("onoff", "analog")][:args.commands]
+    waiting: dict[str, float] = {}
+    round_trips: list[float] = []
+    lock = threading.Lock()
+
+    def on_state(now: float, topic: str, payload: bytes) -> None:
+        entity_id = topic.split("/")[-2]
+
+        with lock:
+            if entity_id in waiting and b'"event"' in payload:
+                round_trips.append(now - waiting.pop(entity_id))
+
+    probe.on_state = on_state
+
+    # Like Home Assistant: straight to the gateway, one at a time
+    for entity_id in targets:
+        (controller_id, entity) = gateway.entities[entity_id]
+        value = gateway.rnd.random() < 0.5 if entity["type"] == "onoff" else gateway.rnd.randrange(101)
+
+        with lock:
+            waiting[entity_id] = time.monotonic()
+
+        probe.client.publish(f"{gateway.prefix}/{controller_id}/{entity_id}/setState", json.dumps({"id": entity_id, "type": "state", "properties": {"value": value}}))
+        time.sleep(1 / args.rate)
+
+    time.sleep(args.settle)
+    probe.on_state = None
+
+    # A bulk command through QBHA for every on/off entity of a location
+    location = next((entity["location"] for (_, entity) in gateway.entities.values() if entity["type"] == "onoff"), None)
+    bulk: dict = {}
+
+    if location is not None:
+        with gateway.lock:
+            set_states_before = len(gateway.set_states)
+
+        with probe.lock:
+            results_before = len(probe.command_results)
+
+        started = time.monotonic()
+        command = {"id": "simulator", "group": location, "type": "onoff", "properties": {"value": True}, "force": True}
+        probe.client.publish("qbha/command", json.dumps(command), 1)
+        deadline = started + args.timeout
+
+        while len(probe.command_results) <= results_before and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        with gateway.lock:
+            received = gateway.set_states[set_states_before:]
+
+        with probe.lock:
+            result = probe.command_results[results_before][1] if len(probe.command_results) > results_before else None
+
+        bulk = {
+            "location": location,
+            "set_states_received": len(received),
+            "first_set_state_s": received[0][0] - started if received else None,
+            "last_set_state_s": received[-1][0] - started if received else None,
+            "result": result,
+        }
+
+    with lock:
+        return {
+            "commands": len(targets),
+            "round_trip": latency_summary(round_trips),
+            "unanswered": len(waiting),
+            "bulk": bulk,
+        }
+
+
+def run_birth(gateway: QbusGatewaySimulator, probe: HomeAssistantProbe, args) -> dict:
+    with probe.lock:
+        states_before = len(probe.states)
+
+    with gateway.lock:
+        requests_before = sum(len(times) for times in gateway.state_requests.values())
+
+    started = time.monotonic()
+    probe.client.publish("homeassistant/status", "online")
+    wait_until_quiet(probe.states, probe.lock, started, args.settle, args.timeout)
+
+    with probe.lock:
+        states = probe.states[states_before:]
+
+    with gateway.lock:
+        requested = sum(len(times) for times in gateway.state_requests.values()) - requests_before
+
+    # When every entity had a state again
+    covered: set[str] = set()
+    all_states_s = None
+
+    for (at, topic, _) in states:
+        covered.add(topic.split("/")[-2])
+
+        if all_states_s is None and len(covered.intersection(gateway.entities)) == len(gateway.entities):
+            all_states_s = at - started
+
+    return {
+        "state_messages": len(states),
+        "ids_requested_from_gateway": requested,
+        "entities_with_state": len(covered.intersection(gateway.entities)),
+        "all_states_s": all_states_s,
+    }
+
+
+def create_client(name: str, args) -> mqtt.Client:
+    client = mqtt.Client(f"{name}-{os.getpid()}")
+
+    if args.user:
+        client.username_pw_set(args.user, args.password)
+
+    host, _, port = args.broker.partition(":")
+    client.connect(host, int(port or 1883), 60)
+    client.loop_start()
+
+    return client
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate a Qbus MQTT gateway and measure QBHA.")
+    parser.add_argument("--broker", default="localhost:1883", help="host:port of the MQTT broker QBHA uses.")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--prefix", default=_DEFAULT_PREFIX, help="Topic prefix of the simulated gateway.")
+    parser.add_argument("--function-blocks", type=int, default=100, help="Size of the generated config.")
+    parser.add_argument("--per-controller", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", help="Qbus config JSON to serve instead of a generated one.")
+    parser.add_argument("--scenarios", default=",".join(_SCENARIOS), help=f"Comma separated, from {', '.join(_SCENARIOS)}.")
+    parser.add_argument("--rate", type=float, default=50, help="Events (and Home Assistant commands) per second.")
+    parser.add_argument("--pattern", choices=_PATTERNS, default="uniform", help="uniform, burst (a second of events at once), hotspot (80%% to 5%% of the entities) or thermo (thermostats only).")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to emit events.")
+    parser.add_argument("--commands", type=int, default=50, help="Number of Home Assistant commands.")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds without new messages before a scenario is done.")
+    parser.add_argument("--timeout", type=float, default=60, help="Maximum seconds to wait for QBHA in a scenario.")
+    parser.add_argument("--output", help="Write the report to this JSON file.")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=args.log_level.upper())
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario in _SCENARIOS]
+
+    if args.config:
+        with open(args.config, "r") as file:
+            config = json.load(file)
+    else:
+        config = generate_config(args.function_blocks, args.per_controller, args.seed)
+
+    gateway = QbusGatewaySimulator(create_client("qbus-simulator", args), args.prefix, config, args.seed)
+    probe = HomeAssistantProbe(create_client("ha-probe", args), args.prefix)
+    gateway.subscribe()
+    probe.subscribe()
+    time.sleep(0.5)
+
+    report: dict = {"prefix": args.prefix, "entities": len(gateway.entities), "controllers": len(gateway.controllers)}
+    runners = {"discovery": run_discovery, "events": run_events, "commands": run_commands, "birth": run_birth}
+
+    try:
+        for scenario in scenarios:
+            _logger.info(f"Running {scenario}.")
+            report[scenario] = runners[scenario](gateway, probe, args)
+            print(f"{scenario}: {json.dumps(report[scenario], indent=2)}")
+    finally:
+        # Do not leave the simulated gateway online for the next run
+        gateway.client.publish(f"{args.prefix}/state", b"", 0, True).wait_for_publish()
+
+        for client in (gateway.client, probe.client):
+            client.loop_stop()
+            client.disconnect()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()